@@ -1,4 +1,18 @@
 #!/bin/sh
 
-# connect to aurora / mysql through ssh tunnel
-mysql --host=127.0.0.1 --port=3306 --user=billybob  --password
+# connect to aurora / mysql through ssh tunnel, see ssh_tunnel_ar.sh
+#
+# --direct connects to the cluster endpoint from the stack outputs cached
+# by cfn.py instead, the cluster is private so only from inside the vpc,
+# for example on the bastion.  One list_stacks call checks the cache, the
+# stack is described only when it changed, see cfn_outputs.py
+HOST=127.0.0.1
+if [ "$1" = "--direct" ]; then
+    STACK=${OWNER}-${AWS_DEFAULT_PROFILE}-ar
+    ENV_FILE=~/.aws/cfn_cache/${STACK}.env
+    python cfn_outputs.py --stacks ${STACK} > /dev/null || exit 1
+    . "${ENV_FILE}"
+    HOST=${EndPointAddress}
+fi
+
+mysql --host=${HOST} --port=3306 --user=billybob  --password
@@ -0,0 +1,199 @@
+'''aws_clients.py
+
+shared boto3 sessions and clients for every script
+
+sessions are cached per profile and clients per session, service, region
+and endpoint, so a script makes each client once however many functions
+or threads ask for it.  Sessions and clients are created under one lock,
+boto3 sessions are not thread safe, the clients themselves are.
+
+every client uses the botocore adaptive retry mode, which retries throttled
+calls with backoff and slows its own send rate once throttled.  That rate is
+per client, so calls of all clients of a service also share one token
+bucket per process, DEFAULT_CALLS_PER_SECOND calls a second with bursts of the same
+size.  Every attempt takes a token, retries included.  Set
+AWS_CALLS_PER_SECOND to change the default rate, 0 turns the bucket off.
+
+sessions made here are traced when aws_trace.py tracing is on.  boto3 is
+imported in the functions that use it, see bench_startup.py
+
+Example:
+    import aws_clients
+
+    ec2 = aws_clients.client('ec2')
+    cfn = aws_clients.client('cloudformation', profile='prod')
+    instance = aws_clients.resource('ec2').Instance(instance_id)
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import time
+import logging
+import threading
+
+import aws_trace
+
+# default calls a second per service for the whole process, AWS_CALLS_PER_SECOND overrides it
+DEFAULT_CALLS_PER_SECOND = 10.0
+# set by set_rate, None to read AWS_CALLS_PER_SECOND when the first bucket is made
+CALLS_PER_SECOND = None
+# attempts of one call with adaptive retries, the first one included
+MAX_ATTEMPTS = 10
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+_buckets = {}
+_rates = {}
+
+
+class TokenBucket(object):
+    '''block callers so that at most rate calls a second pass, bursts up to capacity
+
+    Args:
+        rate (float): tokens added a second
+        capacity (float): most tokens held, defaults to rate
+    '''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''take one token, waiting for it if the bucket is empty
+
+        Returns:
+            seconds waited
+        '''
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+def set_rate(rate, service=None):
+    '''calls a second of one service, or the default of every service, 0 for no limit
+
+    takes effect for buckets made from now on, set it before the first call
+    '''
+    global CALLS_PER_SECOND
+    with _lock:
+        if service is None:
+            CALLS_PER_SECOND = float(rate)
+        else:
+            _rates[service] = float(rate)
+
+
+def default_rate():
+    '''calls a second of services without a rate of their own
+
+    AWS_CALLS_PER_SECOND is read here and not at import, a malformed value is
+    logged and the default used instead of failing every script at import
+    '''
+    if CALLS_PER_SECOND is not None:
+        return CALLS_PER_SECOND
+    value = os.getenv('AWS_CALLS_PER_SECOND')
+    if value is None:
+        return DEFAULT_CALLS_PER_SECOND
+    try:
+        return float(value)
+    except ValueError:
+        logging.getLogger(__file__).warning('AWS_CALLS_PER_SECOND={0!r} is not a number, using {1}'.format(
+            value, DEFAULT_CALLS_PER_SECOND))
+        return DEFAULT_CALLS_PER_SECOND
+
+
+def bucket(service):
+    '''token bucket shared by every client of a service, None when not limited'''
+    with _lock:
+        if service not in _buckets:
+            rate = _rates.get(service, default_rate())
+            _buckets[service] = TokenBucket(rate) if rate > 0 else None
+        return _buckets[service]
+
+
+def _throttle(event_name, **kwargs):
+    # before-send.{service}.{operation} fires for every attempt.  Returning
+    # None lets the request go out, anything else would replace the response
+    limiter = bucket(event_name.split('.')[1])
+    if limiter is not None:
+        limiter.acquire()
+
+
+def _prepare(session):
+    '''register the token bucket and tracing on a session, both are idempotent'''
+    aws_trace.session_events(session).register('before-send', _throttle, unique_id='aws_clients.throttle')
+    aws_trace.instrument(session)
+    return session
+
+
+def session(profile=None):
+    '''cached boto3 session of a profile, None for the boto3 default session
+
+    the default session is looked up every time, so boto3.setup_default_session
+    still replaces it
+    '''
+    import boto3
+
+    with _lock:
+        if profile is None:
+            if boto3.DEFAULT_SESSION is None:
+                boto3.setup_default_session()
+            return _prepare(boto3.DEFAULT_SESSION)
+        if profile not in _sessions:
+            _sessions[profile] = _prepare(boto3.Session(profile_name=profile))
+        return _sessions[profile]
+
+
+def config():
+    '''botocore Config with adaptive retries'''
+    from botocore.config import Config
+    return Config(retries={'mode': 'adaptive', 'max_attempts': MAX_ATTEMPTS})
+
+
+def client(service, profile=None, region=None, endpoint_url=None, boto_session=None):
+    '''cached client with adaptive retries and the shared token bucket
+
+    Args:
+        service (String): for example cloudformation
+        profile (String): aws profile, None for the default session
+        region (String): region, None for the region of the profile
+        endpoint_url (String): endpoint other than the aws one, for example a local s3
+        boto_session (boto3.Session): session to use instead of the one of profile
+    '''
+    boto_session = boto_session or session(profile)
+    key = (id(boto_session), service, region, endpoint_url)
+    with _lock:
+        # the session is kept in the value, so its id is not reused while cached
+        if key not in _clients or _clients[key][0] is not boto_session:
+            _prepare(boto_session)
+            _clients[key] = (boto_session, boto_session.client(service, region_name=region,
+                                                               endpoint_url=endpoint_url, config=config()))
+        return _clients[key][1]
+
+
+def resource(service, profile=None, region=None, boto_session=None):
+    '''resource with the same retries and token bucket as client, not cached'''
+    boto_session = boto_session or session(profile)
+    with _lock:
+        _prepare(boto_session)
+        return boto_session.resource(service, region_name=region, config=config())
+
+
+def clear():
+    '''forget cached sessions and clients, for example after switching credentials'''
+    with _lock:
+        _sessions.clear()
+        _clients.clear()
@@ -0,0 +1,200 @@
+'''aws_trace.py
+
+record every aws api call made through boto3
+
+handlers on the botocore event system record the service, operation,
+latency, retries, throttles and error of each call as one json line and
+keep totals per operation.  Latency is measured around the whole call,
+retries and their sleeps included.  A summary table is printed when the
+process exits.  A handler never raises, a failure to trace is logged and
+the call goes on as if tracing was off.
+
+boto3 is not imported here, tracing is started from main after argument
+parsing.  Clients copy the handlers of their session when created, so
+start tracing before any client is made.  Sessions other than the boto3
+default session are added with instrument.
+
+Example:
+    import aws_trace
+
+    if args.trace:
+        aws_trace.start(args.trace)
+    ...
+    aws_trace.instrument(boto3.Session(profile_name='other'))
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+import json
+import time
+import atexit
+import logging
+import functools
+import threading
+from collections import defaultdict
+
+THROTTLE_CODES = (
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'SlowDown', 'RequestThrottled',
+    'ProvisionedThroughputExceededException', 'BandwidthLimitExceeded',
+)
+
+_CONTEXT_KEY = 'aws_trace'
+_tracer = None
+
+
+def _error_code(response):
+    '''error code of a parsed response, None on success'''
+    return (response or {}).get('Error', {}).get('Code')
+
+
+def _never_raise(handler):
+    '''log instead of raising, an exception in a handler would replace the result of the call'''
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            handler(*args, **kwargs)
+        except Exception:
+            logging.getLogger(__file__).debug('aws_trace {0} failed'.format(handler.__name__), exc_info=True)
+    return wrapper
+
+
+class Tracer(object):
+    '''collect api call records and write them as json lines
+
+    Args:
+        path (String): json lines file, truncated at start, None to only summarize
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.totals = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'max': 0.0,
+                                           'retries': 0, 'throttles': 0, 'errors': 0})
+        self.trace_file = open(path, 'w') if path else None
+
+    @_never_raise
+    def before_call(self, model, context, **kwargs):
+        # after-call-error has no model, keep the names for it
+        context[_CONTEXT_KEY] = {'start': time.time(), 'throttles': 0,
+                                 'service': model.service_model.service_name, 'operation': model.name}
+
+    @_never_raise
+    def needs_retry(self, response, request_dict, **kwargs):
+        # response is (http response, parsed) of an attempt, None when the connection failed
+        state = request_dict.get('context', {}).get(_CONTEXT_KEY)
+        if state is not None and response is not None and _error_code(response[1]) in THROTTLE_CODES:
+            state['throttles'] += 1
+
+    @_never_raise
+    def after_call(self, context, parsed=None, exception=None, **kwargs):
+        state = context.get(_CONTEXT_KEY)
+        if state is None:
+            return
+        metadata = (parsed or {}).get('ResponseMetadata', {})
+        error = _error_code(parsed) or (type(exception).__name__ if exception is not None else None)
+        record = {
+            'time': round(state['start'], 3),
+            'service': state['service'],
+            'operation': state['operation'],
+            'seconds': round(time.time() - state['start'], 4),
+            'retries': metadata.get('RetryAttempts', 0),
+            'throttles': state['throttles'],
+            'status': metadata.get('HTTPStatusCode'),
+            'error': error,
+            'thread': threading.current_thread().name,
+        }
+        self.record(record)
+
+    @_never_raise
+    def after_call_error(self, context, exception=None, **kwargs):
+        # botocore passes only context and exception, for example on a connection error
+        self.after_call(context, exception=exception)
+
+    def record(self, record):
+        '''add one call record'''
+        with self.lock:
+            total = self.totals[(record['service'], record['operation'])]
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            total['max'] = max(total['max'], record['seconds'])
+            total['retries'] += record['retries']
+            total['throttles'] += record['throttles']
+            total['errors'] += 1 if record['error'] else 0
+            if self.trace_file:
+                self.trace_file.write(json.dumps(record, sort_keys=True) + '\n')
+                self.trace_file.flush()
+
+    def register(self, events):
+        '''register the handlers on a botocore event emitter'''
+        events.register('before-call', self.before_call, unique_id='aws_trace.before_call')
+        events.register('needs-retry', self.needs_retry, unique_id='aws_trace.needs_retry')
+        events.register('after-call', self.after_call, unique_id='aws_trace.after_call')
+        events.register('after-call-error', self.after_call_error, unique_id='aws_trace.after_call_error')
+
+    def summary(self):
+        '''table of calls per operation, slowest total first'''
+        with self.lock:
+            items = sorted(self.totals.items(), key=lambda x: -x[1]['seconds'])
+        rows = [('service', 'operation', 'calls', 'seconds', 'max', 'retries', 'throttles', 'errors')]
+        for (service, operation), x in items:
+            rows.append((service, operation, str(x['calls']), '{0:.2f}'.format(x['seconds']),
+                         '{0:.2f}'.format(x['max']), str(x['retries']), str(x['throttles']), str(x['errors'])))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = ['  '.join(x.ljust(w) for x, w in zip(row, widths)).rstrip() for row in rows]
+        lines.append('{0} calls, {1:.2f}s in api calls, {2:.2f}s wall clock'.format(
+            sum(x['calls'] for _, x in items), sum(x['seconds'] for _, x in items), time.time() - self.started))
+        return '\n'.join(lines)
+
+    def close(self):
+        '''print the summary to stderr and close the trace file'''
+        sys.stderr.write(self.summary() + '\n')
+        if self.trace_file:
+            self.trace_file.close()
+            self.trace_file = None
+            sys.stderr.write('api call trace written to {0}\n'.format(self.path))
+
+
+def session_events(session):
+    '''event emitter of a boto3 or botocore session'''
+    session = getattr(session, '_session', session)
+    return session.get_component('event_emitter')
+
+
+def instrument(session):
+    '''trace the clients a session creates from now on, nothing if tracing is off
+
+    Args:
+        session: boto3.Session or botocore session
+    '''
+    if _tracer is not None:
+        _tracer.register(session_events(session))
+    return session
+
+
+def start(path=None):
+    '''start tracing the boto3 default session, summary is printed at exit
+
+    Args:
+        path (String): json lines file for every call, None for only the summary
+
+    Returns:
+        Tracer
+    '''
+    global _tracer
+    import boto3
+
+    if _tracer is None:
+        _tracer = Tracer(path)
+        atexit.register(_tracer.close)
+    if boto3.DEFAULT_SESSION is None:
+        boto3.setup_default_session()
+    instrument(boto3.DEFAULT_SESSION)
+    return _tracer
+
+
+def enabled():
+    '''True once start was called'''
+    return _tracer is not None
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+'''bench_offline.py
+
+offline benchmark of the deploy, render, script generation and keypair paths
+
+cfn.py, ssh_create_scripts.py and manage_keypair.py run end to end, each
+in a fresh interpreter with its own argument parsing and config loading,
+against a moto server, an in memory stand in for aws, so no network or
+credentials are needed.  AWS_ENDPOINT_URL points every boto3 client of
+the scripts at the server.  A throw away HOME, aws config and working
+directory keep the real ~/.ssh, ~/.aws caches and generated scripts
+untouched.  Each run starts with an empty moto account, creates the bucket
+and uploads the templates, then runs in order
+
+    render          cfn.build_param_dict for every stack type, --renders times,
+                    in process since it makes no aws calls
+    create          cfn.py --create for DEPLOY_TYPES, moto can not deploy rs and ar
+    update          cfn.py --update for UPDATE_TYPES with another PRODUCT, so
+                    every stack has a parameter to change
+    generate        ssh_create_scripts.py
+    keypair create  manage_keypair.py -c for --keypairs keys
+    keypair import  manage_keypair.py -c --generate rsa for --keypairs more keys
+    keypair rotate  manage_keypair.py -r for the created keys
+    keypair audit   manage_keypair.py --audit of every key, all imported rsa
+                    keys by now, which moto fingerprints the way ec2 does, so
+                    a mismatch fails the scenario
+    keypair delete  manage_keypair.py -d for every key
+    delete          cfn.py --delete for DELETE_TYPES, moto can not delete vpc
+
+the scripts record their aws api calls with --trace, see aws_trace.py.  The
+gate compares the calls per operation, the largest count over --runs, with
+bench_baseline.json and fails when a scenario makes more calls of any
+operation than its baseline.  Call counts do not depend on the speed of the
+machine, wall time does, so the median wall time is only reported.
+--update-baseline stores the current results as the new baseline.
+Scenarios that moto can not run are reported as FAILED with the error, they
+fail the gate unless their baseline failed too, a scenario without a
+baseline fails the gate when it fails.
+
+needs the packages of requirements-dev.txt, openssl and ssh-keygen
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ python bench_offline.py [-v] [--runs 3] [--update-baseline]
+
+'''
+from __future__ import absolute_import, division, print_function
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import Counter
+from os.path import abspath, dirname, isfile, join
+
+REPO_DIR = dirname(abspath(__file__))
+BASELINE_FILE = join(REPO_DIR, 'bench_baseline.json')
+BUCKET = 'cfn-bench'
+PROFILE = 'bench'
+REGION = 'us-west-2'
+PASSWORD = 'Bench1234Password'
+# stack types moto can deploy, it has no cloudformation support for
+# AWS::RDS::DBCluster and no Endpoint attribute for AWS::Redshift::Cluster
+DEPLOY_TYPES = ['vpc', 'sg', 'role', 'ec2']
+# moto deletes the vpc of vpc.yaml before its subnets and fails, the vpc
+# stack is left for the next run's fresh moto account
+DELETE_TYPES = ['sg', 'role', 'ec2']
+# moto can not update the bastion of ec2.yaml, its Fn::GetAtt Bastion.PublicIp
+# output fails on update
+UPDATE_TYPES = ['vpc', 'sg', 'role']
+TRACE_FILE = 'bench_trace.jsonl'
+
+
+def isolate(work_dir, endpoint_url):
+    '''point HOME, aws config, credentials and the environment the scripts need at work_dir
+
+    must run before the repo modules are imported, they resolve ~ at import
+    '''
+    home = join(work_dir, 'home')
+    os.makedirs(join(home, '.ssh'))
+    os.makedirs(join(home, '.aws'))
+    with open(join(home, '.aws', 'config'), 'w') as f:
+        f.write('[profile {0}]\nregion = {1}\n'.format(PROFILE, REGION))
+    with open(join(home, '.aws', 'credentials'), 'w') as f:
+        f.write('[{0}]\naws_access_key_id = testing\naws_secret_access_key = testing\n'.format(PROFILE))
+    # the database passwords users keep in ~/.aws/etc, see cfn_config.py
+    os.makedirs(join(home, '.aws', 'etc'))
+    for type_of_stack in ['rs', 'ar']:
+        with open(join(home, '.aws', 'etc', '{0}_cfg.yaml'.format(type_of_stack)), 'w') as f:
+            f.write("{{Password: '{0}'}}\n".format(PASSWORD))
+    for envvar in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN', 'AWS_PROFILE']:
+        os.environ.pop(envvar, None)
+    os.environ.update({
+        'HOME': home,
+        'AWS_CONFIG_FILE': join(home, '.aws', 'config'),
+        'AWS_SHARED_CREDENTIALS_FILE': join(home, '.aws', 'credentials'),
+        'AWS_DEFAULT_PROFILE': PROFILE,
+        'AWS_DEFAULT_REGION': REGION,
+        'AWS_ENDPOINT_URL': endpoint_url,
+        'OWNER': 'bench',
+        'PRODUCT': 'bench',
+        'S3BUCKET': BUCKET,
+        # moto has no api quota, the aws_clients.py token bucket would only hide regressions
+        'AWS_CALLS_PER_SECOND': '0',
+    })
+    os.chdir(work_dir)
+
+
+def scenarios(renders, keypairs):
+    '''(name, arguments, environment) of every scenario in run order
+
+    arguments are the command line of a repo script, or a function for the
+    scenarios that run in process, environment the variables to override
+    '''
+    import cfn
+    from cfn_template import template_types
+
+    types = template_types()
+    keynames = ','.join('bench-key-{0}'.format(x) for x in range(keypairs))
+    imported = ','.join('bench-imported-{0}'.format(x) for x in range(keypairs))
+    deploy = ','.join(DEPLOY_TYPES)
+
+    def render():
+        for _ in range(renders):
+            for type_of_stack in types:
+                cfn.build_param_dict(type_of_stack)
+
+    return [
+        ('render', render, None),
+        ('create', ['cfn.py', '--types', deploy, '--create'], None),
+        ('update', ['cfn.py', '--types', ','.join(UPDATE_TYPES), '--update'], {'PRODUCT': 'bench-update'}),
+        ('generate', ['ssh_create_scripts.py'], None),
+        ('keypair create', ['manage_keypair.py', '-c', '-k', keynames], None),
+        ('keypair import', ['manage_keypair.py', '-c', '--generate', 'rsa', '-k', imported], None),
+        ('keypair rotate', ['manage_keypair.py', '-r', '-k', keynames], None),
+        ('keypair audit', ['manage_keypair.py', '--audit', '-k', keynames + ',' + imported], None),
+        ('keypair delete', ['manage_keypair.py', '-d', '-k', keynames + ',' + imported], None),
+        ('delete', ['cfn.py', '--types', ','.join(DELETE_TYPES), '--delete'], None),
+    ]
+
+
+def assign_public_ip():
+    '''give the bastion of ec2.yaml a public ip
+
+    moto launches AWS::EC2::Instance without the MapPublicIpOnLaunch of its
+    subnet, so the ec2 stack would have no PublicIP output.  An elastic ip
+    stands in for it, allocated from the benchmark, outside of the traced
+    scripts.  The outputs cfn.py cached for the stack lack the ip and are
+    dropped
+    '''
+    import boto3
+    import cfn_outputs
+
+    session = boto3.Session()
+    stack_name = 'bench-{0}-ec2'.format(PROFILE)
+    resources = session.client('cloudformation').describe_stack_resources(
+        StackName=stack_name, LogicalResourceId='Bastion')['StackResources']
+    ec2 = session.client('ec2')
+    for resource in resources:
+        allocation = ec2.allocate_address(Domain='vpc')
+        ec2.associate_address(AllocationId=allocation['AllocationId'],
+                              InstanceId=resource['PhysicalResourceId'])
+    cache = cfn_outputs.read_cache()
+    if cache.pop(stack_name, None) is not None:
+        cfn_outputs.write_cache(cache)
+
+
+def run_script(arguments, environment=None):
+    '''run a repo script with --trace in a fresh interpreter
+
+    Returns:
+        Counter of 'service.operation' to the number of calls
+    '''
+    log = logging.getLogger(__file__)
+    if isfile(TRACE_FILE):
+        os.remove(TRACE_FILE)
+    command = [sys.executable, join(REPO_DIR, arguments[0])] + arguments[1:] + ['--trace', TRACE_FILE]
+    env = dict(os.environ, **(environment or {}))
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0].decode('utf-8', 'replace')
+    log.debug(output)
+    if process.returncode != 0:
+        # the last exception line, the trace summary is printed after it
+        errors = [x for x in output.splitlines() if re.match(r'^[\w.]+(Error|Exception): ', x)]
+        raise RuntimeError('{0} exited with {1}: {2}'.format(
+            arguments[0], process.returncode, errors[-1] if errors else output.strip()[-200:]))
+    calls = Counter()
+    if isfile(TRACE_FILE):
+        with open(TRACE_FILE) as f:
+            for line in f:
+                record = json.loads(line)
+                calls['{0}.{1}'.format(record['service'], record['operation'])] += 1
+    return calls
+
+
+def run_once(endpoint_url, renders, keypairs):
+    '''one pass over every scenario against an empty moto account
+
+    Returns:
+        dict of scenario name to {'seconds': ..., 'calls': {operation: count}, 'error': ...}
+    '''
+    import boto3
+    from cfn_template import template_types
+    from upload_templates import upload_templates
+    import requests
+
+    log = logging.getLogger(__file__)
+    # the moto server keeps its state between runs
+    requests.post(endpoint_url + '/moto-api/reset').raise_for_status()
+    boto3.setup_default_session()
+    boto3.client('s3').create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+    upload_templates(template_types(), BUCKET)
+
+    results = {}
+    for name, scenario, environment in scenarios(renders, keypairs):
+        start = time.time()
+        calls = Counter()
+        error = None
+        try:
+            if callable(scenario):
+                scenario()
+            else:
+                calls = run_script(scenario, environment)
+            if name == 'create':
+                assign_public_ip()
+        except Exception as err:
+            log.debug('{0} failed'.format(name), exc_info=True)
+            error = '{0}: {1}'.format(type(err).__name__, err)
+        results[name] = {
+            'seconds': time.time() - start,
+            'calls': dict(calls),
+            'error': error,
+        }
+        log.debug('{0}: {1}'.format(name, results[name]))
+    return results
+
+
+def merge_results(runs):
+    '''median seconds and the largest count of every operation of every scenario over several runs'''
+    merged = {}
+    for name in runs[0]:
+        seconds = sorted(x[name]['seconds'] for x in runs)
+        calls = Counter()
+        for run in runs:
+            calls |= Counter(run[name]['calls'])
+        merged[name] = {
+            'seconds': round(seconds[len(seconds) // 2], 4),
+            'calls': dict(calls),
+            'error': next((x[name]['error'] for x in runs if x[name]['error']), None),
+        }
+    return merged
+
+
+def compare(results, baseline):
+    '''regressions of results against baseline
+
+    Returns:
+        list of (scenario, message)
+    '''
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if result['error'] and not (base or {}).get('error'):
+            regressions.append((name, 'failed: {0}'.format(result['error'])))
+            continue
+        if base is None or result['error']:
+            continue
+        for operation, calls in sorted(result['calls'].items()):
+            if calls > base['calls'].get(operation, 0):
+                regressions.append((name, '{0} {1} calls, baseline {2}'.format(
+                    operation, calls, base['calls'].get(operation, 0))))
+    return regressions
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    parser = argparse.ArgumentParser(description='offline benchmark against moto with a regression gate')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('-r', '--runs', type=int, default=3,
+                        help='runs of every scenario, the median wall time is reported')
+    parser.add_argument('--renders', type=int, default=20,
+                        help='build_param_dict passes over every stack type in the render scenario')
+    parser.add_argument('--keypairs', type=int, default=10,
+                        help='keypairs in the keypair scenarios')
+    parser.add_argument('-b', '--baseline', default=BASELINE_FILE,
+                        help='baseline json file')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store these results as the new baseline')
+    args = parser.parse_args()
+
+    if args.verbose >= 1:
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    baseline = {}
+    if isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+    server.start()
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix='bench_offline')
+    sys.path.insert(0, REPO_DIR)
+    try:
+        isolate(work_dir, 'http://{0}:{1}'.format(*server.get_host_and_port()))
+        runs = [run_once(os.environ['AWS_ENDPOINT_URL'], args.renders, args.keypairs) for _ in range(args.runs)]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        server.stop()
+    results = merge_results(runs)
+
+    for name, result in sorted(results.items(), key=lambda x: -x[1]['seconds']):
+        base = baseline.get(name, {})
+        log.info('{0:16} {1:8.3f}s {2:5d} calls   baseline {3} {4}'.format(
+            name, result['seconds'], sum(result['calls'].values()),
+            '{0:.3f}s {1:d} calls'.format(base['seconds'], sum(base['calls'].values())) if base else 'none',
+            'FAILED {0}'.format(result['error']) if result['error'] else ''))
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        log.info('wrote {0}'.format(args.baseline))
+        return
+
+    regressions = compare(results, baseline)
+    if regressions:
+        for name, message in regressions:
+            log.error('REGRESSION: {0} {1}'.format(name, message))
+        sys.exit(1)
+    log.info('no regressions against {0}'.format(args.baseline))
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+'''bench_startup.py
+
+cold start benchmark for cfn.py
+
+runs cfn.py in fresh interpreters for the paths that end before any aws
+work: --help, an argument error and missing environment variables.
+Fails when
+    * boto3, botocore, pystache, yaml or cfn_manage is imported on one of these paths
+    * median startup is more than --budget milliseconds slower than a bare interpreter
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ python bench_startup.py [-v] [--runs 10] [--budget 100]
+
+'''
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import logging
+import argparse
+import platform
+import subprocess
+from os.path import abspath, dirname, join
+
+CFN = join(dirname(abspath(__file__)), 'cfn.py')
+
+HEAVY_MODULES = ['boto3', 'botocore', 'pystache', 'yaml', 'cfn_manage']
+
+SCENARIOS = [
+    ('help', [CFN, '--help']),
+    ('argument error', [CFN]),
+    ('missing env vars', [CFN, '--create', '--type_of_stack', 'vpc']),
+]
+
+
+def clean_env():
+    '''environment without the variables cfn.py requires'''
+    env = dict(os.environ)
+    for envvar in ['S3BUCKET', 'AWS_DEFAULT_PROFILE', 'OWNER', 'PRODUCT']:
+        env.pop(envvar, None)
+    return env
+
+
+def time_command(args, runs):
+    '''median wall time in milliseconds of running python with args'''
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.call([sys.executable] + args, env=clean_env(),
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def heavy_imports(args):
+    '''heavy top level modules imported when running python with args'''
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime'] + args, env=clean_env(),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    _, stderr = proc.communicate()
+    found = set()
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and line.count('|') == 2:
+            module = line.split('|')[2].strip().split('.')[0]
+            if module in HEAVY_MODULES:
+                found.add(module)
+    return sorted(found)
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    parser = argparse.ArgumentParser(description='cold start benchmark for cfn.py')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('-r', '--runs', type=int, default=10,
+                        help='runs per scenario, the median is reported')
+    parser.add_argument('-b', '--budget', type=float, default=100.0,
+                        help='allowed milliseconds over a bare interpreter start')
+    args = parser.parse_args()
+
+    if args.verbose >= 1:
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    baseline = time_command(['-c', 'pass'], args.runs)
+    log.info('bare interpreter start: {0:.1f} ms'.format(baseline))
+
+    failures = []
+    for name, command in SCENARIOS:
+        median = time_command(command, args.runs)
+        overhead = median - baseline
+        heavy = heavy_imports(command)
+        log.info('{0}: {1:.1f} ms ({2:+.1f} ms over interpreter) heavy imports: {3}'.format(
+            name, median, overhead, heavy or 'none'))
+        if heavy:
+            failures.append('{0} imports {1}'.format(name, heavy))
+        if overhead > args.budget:
+            failures.append('{0} took {1:.1f} ms over interpreter start, budget is {2:.1f} ms'.format(
+                name, overhead, args.budget))
+
+    if failures:
+        for failure in failures:
+            log.error('REGRESSION: {0}'.format(failure))
+        sys.exit(1)
+    log.info('startup within budget')
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
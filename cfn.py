@@ -5,10 +5,18 @@ manage cloudformation stacks
 
 Example:
     $ cfn.py [-vvv] [-c|-u|-d] -t type
+    $ cfn.py [-vvv] [-c|-u|-d] --types vpc,sg,rs
+    $ cfn.py [-vvv] [-c|-u|-d] --all
+    $ cfn.py [-vvv] --drift --all [--targets mwest:lab,mwest:prod]
+    $ cfn.py [-vvv] -c --types rs,ar --restore-latest
+    $ cfn.py [-vvv] -c -t rs --snapshot mwest-lab-rs-20170502
 
     --create  create stack
     --update  update stack
     --delete  delete stack
+    --drift   detect drift of the stacks, all at once, and print one report
+              of every drifted resource, see cfn_drift.py.  Fails if any
+              stack drifted.  Works with --targets.
 
     --type_of_stack  type of stack
         * vpc
@@ -19,11 +27,69 @@ Example:
         * mysql
         * ec2
 
+    --types  comma separated list of stack types
+    --all    every stack type with a template in this directory
+
+    with --types or --all stacks are ordered by the Export / Fn::ImportValue
+    references in their templates and independent stacks run concurrently,
+    for example rs and ar deploy at the same time once vpc, sg and role are done.
+    --delete runs in reverse order.  --jobs limits the number of concurrent stacks.
+
+    --change-set  with --update, build a change set and print a resource level diff
+                  instead of calling update_stack.  Returns at once if nothing changed.
+    --execute     with --change-set, execute a non empty change set
+
+    --no-inline  always deploy from the template uploaded to S3BUCKET.  By default
+                 templates that fit the 51200 byte TemplateBody limit once minified
+                 to json are sent inline and only larger ones use the s3 url, see
+                 cfn_template.template_body.  The url is the content hash key of the
+                 local template, uploaded first when it is missing
+
+    --follow  log stack events while the stacks are created, updated or deleted,
+              one tailer follows every selected stack, see stack_events.py
+
+    --fail-fast  with --create or --update, watch the stack events and stop at the
+                 first resource that reaches a *_FAILED status instead of waiting
+                 for the rollback.  An update is cancelled with cancel_update_stack,
+                 a create is deleted, the resource and its reason are logged and
+                 the script fails at once.  Stack events are logged as with --follow.
+                 Other stacks of --types or --all that are already running finish,
+                 stacks that depend on the failed one are skipped.
+
+    --restore-latest  with --create, restore the selected rs and ar stacks from the
+                      newest snapshot of any cluster the stack had, see cfn_snapshots.py.
+                      With --types rs,ar both are looked up and restored concurrently.
+    --snapshot ID     with --create, restore the one selected rs or ar stack from ID.
+                      The snapshot is passed to etc/{type}_cfg.yaml as
+                      {{SnapshotIdentifier}} for rs and {{DBSnapshotName}} for ar.
+
+    --targets  comma separated owner:profile pairs, for example mwest:lab,mwest:prod
+               runs the same action in every target concurrently, each target with
+               its own boto3 session, and prints a summary table.
+               OWNER and AWS_DEFAULT_PROFILE are not required.
+               --target-jobs limits the number of concurrent targets.
+
+    aws clients are shared per profile and use adaptive retries and a token
+    bucket per service, AWS_CALLS_PER_SECOND, default 10, so concurrent
+    stacks and targets slow down instead of failing on Throttling, see aws_clients.py
+
+    --trace [FILE]  record every aws api call to FILE as json lines, default
+                    aws_trace.jsonl, and print a summary per operation at exit,
+                    see aws_trace.py
+
     call with optional -v argument
     -v will enable debug mode for this script
     -vv will enable debug mode for this script and cfn_manage namespace
     -vvv will enable debug output from everywhere
 
+    after every create or update the stack outputs are written to
+    ~/.aws/cfn_cache/outputs.json and ~/.aws/cfn_cache/{stack name}.env for
+    connect scripts and generators, see cfn_outputs.py
+
+    stack parameters come from the environment and the config files
+    etc/{type}_cfg.yaml, etc/{profile}/{type}_cfg.yaml, ~/.aws/etc/{type}_cfg.yaml
+    and ~/.aws/etc/{profile}/{type}_cfg.yaml, later files win, see cfn_config.py
+
     TODO:
         * pass stack name parameter
 
@@ -32,16 +98,17 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import os
 import sys
-import yaml
-import boto3
 import logging
 import argparse
 import platform
-import pystache
-from os.path import expanduser, abspath, dirname, isfile, join
-# cfn_manage comes from my github project
-# https://github.com/quagly/cfn-manage
-from cfn_manage.cloudformation import CfnStack
+from collections import namedtuple
+
+import aws_trace
+import aws_clients
+
+# boto3, pystache and yaml are imported in the functions that use them.
+# importing boto3 costs more than most runs that fail argument or environment
+# validation, see bench_startup.py which fails if one of them sneaks back in here
 
 
 def validate_env_vars(expected):
@@ -69,6 +136,8 @@ def validate_env_vars(expected):
 def read_config(config_file, **kwargs):
     '''read config file {stack_type}_cfg.yaml from directory config_dir
 
+    rendering is cached by file mtime and kwargs, see cfn_config.py
+
     Args:
         config_file (String):  absolute path to configuration file to read
         **kwargs:  additional parameters to substitue in config file template
@@ -76,19 +145,411 @@ def read_config(config_file, **kwargs):
     Returns:
         dict of config
     '''
+    from cfn_config import read_config as read_cached_config
+
     log = logging.getLogger(__file__)
     log.debug('BEGIN read_config')
-    log.info('configuration file is: {0}'.format(config_file))
-    # note that pystache can use search paths to find templates
-    # is that better than passing in the absolute path to the template file?
-    renderer = pystache.Renderer()
-    yaml_string = renderer.render_path(config_file, kwargs)
-    log.debug('post mustache template process yaml is: {0}'.format(yaml_string))
-    config = yaml.safe_load(yaml_string)
+    config = read_cached_config(config_file, **kwargs)
     log.debug('END read_config')
     return config
 
 
+# owner and profile a stack belongs to.  session is None for the default
+# boto3 session, fan out targets each get their own session
+Target = namedtuple('Target', ['owner', 'profile', 'session'])
+
+
+def default_target():
+    '''target of the current OWNER and AWS_DEFAULT_PROFILE using the default session'''
+    return Target(os.getenv('OWNER'), os.getenv('AWS_DEFAULT_PROFILE'), None)
+
+
+def parse_targets(value):
+    '''parse owner:profile,owner:profile into targets with one boto3 session per profile
+
+    sessions are cached per profile by aws_clients.py and shared by every
+    stack of the target and every target of the profile
+    '''
+    targets = []
+    for item in [x.strip() for x in value.split(',') if x.strip()]:
+        if ':' not in item:
+            raise ValueError('target must be owner:profile, got: {0}'.format(item))
+        owner, profile = item.split(':', 1)
+        targets.append(Target(owner, profile, aws_clients.session(profile)))
+    return targets
+
+
+def cloudformation_client(target):
+    '''shared cloudformation client of the target session, or of the default session'''
+    return aws_clients.client('cloudformation', boto_session=target.session)
+
+
+def stack_name_for(type_of_stack, target=None):
+    '''stack name {OWNER}-{AWS_DEFAULT_PROFILE}-{type}'''
+    target = target or default_target()
+    return '{0}-{1}-{2}'.format(target.owner, target.profile, type_of_stack)
+
+
+def build_param_dict(type_of_stack, target=None, context=None, inline=True):
+    '''build CfnStack parameters for a stack type from the environment
+    and the config layers of the type, see cfn_config.py
+
+    Args:
+        type_of_stack (String): type of stack, for example vpc
+        target (Target): owner and profile, defaults to the environment
+        context (dict): extra values for the config file templates, for example
+            {'SnapshotIdentifier': ...} to restore rs from a snapshot
+        inline (bool): pass the minified local template as template_body when
+            it fits, instead of the s3 template_url
+
+    Returns:
+        dict of CfnStack parameters
+    '''
+    from cfn_config import resolve_config
+
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN build_param_dict')
+    target = target or default_target()
+
+    stack_name = stack_name_for(type_of_stack, target)
+    log.info('stack name is: {0}'.format(stack_name))
+
+    param_dict = {
+        'name': stack_name,
+        'Environment': target.profile,
+        'Owner': target.owner,
+        'Product': os.getenv('PRODUCT'),
+    }
+
+    body = None
+    if inline:
+        from cfn_template import template_body
+        body = template_body(type_of_stack)
+    if body is not None:
+        log.info('template body is inline: {0} bytes'.format(len(body.encode('utf-8'))))
+        param_dict['template_body'] = body
+    else:
+        param_dict['template_url'] = template_url(type_of_stack, target)
+
+    # data to pass to config file templates
+    config_dict = {
+        'Environment': target.profile,
+        'Owner': target.owner,
+        'S3BucketHome': os.getenv('S3BUCKET'),
+    }
+    config_dict.update(context or {})
+
+    # etc/ defaults, per profile overlays and ~/.aws/etc secrets, see cfn_config.py
+    config = resolve_config(type_of_stack, config_dict, target.profile)
+    log.debug('configuration dict is: {0}'.format(config))
+    # merge configs
+    param_dict.update(config)
+
+    # a snapshot to restore wins over every config layer, users keep an empty
+    # SnapshotIdentifier in ~/.aws/etc which would otherwise create an empty cluster
+    from cfn_snapshots import PARAMETERS
+    parameter = PARAMETERS.get(type_of_stack)
+    if parameter and (context or {}).get(parameter):
+        if config.get(parameter) != context[parameter]:
+            log.info('{0} {1} replaces {2!r} from the config files'.format(
+                parameter, context[parameter], config.get(parameter)))
+        param_dict[parameter] = context[parameter]
+
+    log.debug('END build_param_dict')
+    return param_dict
+
+
+def template_url(type_of_stack, target=None):
+    '''s3 url of the content hash key of the local template of a stack type
+
+    the template is uploaded first when the key is missing, see
+    upload_templates.ensure_template
+    '''
+    from upload_templates import ensure_template
+
+    log = logging.getLogger(__file__)
+    target = target or default_target()
+    url = ensure_template(type_of_stack, os.getenv('S3BUCKET'),
+                          client=aws_clients.client('s3', boto_session=target.session))
+    log.info('template url is: {0}'.format(url))
+    return url
+
+
+def _run_action(param_dict, action, change_set, execute, target):
+    '''create, update or delete a stack from its CfnStack parameters
+
+    the api is called through cfn_api with the shared client of the target,
+    see aws_clients.py.  CfnStack from cfn_manage built plain clients from
+    the default session, without adaptive retries or the token bucket and
+    not safe to create from several stack threads at once
+    '''
+    if action == 'update' and change_set:
+        from cfn_changeset import update_with_change_set
+        update_with_change_set(cloudformation_client(target), param_dict, execute=execute)
+        return
+
+    from cfn_api import run_stack_action
+    run_stack_action(cloudformation_client(target), action, param_dict)
+
+
+def abort_stack(client, action, stack_name):
+    '''cancel an update or delete a stack whose create failed, without waiting
+
+    a failure is logged, the stack may already be rolling back on its own
+    '''
+    from botocore.exceptions import ClientError
+
+    log = logging.getLogger(__file__)
+    try:
+        if action == 'update':
+            client.cancel_update_stack(StackName=stack_name)
+            log.info('cancelled update of {0}'.format(stack_name))
+        else:
+            client.delete_stack(StackName=stack_name)
+            log.info('deleting {0}'.format(stack_name))
+    except ClientError:
+        log.exception('could not abort {0} of {1}'.format(action, stack_name))
+
+
+def _run_fail_fast(param_dict, action, target, max_delay=10.0):
+    '''create or update a stack and abort it at the first resource failure
+
+    events are followed in the foreground while the operation runs, the
+    first *_FAILED resource event stops following, see stack_events.py
+    '''
+    import threading
+    from cfn_api import start_stack_action
+    from stack_events import StackEventTailer, format_event, is_failure, is_resource_failure
+
+    log = logging.getLogger(__file__)
+    client = cloudformation_client(target)
+    stack_name = param_dict['name']
+    failures = []
+    stop = threading.Event()
+
+    def on_event(_, event):
+        if not failures and is_resource_failure(event):
+            failures.append(event)
+            stop.set()
+
+    tailer = StackEventTailer(client, [stack_name], wait_for_new=True, on_event=on_event)
+    tailer.prime()
+    start_stack_action(client, action, param_dict)
+    status = tailer.follow(stop=stop, max_delay=max_delay)[stack_name]
+    if failures:
+        log.error('FAILED: {0}'.format(format_event(failures[0])))
+        abort_stack(client, action, stack_name)
+        raise RuntimeError('{0} {1} failed at {2}: {3}'.format(
+            action, stack_name, failures[0]['LogicalResourceId'], failures[0].get('ResourceStatusReason', '')))
+    if is_failure(status):
+        raise RuntimeError('{0} {1} ended with status {2}'.format(action, stack_name, status))
+    log.info('{0} {1} complete'.format(action, stack_name))
+
+
+def cache_outputs(stack_name, action, target):
+    '''refresh the local outputs cache and env file of a stack after an action
+
+    connect scripts and generators read them instead of calling aws, see cfn_outputs.py
+    a failure is logged, the stack action itself succeeded
+    '''
+    import cfn_outputs
+
+    log = logging.getLogger(__file__)
+    try:
+        if action == 'delete':
+            cfn_outputs.forget([stack_name])
+        else:
+            cfn_outputs.refresh([stack_name], cloudformation_client(target))
+            log.info('outputs of {0} cached in {1}'.format(stack_name, cfn_outputs.env_file(stack_name)))
+    except Exception:
+        log.exception('could not cache outputs of {0}'.format(stack_name))
+
+
+def snapshot_context(type_of_stack, snapshot):
+    '''render context restoring a stack type from a snapshot, None without a snapshot'''
+    if not snapshot:
+        return None
+    from cfn_snapshots import PARAMETERS
+    return {PARAMETERS[type_of_stack]: snapshot}
+
+
+def find_snapshots(types, restore_latest=False, snapshot=None):
+    '''snapshot to restore for each selected rs and ar stack
+
+    Args:
+        types (list): selected stack types, only those in cfn_snapshots.PARAMETERS are restored
+        restore_latest (bool): look up the newest snapshot of every such stack
+        snapshot (String): snapshot identifier, needs exactly one such stack
+
+    Returns:
+        dict of stack type to snapshot identifier
+    '''
+    from cfn_snapshots import INDEXES, PARAMETERS, find_latest
+
+    restorable = [x for x in types if x in PARAMETERS]
+    if not restorable:
+        raise ValueError('none of {0} can be restored from a snapshot, only {1}'.format(types, sorted(PARAMETERS)))
+    if snapshot:
+        if len(restorable) != 1:
+            raise ValueError('--snapshot needs exactly one of {0}, got {1}'.format(sorted(PARAMETERS), restorable))
+        return {restorable[0]: snapshot}
+    if not restore_latest:
+        return {}
+
+    # both services are listed concurrently with shared clients, see aws_clients.py
+    clients = dict((INDEXES[x][0], aws_clients.client(INDEXES[x][0])) for x in restorable)
+    return find_latest(dict((x, stack_name_for(x)) for x in restorable), clients)
+
+
+def run_stack(type_of_stack, action, change_set=False, execute=False, follow=False, target=None, context=None,
+              inline=True, fail_fast=False):
+    '''create, update or delete the stack of one type
+
+    Args:
+        type_of_stack (String): type of stack, for example vpc
+        action (String): one of create, update, delete
+        change_set (bool): update through a change set, see cfn_changeset.py
+        execute (bool): execute the change set if it is not empty
+        follow (bool): log stack events while the action runs
+        target (Target): owner and profile, defaults to the environment
+        context (dict): extra values for the config file templates
+        inline (bool): send the template inline when it fits, see build_param_dict
+        fail_fast (bool): abort a create or update at the first resource failure,
+            events are always logged
+    '''
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN run_stack')
+    target = target or default_target()
+    param_dict = build_param_dict(type_of_stack, target, context, inline)
+    log.debug('parameters are: {0}'.format(dict((k, v) for k, v in param_dict.items() if k != 'template_body')))
+
+    if fail_fast and action in ('create', 'update') and not change_set:
+        _run_fail_fast(param_dict, action, target)
+    elif follow:
+        from stack_events import follow_events, is_failure
+        with follow_events(cloudformation_client(target), [param_dict['name']]) as tailer:
+            _run_action(param_dict, action, change_set, execute, target)
+        status = tailer.statuses[param_dict['name']]
+        if status is not None and is_failure(status):
+            raise RuntimeError('{0} {1} ended with status {2}'.format(action, param_dict['name'], status))
+    else:
+        _run_action(param_dict, action, change_set, execute, target)
+    if not change_set or execute:
+        cache_outputs(param_dict['name'], action, target)
+    log.debug('END run_stack')
+
+
+def run_stacks(types, action, max_workers=None, follow=False, target=None, snapshots=None, **kwargs):
+    '''run an action on several stack types in dependency order
+
+    stacks whose dependencies are done run concurrently.
+    delete runs dependents first.
+
+    Args:
+        types (list): stack types, for example ['vpc', 'sg', 'rs']
+        action (String): one of create, update, delete
+        max_workers (int): maximum number of stacks to run at once
+        follow (bool): log events of every stack with one multiplexed tailer
+        target (Target): owner and profile, defaults to the environment
+        snapshots (dict): stack type to snapshot identifier to restore from, see cfn_snapshots.py
+        **kwargs: passed to run_stack
+    '''
+    from cfn_graph import build_dependencies, reverse_dependencies, run_graph
+
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN run_stacks')
+    target = target or default_target()
+    dependencies = build_dependencies(types)
+    if action == 'delete':
+        dependencies = reverse_dependencies(dependencies)
+
+    # create the shared client up front in this thread, every stack thread calls the api with it
+    cloudformation_client(target)
+
+    def run(type_of_stack):
+        run_stack(type_of_stack, action, target=target,
+                  context=snapshot_context(type_of_stack, (snapshots or {}).get(type_of_stack)), **kwargs)
+
+    if follow and not (kwargs.get('fail_fast') and action in ('create', 'update')):
+        # fail fast stacks log their own events
+        from stack_events import follow_events
+        with follow_events(cloudformation_client(target), [stack_name_for(x, target) for x in types]):
+            status = run_graph(dependencies, run, max_workers)
+    else:
+        status = run_graph(dependencies, run, max_workers)
+
+    for type_of_stack in sorted(status):
+        log.info('{0} {1}: {2}'.format(action, type_of_stack, status[type_of_stack]))
+    failed = sorted(x for x in status if status[x] != 'COMPLETE')
+    if failed:
+        raise RuntimeError('{0} did not complete for: {1}'.format(action, failed))
+    log.debug('END run_stacks')
+
+
+def drift_stacks(types, targets=None):
+    '''detect drift of every stack of every target concurrently
+
+    Args:
+        types (list): stack types, for example ['vpc', 'sg', 'rs']
+        targets (list): Target list, defaults to the environment
+
+    Returns:
+        list of report lines, and True if any stack drifted or could not be checked
+    '''
+    from cfn_drift import detect_drift, format_drift
+
+    targets = targets or [default_target()]
+    # one client per target, created here in the main thread
+    clients = [cloudformation_client(x) for x in targets]
+    stacks = [(client, stack_name_for(x, target)) for target, client in zip(targets, clients) for x in types]
+    results = detect_drift(stacks)
+    failed = any(x['status'] in ('DRIFTED', 'DETECTION_FAILED', 'UNKNOWN') for x in results.values())
+    return format_drift(results), failed
+
+
+def run_targets(targets, types, action, max_workers=None, **kwargs):
+    '''run the same action for several owner / profile targets concurrently
+
+    Args:
+        targets (list): Target for every environment
+        types (list): stack types to run in each target
+        action (String): one of create, update, delete
+        max_workers (int): maximum number of targets to run at once
+        **kwargs: passed to run_stacks
+
+    Returns:
+        list of summary rows (owner, profile, status, seconds, error)
+    '''
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN run_targets')
+
+    def run(target):
+        start = time.time()
+        try:
+            run_stacks(types, action, target=target, **kwargs)
+            return (target.owner, target.profile, 'COMPLETE', time.time() - start, '')
+        except Exception as err:
+            log.exception('FAILED: {0}:{1}'.format(target.owner, target.profile))
+            return (target.owner, target.profile, 'FAILED', time.time() - start, str(err))
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(targets)) as executor:
+        rows = list(executor.map(run, targets))
+    log.debug('END run_targets')
+    return rows
+
+
+def format_table(headers, rows):
+    '''left aligned plain text table'''
+    rows = [[str(x) for x in row] for row in rows]
+    widths = [max(len(x) for x in column) for column in zip(headers, *rows)]
+    lines = ['  '.join(x.ljust(w) for x, w in zip(row, widths)).rstrip() for row in [headers] + rows]
+    lines.insert(1, '  '.join('-' * w for w in widths))
+    return '\n'.join(lines)
+
+
 def main():
     """entry function runs when script is executed."""
     log = logging.getLogger(__file__)
@@ -97,13 +558,21 @@ def main():
     # parse command line arguments
     parser = argparse.ArgumentParser(
         description='manage vpc cfn stack',
-        epilog='one and only one of --create, --delete, --update required'
+        epilog='one and only one of --create, --delete, --update, --drift required. '
+               'one and only one of --type_of_stack, --types, --all required'
     )
     # count the number of verbose options
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help='increase output detail')
 
-    parser.add_argument('-t', '--type_of_stack', required=True, help='REQUIRED: type of stack to create, for example vpc')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='maximum number of stacks to run at once with --types or --all')
+
+    # one of a single type, a list of types, or all types is required
+    types_group = parser.add_mutually_exclusive_group(required=True)
+    types_group.add_argument('-t', '--type_of_stack', help='type of stack to create, for example vpc')
+    types_group.add_argument('--types', help='comma separated stack types, for example vpc,sg,rs')
+    types_group.add_argument('--all', action='store_true', help='every stack type with a template')
 
     # one of create, update, delete,  is required
     # groups do not support custom help
@@ -111,8 +580,47 @@ def main():
     group.add_argument('-c', '--create', action='store_true')
     group.add_argument('-d', '--delete', action='store_true')
     group.add_argument('-u', '--update', action='store_true')
+    group.add_argument('--drift', action='store_true')
+
+    parser.add_argument('--change-set', action='store_true',
+                        help='with --update, preview changes with a change set instead of update_stack')
+    parser.add_argument('--execute', action='store_true',
+                        help='with --change-set, execute the change set if it is not empty')
+
+    parser.add_argument('--no-inline', dest='inline', action='store_false',
+                        help='always use the s3 template url, never an inline template body')
+
+    parser.add_argument('--follow', action='store_true',
+                        help='log stack events while the action runs')
+
+    parser.add_argument('--fail-fast', action='store_true',
+                        help='with --create or --update, abort at the first resource failure')
+
+    parser.add_argument('--restore-latest', action='store_true',
+                        help='with --create, restore rs and ar stacks from their newest snapshot')
+    parser.add_argument('--snapshot',
+                        help='with --create, restore the selected rs or ar stack from this snapshot')
+
+    parser.add_argument('--targets',
+                        help='comma separated owner:profile pairs to run the action in concurrently')
+    parser.add_argument('--target-jobs', type=int, default=None,
+                        help='maximum number of targets to run at once with --targets')
+    parser.add_argument('--trace', nargs='?', const='aws_trace.jsonl',
+                        help='record every aws api call to this json lines file')
 
     args = parser.parse_args()
+    if args.change_set and not args.update:
+        parser.error('--change-set requires --update')
+    if args.execute and not args.change_set:
+        parser.error('--execute requires --change-set')
+    if args.fail_fast and not (args.create or args.update):
+        parser.error('--fail-fast requires --create or --update')
+    if args.fail_fast and args.change_set:
+        parser.error('--fail-fast does not support --change-set')
+    if (args.restore_latest or args.snapshot) and not args.create:
+        parser.error('--restore-latest and --snapshot require --create')
+    if (args.restore_latest or args.snapshot) and args.targets:
+        parser.error('--restore-latest and --snapshot do not support --targets')
 
     # set loglevel to DEBUG if verbose
     if args.verbose >= 3:
@@ -130,70 +638,66 @@ def main():
 
     log.debug('system version is: {0}'.format(sys.version))
     log.debug('python path is: {0}'.format(sys.path))
-    log.debug("boto3 version is: {0}".format(boto3.__version__))
 
-    missing = validate_env_vars(['S3BUCKET', 'AWS_DEFAULT_PROFILE', 'OWNER', 'PRODUCT'])
+    required = ['S3BUCKET', 'PRODUCT'] if args.targets else ['S3BUCKET', 'AWS_DEFAULT_PROFILE', 'OWNER', 'PRODUCT']
+    if args.drift:
+        # drift detection reads deployed stacks only, no templates or parameters
+        required = [] if args.targets else ['AWS_DEFAULT_PROFILE', 'OWNER']
+    missing = validate_env_vars(required)
     if missing:
         raise ValueError('missing enviornment variables: {0}'.format(missing))
 
-    stack_name = '{0}-{1}-{2}'.format(os.getenv('OWNER'), os.getenv('AWS_DEFAULT_PROFILE'), args.type_of_stack)
-    template_url = 'https://s3-us-west-2.amazonaws.com/{0}/cloudformation/{1}.yaml'.format(
-                                                                                            os.getenv('S3BUCKET'),
-                                                                                            args.type_of_stack
-                                                                                           )
-    log.info('stack name is: {0}'.format(stack_name))
-
-    param_dict = {
-        'name': stack_name,
-        'template_url': template_url,
-        'Environment': os.getenv('AWS_DEFAULT_PROFILE'),
-        'Owner': os.getenv('OWNER'),
-        'Product': os.getenv('PRODUCT'),
-    }
-
-    # data to pass to config file templates
-    config_dict = {
-        'Environment': os.getenv('AWS_DEFAULT_PROFILE'),
-        'Owner': os.getenv('OWNER'),
-        'S3BucketHome': os.getenv('S3BUCKET'),
-    }
+    if args.trace:
+        aws_trace.start(args.trace)
 
-    config_file = join(
-        '{0}/etc'.format(dirname(abspath(__file__))),
-        '{0}_cfg.yaml'.format(args.type_of_stack)
-    )
+    if log.isEnabledFor(logging.DEBUG):
+        import boto3
+        log.debug("boto3 version is: {0}".format(boto3.__version__))
 
-    if isfile(config_file):
-        config = read_config(config_file=config_file, **config_dict)
-        log.debug('configuration file dict is: {0}'.format(config))
-        # merge configs
-        param_dict.update(config)
-
-    secrets_file = join(
-        expanduser('~/.aws/etc'),
-        '{0}_cfg.yaml'.format(args.type_of_stack)
-    )
-
-    if isfile(secrets_file):
-        config = read_config(config_file=secrets_file, **config_dict)
-        log.debug('configuration file dict is: {0}'.format(config))
-        # merge configs
-        param_dict.update(config)
+    if args.type_of_stack:
+        types = [args.type_of_stack]
+    else:
+        from cfn_template import template_types
+        types = template_types() if args.all else [x.strip() for x in args.types.split(',') if x.strip()]
 
-    log.debug('parameters are: {0}'.format(param_dict))
-    stack = CfnStack(**param_dict)
-    log.debug(stack)
+    if args.drift:
+        lines, failed = drift_stacks(types, parse_targets(args.targets) if args.targets else None)
+        print('\n'.join(lines))
+        if failed:
+            raise RuntimeError('some stacks drifted from their templates')
+        return
 
     if args.create:
-        stack.create_stack()
+        action = 'create'
     elif args.update:
-        stack.update_stack()
+        action = 'update'
     elif args.delete:
-        stack.delete_stack()
+        action = 'delete'
     else:
         # argparse mutually exclusive group guarantees this will never happen
         raise ValueError('one of create, update, or delete required')
 
+    options = {'change_set': args.change_set, 'execute': args.execute, 'follow': args.follow,
+               'inline': args.inline, 'fail_fast': args.fail_fast}
+    if not args.type_of_stack:
+        options['max_workers'] = args.jobs
+
+    snapshots = {}
+    if args.restore_latest or args.snapshot:
+        snapshots = find_snapshots(types, args.restore_latest, args.snapshot)
+
+    if args.targets:
+        rows = run_targets(parse_targets(args.targets), types, action, max_workers=args.target_jobs, **options)
+        print(format_table(['owner', 'profile', 'status', 'seconds', 'error'],
+                           [(o, p, st, '{0:.1f}'.format(sec), err) for o, p, st, sec, err in rows]))
+        if any(row[2] != 'COMPLETE' for row in rows):
+            raise RuntimeError('{0} failed for some targets'.format(action))
+    elif args.type_of_stack:
+        run_stack(args.type_of_stack, action,
+                  context=snapshot_context(args.type_of_stack, snapshots.get(args.type_of_stack)), **options)
+    else:
+        run_stacks(types, action, snapshots=snapshots, **options)
+
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,102 @@
+'''cfn_api.py
+
+translate the CfnStack parameter dict built by cfn.py into arguments
+for direct cloudformation api calls.  cfn.py runs every stack through
+this module with the shared clients of aws_clients.py, CfnStack made its
+own clients from the default session and does not cover change sets,
+other sessions or inline templates
+
+the parameter dict holds the stack name, template url, the iam flag from
+etc/role_cfg.yaml and every template parameter, for example
+    {'name': 'mwest-default-vpc', 'template_url': 'https://...',
+     'Environment': 'default', 'Owner': 'mwest', 'Product': 'home'}
+cfn.py replaces template_url with template_body, the minified template,
+when it is small enough to send inline.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+
+# keys of the parameter dict that are not template parameters
+RESERVED_KEYS = ('name', 'template_url', 'template_body', 'iam')
+
+
+def parameter_value(value):
+    '''cloudformation parameter values are strings, yaml booleans become true/false'''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '' if value is None else str(value)
+
+
+def stack_parameters(param_dict):
+    '''Parameters argument for create_stack, update_stack and create_change_set'''
+    return [
+        {'ParameterKey': key, 'ParameterValue': parameter_value(value)}
+        for key, value in sorted(param_dict.items()) if key not in RESERVED_KEYS
+    ]
+
+
+def stack_capabilities(param_dict):
+    '''Capabilities argument, iam: True in the config acknowledges iam resources
+
+    CAPABILITY_IAM only, as CfnStack did, role.yaml names none of its resources
+    '''
+    if param_dict.get('iam'):
+        return ['CAPABILITY_IAM']
+    return []
+
+
+def template_args(param_dict):
+    '''template arguments, the inline body when there is one, otherwise the url'''
+    if param_dict.get('template_body'):
+        return {'TemplateBody': param_dict['template_body']}
+    return {'TemplateURL': param_dict['template_url']}
+
+
+def stack_args(param_dict):
+    '''keyword arguments shared by create_stack, update_stack and create_change_set'''
+    args = {
+        'StackName': param_dict['name'],
+        'Parameters': stack_parameters(param_dict),
+        'Capabilities': stack_capabilities(param_dict),
+    }
+    args.update(template_args(param_dict))
+    return args
+
+
+# waiter to use after each action
+WAITERS = {
+    'create': 'stack_create_complete',
+    'update': 'stack_update_complete',
+    'delete': 'stack_delete_complete',
+}
+
+
+def start_stack_action(client, action, param_dict):
+    '''start a create, update or delete without waiting for it
+
+    an update with nothing to do raises the ClientError of update_stack, as
+    CfnStack did, --change-set is the way to skip unchanged stacks
+    '''
+    if action == 'create':
+        client.create_stack(**stack_args(param_dict))
+    elif action == 'update':
+        client.update_stack(**stack_args(param_dict))
+    elif action == 'delete':
+        client.delete_stack(StackName=param_dict['name'])
+    else:
+        raise ValueError('unknown action: {0}'.format(action))
+
+
+def run_stack_action(client, action, param_dict):
+    '''create, update or delete a stack with the given client and wait for it
+
+    same behaviour as CfnStack create_stack, update_stack and delete_stack
+    '''
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN run_stack_action')
+    start_stack_action(client, action, param_dict)
+    client.get_waiter(WAITERS[action]).wait(StackName=param_dict['name'])
+    log.info('{0} {1} complete'.format(action, param_dict['name']))
+    log.debug('END run_stack_action')
@@ -0,0 +1,127 @@
+'''cfn_changeset.py
+
+update a stack through a change set
+
+the change set is created and described first.  An empty change set is
+deleted and the update returns at once, without an update_stack round trip
+or a wait.  Otherwise a compact resource level diff is printed and the
+change set is executed only when asked, for example
+
+    Modify  Bastion  AWS::EC2::Instance  replacement=True  Properties.UserData
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+import logging
+
+from cfn_api import stack_args
+
+# StatusReason of a change set that failed only because nothing changed
+NO_CHANGES = ("didn't contain changes", 'No updates are to be performed')
+# seconds a change set may take to be created
+CHANGE_SET_TIMEOUT = 300
+
+
+def change_set_name():
+    '''unique change set name in utc, must match [a-zA-Z][-a-zA-Z0-9]*'''
+    now = time.time()
+    return 'cfn-py-{0}{1:06d}'.format(time.strftime('%Y%m%d%H%M%S', time.gmtime(now)), int(now % 1 * 1000000))
+
+
+def wait_for_change_set(client, stack_name, name, timeout=CHANGE_SET_TIMEOUT, delay=1.0, max_delay=5.0):
+    '''poll a change set until it is created or failed
+
+    starts with a short delay that grows, change sets are usually ready in seconds,
+    see wait_ready.poll_until
+
+    Returns:
+        describe_change_set response, raises wait_ready.NotReady after timeout seconds
+    '''
+    from wait_ready import poll_until
+
+    def check():
+        response = client.describe_change_set(StackName=stack_name, ChangeSetName=name)
+        if response['Status'] in ('CREATE_COMPLETE', 'FAILED'):
+            return response
+        return None
+
+    return poll_until(check, timeout, 'change set {0} of {1}'.format(name, stack_name),
+                      delay=delay, max_delay=max_delay)
+
+
+def change_set_changes(client, stack_name, name, response):
+    '''every change of a change set, following NextToken pages'''
+    changes = list(response.get('Changes', []))
+    while response.get('NextToken'):
+        response = client.describe_change_set(StackName=stack_name, ChangeSetName=name,
+                                              NextToken=response['NextToken'])
+        changes.extend(response.get('Changes', []))
+    return changes
+
+
+def format_changes(changes):
+    '''one line per resource change
+
+    Returns:
+        list of String
+    '''
+    lines = []
+    for change in changes:
+        resource = change.get('ResourceChange', {})
+        targets = sorted(set(
+            '{0}.{1}'.format(x['Target']['Attribute'], x['Target'].get('Name', '')).rstrip('.')
+            for x in resource.get('Details', [])
+        ))
+        replacement = resource.get('Replacement')
+        lines.append('  '.join(x for x in [
+            resource.get('Action', ''),
+            resource.get('LogicalResourceId', ''),
+            resource.get('ResourceType', ''),
+            'replacement={0}'.format(replacement) if replacement else '',
+            ','.join(targets),
+        ] if x))
+    return lines
+
+
+def update_with_change_set(client, param_dict, execute=False, timeout=CHANGE_SET_TIMEOUT):
+    '''update a stack through a change set
+
+    Args:
+        client: cloudformation client
+        param_dict (dict): CfnStack parameters built by cfn.py
+        execute (bool): execute a non empty change set and wait for the update
+        timeout (float): seconds to wait for the change set to be created
+
+    Returns:
+        list of changes, empty if the stack is already up to date
+    '''
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN update_with_change_set')
+    stack_name = param_dict['name']
+    name = change_set_name()
+    client.create_change_set(ChangeSetName=name, ChangeSetType='UPDATE', **stack_args(param_dict))
+    response = wait_for_change_set(client, stack_name, name, timeout=timeout)
+
+    if response['Status'] == 'FAILED':
+        reason = response.get('StatusReason', '')
+        client.delete_change_set(StackName=stack_name, ChangeSetName=name)
+        if any(x in reason for x in NO_CHANGES):
+            log.info('{0} is up to date, nothing to update'.format(stack_name))
+            log.debug('END update_with_change_set')
+            return []
+        raise RuntimeError('change set for {0} failed: {1}'.format(stack_name, reason))
+
+    changes = change_set_changes(client, stack_name, name, response)
+    log.info('change set {0} for {1}:\n{2}'.format(name, stack_name, '\n'.join(format_changes(changes))))
+
+    if execute:
+        log.info('executing change set {0}'.format(name))
+        client.execute_change_set(StackName=stack_name, ChangeSetName=name)
+        client.get_waiter('stack_update_complete').wait(StackName=stack_name)
+        log.info('{0} update complete'.format(stack_name))
+    else:
+        log.info('change set {0} not executed, pass --execute to apply it'.format(name))
+
+    log.debug('END update_with_change_set')
+    return changes
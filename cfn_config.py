@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+'''cfn_config.py
+
+render and merge the mustache / yaml config files that add parameters
+to cloudformation stacks
+
+config for a stack type is merged from these layers, later layers win
+    1. etc/{type}_cfg.yaml                      defaults in this repository
+    2. etc/{profile}/{type}_cfg.yaml            per profile overlay in this repository
+    3. ~/.aws/etc/{type}_cfg.yaml               secrets
+    4. ~/.aws/etc/{profile}/{type}_cfg.yaml     per profile secrets
+
+parsed mustache templates are cached by file path and mtime, rendered and
+parsed yaml by file path, mtime and render context, so rendering the same
+files for many stack types and environments in one process only does the
+work once.
+
+Example:
+    resolve every stack type for the current environment in one pass,
+    values of keys containing Password are masked unless --show-secrets
+
+      $ cfn_config.py [-v] render-all [--profile lab] [--owner mwest] [--show-secrets]
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import copy
+import json
+import logging
+import argparse
+import platform
+import threading
+from os.path import abspath, dirname, expanduser, getmtime, isfile, join
+
+ETC_DIR = join(dirname(abspath(__file__)), 'etc')
+SECRETS_DIR = expanduser('~/.aws/etc')
+
+_lock = threading.Lock()
+_parsed = {}
+_rendered = {}
+_renderer = None
+
+
+def config_layers(type_of_stack, profile=None):
+    '''config files for a stack type in precedence order, lowest first
+
+    Args:
+        type_of_stack (String): type of stack, for example vpc
+        profile (String): aws profile for per profile overlays
+
+    Returns:
+        list of paths, only files that exist
+    '''
+    filename = '{0}_cfg.yaml'.format(type_of_stack)
+    layers = [join(ETC_DIR, filename)]
+    if profile:
+        layers.append(join(ETC_DIR, profile, filename))
+    layers.append(join(SECRETS_DIR, filename))
+    if profile:
+        layers.append(join(SECRETS_DIR, profile, filename))
+    return [x for x in layers if isfile(x)]
+
+
+def _parsed_template(config_file, mtime):
+    '''parsed mustache template of a file, cached by path and mtime'''
+    import pystache
+
+    key = (config_file, mtime)
+    if key not in _parsed:
+        with open(config_file) as f:
+            _parsed[key] = pystache.parse(f.read())
+    return _parsed[key]
+
+
+def read_config(config_file, **kwargs):
+    '''render a mustache config file with kwargs and parse the yaml result
+
+    Args:
+        config_file (String): absolute path to configuration file to read
+        **kwargs: parameters to substitute in config file template
+
+    Returns:
+        dict of config, a copy the caller may change
+    '''
+    import yaml
+    import pystache
+
+    global _renderer
+    log = logging.getLogger(__file__)
+    mtime = getmtime(config_file)
+    key = (config_file, mtime, tuple(sorted(kwargs.items())))
+    with _lock:
+        if key not in _rendered:
+            log.info('configuration file is: {0}'.format(config_file))
+            if _renderer is None:
+                _renderer = pystache.Renderer()
+            yaml_string = _renderer.render(_parsed_template(config_file, mtime), kwargs)
+            log.debug('post mustache template process yaml is: {0}'.format(yaml_string))
+            _rendered[key] = yaml.safe_load(yaml_string) or {}
+        else:
+            log.debug('configuration file from cache: {0}'.format(config_file))
+        return copy.deepcopy(_rendered[key])
+
+
+def resolve_config(type_of_stack, context, profile=None):
+    '''merge every config layer of a stack type
+
+    Args:
+        type_of_stack (String): type of stack, for example vpc
+        context (dict): values for the mustache templates
+        profile (String): aws profile for per profile overlays
+
+    Returns:
+        dict of merged config
+    '''
+    config = {}
+    for config_file in config_layers(type_of_stack, profile):
+        config.update(read_config(config_file, **context))
+    return config
+
+
+def render_all(types, context, profile=None):
+    '''resolve the config of every stack type in one pass
+
+    Returns:
+        dict of stack type to merged config
+    '''
+    return dict((x, resolve_config(x, context, profile)) for x in types)
+
+
+def mask_secrets(config):
+    '''copy of a config with values of keys containing Password replaced'''
+    return dict((k, '****' if 'password' in k.lower() else v) for k, v in config.items())
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    parser = argparse.ArgumentParser(description='render cloudformation config files')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('command', choices=['render-all'],
+                        help='render-all resolves the config of every stack type')
+    parser.add_argument('--owner', default=os.getenv('OWNER'),
+                        help='owner, defaults to OWNER')
+    parser.add_argument('--profile', default=os.getenv('AWS_DEFAULT_PROFILE'),
+                        help='aws profile, defaults to AWS_DEFAULT_PROFILE')
+    parser.add_argument('--show-secrets', action='store_true',
+                        help='do not mask password values')
+    args = parser.parse_args()
+
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+
+    if args.owner is None or args.profile is None:
+        raise ValueError('owner and profile required, set OWNER and AWS_DEFAULT_PROFILE or pass --owner --profile')
+
+    from cfn_template import template_types
+
+    # every type with a template or a config file
+    types = sorted(set(template_types()) | set(
+        x[:-len('_cfg.yaml')] for x in os.listdir(ETC_DIR) if x.endswith('_cfg.yaml')))
+    context = {
+        'Environment': args.profile,
+        'Owner': args.owner,
+        'S3BucketHome': os.getenv('S3BUCKET'),
+    }
+    configs = render_all(types, context, args.profile)
+    if not args.show_secrets:
+        configs = dict((k, mask_secrets(v)) for k, v in configs.items())
+    print(json.dumps(configs, indent=2, sort_keys=True, default=str))
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
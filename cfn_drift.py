@@ -0,0 +1,152 @@
+'''cfn_drift.py
+
+detect drift of many stacks at once
+
+detect_stack_drift is started for every stack before any status is
+polled, so detections run side by side in cloudformation.  Pending
+detections are polled together each round, starting after 2 seconds and
+backing off to 10.  Resource drifts of every finished stack are fetched
+concurrently and reported one line per stack and per drifted resource,
+for example
+
+    mwest-lab-sg  DRIFTED  IN_SYNC=2 MODIFIED=1
+        BastionSG  AWS::EC2::SecurityGroup  MODIFIED  SecurityGroupIngress.1.CidrIp NOT_EQUAL
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# resource statuses worth reporting, IN_SYNC and NOT_CHECKED are summarized only
+DRIFTED = ('MODIFIED', 'DELETED')
+
+
+def start_detection(client, stack_name):
+    '''start drift detection of one stack
+
+    Returns:
+        detection id, or None if the stack does not exist
+    '''
+    from botocore.exceptions import ClientError
+
+    try:
+        return client.detect_stack_drift(StackName=stack_name)['StackDriftDetectionId']
+    except ClientError as err:
+        if 'does not exist' in str(err):
+            return None
+        raise
+
+
+def detection_status(client, detection_id):
+    '''describe_stack_drift_detection_status response'''
+    return client.describe_stack_drift_detection_status(StackDriftDetectionId=detection_id)
+
+
+def resource_drifts(client, stack_name):
+    '''drift of every resource of a stack, following NextToken pages'''
+    kwargs = {'StackName': stack_name}
+    drifts = []
+    while True:
+        response = client.describe_stack_resource_drifts(**kwargs)
+        drifts.extend(response['StackResourceDrifts'])
+        if not response.get('NextToken'):
+            return drifts
+        kwargs['NextToken'] = response['NextToken']
+
+
+def detect_drift(stacks, max_workers=8, delay=2.0, max_delay=10.0):
+    '''detect drift of several stacks concurrently
+
+    Args:
+        stacks (list): (cloudformation client, stack name), clients may differ per stack
+        max_workers (int): api calls made at once
+        delay (float): first delay between status polls
+        max_delay (float): longest delay between status polls
+
+    Returns:
+        dict of stack name to {'status': ..., 'reason': ..., 'resources': [...]}
+        status is a StackDriftStatus, NOT_FOUND or DETECTION_FAILED, a stack
+        that can not be checked, for example one in progress, does not stop the others
+    '''
+    from botocore.exceptions import ClientError
+
+    log = logging.getLogger(__file__)
+
+    def start(stack):
+        try:
+            return start_detection(*stack), None
+        except ClientError as err:
+            return None, str(err)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        started = list(executor.map(start, stacks))
+        pending = {}
+        # stacks whose detection started, only those have resource drifts
+        detected = set()
+        for (client, stack_name), (detection_id, error) in zip(stacks, started):
+            if error is not None:
+                log.error('can not detect drift of {0}: {1}'.format(stack_name, error))
+                results[stack_name] = {'status': 'DETECTION_FAILED', 'reason': error, 'resources': []}
+            elif detection_id is None:
+                results[stack_name] = {'status': 'NOT_FOUND', 'reason': '', 'resources': []}
+            else:
+                pending[stack_name] = (client, detection_id)
+                detected.add(stack_name)
+        log.info('detecting drift of {0} stacks'.format(len(pending)))
+
+        while pending:
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+            names = sorted(pending)
+            for stack_name, response in zip(names, executor.map(lambda x: detection_status(*pending[x]), names)):
+                if response['DetectionStatus'] == 'DETECTION_IN_PROGRESS':
+                    continue
+                del pending[stack_name]
+                # a failed detection still reports the resources it could check
+                status = response.get('StackDriftStatus', 'UNKNOWN')
+                if response['DetectionStatus'] == 'DETECTION_FAILED' and status == 'UNKNOWN':
+                    status = 'DETECTION_FAILED'
+                results[stack_name] = {'status': status, 'reason': response.get('DetectionStatusReason', ''),
+                                       'resources': []}
+                log.debug('{0} drift detection finished: {1}'.format(stack_name, status))
+
+        checked = [(client, name) for client, name in stacks if name in detected]
+        for (_, stack_name), drifts in zip(checked, executor.map(lambda x: resource_drifts(*x), checked)):
+            results[stack_name]['resources'] = drifts
+    return results
+
+
+def format_drift(results):
+    '''one line per stack and one per drifted resource
+
+    Returns:
+        list of String
+    '''
+    lines = []
+    for stack_name in sorted(results):
+        result = results[stack_name]
+        counts = {}
+        for drift in result['resources']:
+            counts[drift['StackResourceDriftStatus']] = counts.get(drift['StackResourceDriftStatus'], 0) + 1
+        lines.append('  '.join(x for x in [
+            stack_name,
+            result['status'],
+            ' '.join('{0}={1}'.format(x, counts[x]) for x in sorted(counts)),
+            result['reason'],
+        ] if x))
+        for drift in result['resources']:
+            if drift['StackResourceDriftStatus'] not in DRIFTED:
+                continue
+            differences = ','.join('{0} {1}'.format(x['PropertyPath'].lstrip('/').replace('/', '.'),
+                                                    x['DifferenceType'])
+                                   for x in drift.get('PropertyDifferences', []))
+            lines.append('    ' + '  '.join(x for x in [
+                drift['LogicalResourceId'],
+                drift['ResourceType'],
+                drift['StackResourceDriftStatus'],
+                differences,
+            ] if x))
+    return lines
@@ -0,0 +1,129 @@
+'''cfn_graph.py
+
+order stack types by the Export / Fn::ImportValue references in their
+templates and run an action on independent stacks concurrently
+
+for example sg imports mwest-vpc-id from vpc, so sg waits for vpc,
+while rs and ar both run as soon as vpc, sg and role are done
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+from os.path import isfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from cfn_template import load_template, template_exports, template_imports, template_path
+
+
+def build_dependencies(types):
+    '''build a dependency graph between stack types from their templates
+
+    a type depends on every other selected type whose template exports
+    a name it imports.  Imports exported by a type that is not selected
+    are assumed to be already deployed.
+
+    Args:
+        types (list): stack types to include, for example ['vpc', 'sg']
+
+    Returns:
+        dict of stack type to set of stack types it depends on
+    '''
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN build_dependencies')
+    exporters = {}
+    imports = {}
+    for type_of_stack in types:
+        path = template_path(type_of_stack)
+        if not isfile(path):
+            log.warning('no template for {0}, assuming it has no dependencies'.format(type_of_stack))
+            imports[type_of_stack] = set()
+            continue
+        template = load_template(path)
+        for name in template_exports(template):
+            exporters[name] = type_of_stack
+        imports[type_of_stack] = template_imports(template)
+
+    dependencies = {}
+    for type_of_stack in types:
+        dependencies[type_of_stack] = set(
+            exporters[name] for name in imports[type_of_stack]
+            if name in exporters and exporters[name] != type_of_stack
+        )
+        log.debug('{0} depends on {1}'.format(type_of_stack, sorted(dependencies[type_of_stack])))
+
+    check_acyclic(dependencies)
+    log.debug('END build_dependencies')
+    return dependencies
+
+
+def reverse_dependencies(dependencies):
+    '''invert a dependency graph, used to delete dependents before their dependencies'''
+    reverse = dict((node, set()) for node in dependencies)
+    for node, prereqs in dependencies.items():
+        for prereq in prereqs:
+            reverse[prereq].add(node)
+    return reverse
+
+
+def check_acyclic(dependencies):
+    '''raise ValueError if the dependency graph has a cycle'''
+    remaining = dict((node, set(prereqs)) for node, prereqs in dependencies.items())
+    while remaining:
+        ready = [node for node, prereqs in remaining.items() if not prereqs]
+        if not ready:
+            raise ValueError('dependency cycle between stacks: {0}'.format(sorted(remaining)))
+        for node in ready:
+            del remaining[node]
+        for prereqs in remaining.values():
+            prereqs.difference_update(ready)
+
+
+def run_graph(dependencies, func, max_workers=None):
+    '''call func(node) for every node once all of its dependencies succeeded
+
+    independent nodes run concurrently in a thread pool.  When a node fails
+    every node that depends on it, directly or not, is skipped.
+
+    Args:
+        dependencies (dict): node to set of nodes it depends on
+        func (callable): called with a single node
+        max_workers (int): thread pool size, defaults to one per node
+
+    Returns:
+        dict of node to one of COMPLETE, FAILED, SKIPPED
+    '''
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN run_graph')
+    check_acyclic(dependencies)
+    status = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or max(len(dependencies), 1)) as executor:
+        while len(status) < len(dependencies):
+            for node, prereqs in sorted(dependencies.items()):
+                if node in status or node in running.values():
+                    continue
+                if any(status.get(prereq) in ('FAILED', 'SKIPPED') for prereq in prereqs):
+                    log.warning('skipping {0}, a dependency failed'.format(node))
+                    status[node] = 'SKIPPED'
+                elif all(status.get(prereq) == 'COMPLETE' for prereq in prereqs):
+                    log.info('starting {0}'.format(node))
+                    running[executor.submit(func, node)] = node
+
+            if not running:
+                # only skips were recorded this pass, loop to propagate them
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                try:
+                    future.result()
+                    status[node] = 'COMPLETE'
+                    log.info('finished {0}'.format(node))
+                except Exception:
+                    log.exception('FAILED: {0}'.format(node))
+                    status[node] = 'FAILED'
+
+    log.debug('END run_graph')
+    return status
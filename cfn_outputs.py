@@ -0,0 +1,337 @@
+'''cfn_outputs.py
+
+shared lookup of cloudformation stack outputs and exports
+
+no aws calls are made at import.  Outputs are fetched on first use for
+every requested stack at once, memoized for the life of the process and
+kept in an on-disk cache that is invalidated when a stack's LastUpdatedTime
+changes.  One paginated list_stacks call finds the LastUpdatedTime of every
+stack, then only stacks missing from the disk cache or changed since are
+described, one describe_stacks call per stack, concurrently.  The
+list_stacks check is never skipped, max_age only bounds how long an
+unchanged entry is kept before it is described again.
+
+every described stack is also written to ~/.aws/cfn_cache/{stack name}.env
+with one shell variable per output, for connect scripts to source.
+cfn.py refreshes both after every create or update.
+
+Example:
+    from cfn_outputs import get_output, stack_prefix
+
+    ip = get_output('{0}-ec2'.format(stack_prefix()), 'PublicIP')
+
+    call as script to refresh stale cache entries and env files
+
+      $ python cfn_outputs.py -s mwest-lab-rs,mwest-lab-ec2 [--max-age 43200]
+      $ . ~/.aws/cfn_cache/mwest-lab-rs.env
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+from os.path import dirname, expanduser, isfile, join
+
+CACHE_FILE = expanduser('~/.aws/cfn_cache/outputs.json')
+# seconds an unchanged stack is kept before it is described again anyway
+CACHE_MAX_AGE = 12 * 3600
+
+# the only status of a stack that no longer exists, every other one is listed
+DELETED_STATUS = 'DELETE_COMPLETE'
+# concurrent describe_stacks calls of one lookup
+MAX_WORKERS = 8
+
+_lock = threading.Lock()
+_outputs = {}
+_exports = {}
+
+
+def stack_prefix():
+    '''stack name prefix {OWNER}-{AWS_DEFAULT_PROFILE} shared by every stack'''
+    return '{0}-{1}'.format(os.environ['OWNER'], os.environ['AWS_DEFAULT_PROFILE'])
+
+
+def _cloudformation_client():
+    import aws_clients
+    return aws_clients.client('cloudformation')
+
+
+def _stack_version(stack):
+    '''LastUpdatedTime of a stack, or CreationTime if never updated, as a string'''
+    return str(stack.get('LastUpdatedTime') or stack.get('CreationTime'))
+
+
+def read_cache(cache_file=CACHE_FILE):
+    '''read the on-disk outputs cache
+
+    Returns:
+        dict of stack name to {'version': ..., 'outputs': {...}}
+    '''
+    if not isfile(cache_file):
+        return {}
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except ValueError:
+        logging.getLogger(__file__).warning('ignoring corrupt cache file: {0}'.format(cache_file))
+        return {}
+
+
+def write_cache(cache, cache_file=CACHE_FILE):
+    '''write the on-disk outputs cache atomically'''
+    if not os.path.isdir(dirname(cache_file)):
+        os.makedirs(dirname(cache_file))
+    fdesc, tmp_name = tempfile.mkstemp(dir=dirname(cache_file))
+    with os.fdopen(fdesc, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.rename(tmp_name, cache_file)
+
+
+def env_file(stack_name, cache_file=CACHE_FILE):
+    '''path of the sourceable env file of a stack'''
+    return join(dirname(cache_file), '{0}.env'.format(stack_name))
+
+
+def write_env(stack_name, entry, cache_file=CACHE_FILE):
+    '''write the outputs of a stack as shell variables, atomically'''
+    lines = ['# outputs of {0} version {1}, written by cfn_outputs.py'.format(stack_name, entry['version']),
+             "CFN_STACK_VERSION='{0}'".format(entry['version'])]
+    for key in sorted(entry['outputs']):
+        # shell variable names allow letters, digits and underscore only
+        lines.append("{0}='{1}'".format(re.sub(r'\W', '_', key), entry['outputs'][key].replace("'", "'\\''")))
+    fdesc, tmp_name = tempfile.mkstemp(dir=dirname(cache_file))
+    with os.fdopen(fdesc, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.rename(tmp_name, env_file(stack_name, cache_file))
+
+
+def active_statuses(client):
+    '''every stack status except DELETE_COMPLETE, from the service model of the client
+
+    failed and rolled back stacks still exist and may have outputs
+    '''
+    statuses = client.meta.service_model.shape_for('StackStatus').enum
+    return [x for x in statuses if x != DELETED_STATUS]
+
+
+def list_stack_versions(client):
+    '''LastUpdatedTime of every existing stack with one paginated list_stacks call
+
+    Returns:
+        dict of stack name to version string
+    '''
+    versions = {}
+    paginator = client.get_paginator('list_stacks')
+    for page in paginator.paginate(StackStatusFilter=active_statuses(client)):
+        for summary in page['StackSummaries']:
+            versions[summary['StackName']] = _stack_version(summary)
+    return versions
+
+
+def describe_stacks(stack_names, client, must_exist=True):
+    '''describe each stack by name, concurrently with the shared client
+
+    never lists every stack of the account, the cost grows with stack_names only
+
+    Args:
+        must_exist (bool): raise the ClientError of a stack that does not
+            exist, otherwise leave it out of the result
+
+    Returns:
+        dict of stack name to {'version': ..., 'outputs': {...}}
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    from botocore.exceptions import ClientError
+
+    log = logging.getLogger(__file__)
+
+    def describe(stack_name):
+        try:
+            return client.describe_stacks(StackName=stack_name)['Stacks']
+        except ClientError as err:
+            if must_exist or 'does not exist' not in str(err):
+                raise
+            return []
+
+    described = {}
+    if not stack_names:
+        return described
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(stack_names))) as executor:
+        for stacks in executor.map(describe, stack_names):
+            for stack in stacks:
+                described[stack['StackName']] = {
+                    'version': _stack_version(stack),
+                    'outputs': dict((x['OutputKey'], x['OutputValue']) for x in stack.get('Outputs', [])),
+                    'written': time.time(),
+                }
+    log.debug('described stacks: {0}'.format(sorted(described)))
+    return described
+
+
+def _store(cache, stack_names, cache_file):
+    '''write the on-disk cache and the env files of stack_names'''
+    write_cache(cache, cache_file)
+    for stack_name in stack_names:
+        write_env(stack_name, cache[stack_name], cache_file)
+
+
+def get_outputs(stack_names, client=None, use_cache=True, cache_file=CACHE_FILE, ignore_missing=False,
+                max_age=None):
+    '''outputs of several stacks fetched together
+
+    Args:
+        stack_names (list): stack names, for example ['mwest-default-ec2']
+        client: cloudformation client, created on first use if not passed
+        use_cache (bool): read and update the on-disk cache
+        cache_file (String): path of on-disk cache
+        ignore_missing (bool): leave stacks that do not exist out of the result
+            instead of raising ValueError
+        max_age (float): describe stacks again when their cache entry is older
+            than max_age seconds even if LastUpdatedTime is unchanged, None for
+            no limit.  LastUpdatedTime is always checked
+
+    Returns:
+        dict of stack name to dict of OutputKey to OutputValue
+    '''
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN get_outputs')
+    with _lock:
+        missing = [x for x in stack_names if x not in _outputs]
+        cache = read_cache(cache_file) if use_cache and missing else {}
+        if missing:
+            client = client or _cloudformation_client()
+            if use_cache:
+                versions = list_stack_versions(client)
+                not_found = [x for x in missing if x not in versions]
+                if not_found and not ignore_missing:
+                    raise ValueError('stacks do not exist: {0}'.format(not_found))
+                now = time.time()
+                stale = [x for x in missing if x in versions and (
+                    cache.get(x, {}).get('version') != versions[x] or
+                    (max_age is not None and now - cache[x].get('written', 0) > max_age))]
+                log.debug('stacks to describe: {0}'.format(stale))
+                if stale:
+                    # a stack deleted since list_stacks is left out and treated as missing
+                    cache.update(describe_stacks(stale, client, must_exist=False))
+                current = [x for x in missing if x in versions and x in cache]
+                gone = [x for x in missing if x in versions and x not in cache]
+                if gone and not ignore_missing:
+                    raise ValueError('stacks do not exist: {0}'.format(gone))
+                _store(cache, current, cache_file)
+                cache = dict((x, cache[x]) for x in current)
+            else:
+                cache = describe_stacks(missing, client, must_exist=not ignore_missing)
+            for stack_name in missing:
+                if stack_name in cache:
+                    _outputs[stack_name] = cache[stack_name]['outputs']
+                elif not ignore_missing:
+                    raise ValueError('stack does not exist: {0}'.format(stack_name))
+        result = dict((x, _outputs[x]) for x in stack_names if x in _outputs)
+    log.debug('END get_outputs')
+    return result
+
+
+def get_output(stack_name, key, **kwargs):
+    '''single output value of a stack, see get_outputs for kwargs'''
+    return get_outputs([stack_name], **kwargs)[stack_name][key]
+
+
+def get_exports(client=None):
+    '''every cloudformation export in the account, fetched once with pagination
+
+    Returns:
+        dict of export name to value
+    '''
+    with _lock:
+        if not _exports:
+            client = client or _cloudformation_client()
+            for page in client.get_paginator('list_exports').paginate():
+                _exports.update((x['Name'], x['Value']) for x in page['Exports'])
+        return dict(_exports)
+
+
+def refresh(stack_names, client=None, cache_file=CACHE_FILE):
+    '''describe stacks now and replace their cache entries and env files
+
+    called by cfn.py after a create or update changed the outputs
+
+    Returns:
+        dict of stack name to dict of OutputKey to OutputValue
+    '''
+    with _lock:
+        described = describe_stacks(stack_names, client or _cloudformation_client())
+        cache = read_cache(cache_file)
+        cache.update(described)
+        _store(cache, described, cache_file)
+        for stack_name in described:
+            _outputs[stack_name] = described[stack_name]['outputs']
+        return dict((x, described[x]['outputs']) for x in described)
+
+
+def forget(stack_names, cache_file=CACHE_FILE):
+    '''remove stacks from the memo, the on-disk cache and their env files, after a delete'''
+    with _lock:
+        cache = read_cache(cache_file)
+        for stack_name in stack_names:
+            _outputs.pop(stack_name, None)
+            cache.pop(stack_name, None)
+            if isfile(env_file(stack_name, cache_file)):
+                os.remove(env_file(stack_name, cache_file))
+        if isfile(cache_file):
+            write_cache(cache, cache_file)
+
+
+def clear():
+    '''forget memoized outputs and exports, the on-disk cache is kept'''
+    with _lock:
+        _outputs.clear()
+        _exports.clear()
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    parser = argparse.ArgumentParser(description='refresh the stack outputs cache and env files')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('-s', '--stacks', required=True,
+                        help='comma separated stack names')
+    parser.add_argument('--max-age', type=float, default=CACHE_MAX_AGE,
+                        help='seconds an unchanged cache entry is kept before it is described again')
+    args = parser.parse_args()
+
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+
+    stack_names = [x.strip() for x in args.stacks.split(',') if x.strip()]
+    get_outputs(stack_names, max_age=args.max_age)
+    for stack_name in stack_names:
+        print(env_file(stack_name))
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
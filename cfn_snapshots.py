@@ -0,0 +1,98 @@
+'''cfn_snapshots.py
+
+find the newest snapshot of the rs and ar databases of a stack prefix
+
+cloudformation names the clusters it creates {stack name}-{logical id}-{random},
+so the snapshots of every cluster a stack ever had are found by cluster
+identifier prefix, even after the stack and cluster were deleted.  Each
+service is listed once with a paginated describe call and indexed by cluster
+and creation time, both services are listed concurrently.
+
+the snapshot identifier is passed to the etc/{type}_cfg.yaml templates in
+the render context under the name of the template parameter, see PARAMETERS
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# template parameter and render context key holding the snapshot, by stack type
+PARAMETERS = {
+    'rs': 'SnapshotIdentifier',
+    'ar': 'DBSnapshotName',
+}
+
+
+def redshift_snapshots(client):
+    '''available redshift snapshots indexed by cluster
+
+    Returns:
+        dict of cluster identifier to list of (create time, snapshot identifier), newest first
+    '''
+    index = defaultdict(list)
+    for page in client.get_paginator('describe_cluster_snapshots').paginate():
+        for snapshot in page['Snapshots']:
+            if snapshot['Status'] == 'available':
+                index[snapshot['ClusterIdentifier']].append(
+                    (snapshot['SnapshotCreateTime'], snapshot['SnapshotIdentifier']))
+    for snapshots in index.values():
+        snapshots.sort(reverse=True)
+    return index
+
+
+def aurora_snapshots(client):
+    '''available aurora cluster snapshots indexed by cluster
+
+    Returns:
+        dict of cluster identifier to list of (create time, snapshot identifier), newest first
+    '''
+    index = defaultdict(list)
+    for page in client.get_paginator('describe_db_cluster_snapshots').paginate():
+        for snapshot in page['DBClusterSnapshots']:
+            if snapshot['Status'] == 'available':
+                index[snapshot['DBClusterIdentifier']].append(
+                    (snapshot['SnapshotCreateTime'], snapshot['DBClusterSnapshotIdentifier']))
+    for snapshots in index.values():
+        snapshots.sort(reverse=True)
+    return index
+
+
+# service client and snapshot index by stack type
+INDEXES = {
+    'rs': ('redshift', redshift_snapshots),
+    'ar': ('rds', aurora_snapshots),
+}
+
+
+def latest_snapshot(index, stack_name):
+    '''newest snapshot of any cluster created by a stack, None if there is none'''
+    prefix = '{0}-'.format(stack_name.lower())
+    snapshots = [x[0] for cluster, x in index.items() if cluster.lower().startswith(prefix) and x]
+    return max(snapshots)[1] if snapshots else None
+
+
+def find_latest(stack_names, clients):
+    '''newest snapshot of each stack, services listed concurrently
+
+    Args:
+        stack_names (dict): stack type to stack name, types from PARAMETERS
+        clients (dict): service name to client, created by the caller
+
+    Returns:
+        dict of stack type to snapshot identifier, raises ValueError if a stack has none
+    '''
+    log = logging.getLogger(__file__)
+    types = sorted(stack_names)
+    with ThreadPoolExecutor(max_workers=len(types) or 1) as executor:
+        indexes = list(executor.map(lambda x: INDEXES[x][1](clients[INDEXES[x][0]]), types))
+
+    snapshots = {}
+    for type_of_stack, index in zip(types, indexes):
+        snapshot = latest_snapshot(index, stack_names[type_of_stack])
+        if snapshot is None:
+            raise ValueError('no available snapshot of {0}'.format(stack_names[type_of_stack]))
+        log.info('latest snapshot of {0} is {1}'.format(stack_names[type_of_stack], snapshot))
+        snapshots[type_of_stack] = snapshot
+    return snapshots
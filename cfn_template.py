@@ -0,0 +1,131 @@
+'''cfn_template.py
+
+load the cloudformation yaml templates in this directory and index
+what each one exports and imports
+
+short form intrinsic functions such as !Ref and !ImportValue are not
+standard yaml so the loader expands them to their long form, for example
+!ImportValue 'mwest-vpc-id' becomes {'Fn::ImportValue': 'mwest-vpc-id'}
+
+template_body minifies a template to compact json, comments and layout
+dropped, for passing it inline as TemplateBody instead of an s3 url
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import glob
+import json
+import logging
+import yaml
+from os.path import abspath, basename, dirname, join, splitext
+
+TEMPLATE_DIR = dirname(abspath(__file__))
+# cloudformation limit for an inline TemplateBody, larger templates need TemplateURL
+MAX_TEMPLATE_BODY = 51200
+
+
+class TemplateLoader(yaml.SafeLoader):
+    '''yaml SafeLoader that understands cloudformation short form tags'''
+
+
+def _construct_intrinsic(loader, tag_suffix, node):
+    '''expand a short form tag such as !GetAtt into its long form dict'''
+    name = 'Ref' if tag_suffix == 'Ref' else 'Fn::{0}'.format(tag_suffix)
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+        # !GetAtt Resource.Attribute is shorthand for [Resource, Attribute]
+        if tag_suffix == 'GetAtt':
+            value = value.split('.', 1)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+    return {name: value}
+
+
+TemplateLoader.add_multi_constructor('!', _construct_intrinsic)
+
+
+def template_path(type_of_stack):
+    '''absolute path of the template for a stack type, for example vpc.yaml'''
+    return join(TEMPLATE_DIR, '{0}.yaml'.format(type_of_stack))
+
+
+def template_types():
+    '''list the stack types that have a template in this directory
+
+    Returns:
+        sorted list of stack types, for example ['ar', 'ec2', 'role', ...]
+    '''
+    return sorted(splitext(basename(path))[0] for path in glob.glob(join(TEMPLATE_DIR, '*.yaml')))
+
+
+def load_template(path):
+    '''parse a cloudformation yaml template
+
+    Args:
+        path (String): path of template file
+
+    Returns:
+        dict of template with intrinsic functions in long form
+    '''
+    log = logging.getLogger(__file__)
+    log.debug('loading template: {0}'.format(path))
+    with open(path) as f:
+        return yaml.load(f, Loader=TemplateLoader)
+
+
+def find_intrinsics(node, name):
+    '''yield the argument of every use of an intrinsic function in a template
+
+    Args:
+        node: any part of a parsed template
+        name (String): long form name, for example Fn::ImportValue or Ref
+
+    Returns:
+        generator of intrinsic function arguments
+    '''
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == name:
+                yield value
+            for found in find_intrinsics(value, name):
+                yield found
+    elif isinstance(node, list):
+        for item in node:
+            for found in find_intrinsics(item, name):
+                yield found
+
+
+def template_exports(template):
+    '''set of export names declared in the Outputs of a template
+
+    only literal export names are returned, names built with !Sub are skipped
+    '''
+    exports = set()
+    for output in (template.get('Outputs') or {}).values():
+        name = (output.get('Export') or {}).get('Name')
+        if isinstance(name, str):
+            exports.add(name)
+    return exports
+
+
+def template_imports(template):
+    '''set of literal export names a template reads with !ImportValue'''
+    return set(value for value in find_intrinsics(template, 'Fn::ImportValue') if isinstance(value, str))
+
+
+def minify_template(path):
+    '''template as compact json with intrinsic functions in long form'''
+    # default=str keeps unquoted yaml dates such as a bare 2010-09-09 as strings
+    return json.dumps(load_template(path), separators=(',', ':'), default=str)
+
+
+def template_body(type_of_stack, max_bytes=MAX_TEMPLATE_BODY):
+    '''minified template of a stack type, None if it is larger than max_bytes'''
+    body = minify_template(template_path(type_of_stack))
+    if len(body.encode('utf-8')) > max_bytes:
+        logging.getLogger(__file__).info('{0}.yaml is {1} bytes minified, too large to inline'.format(
+            type_of_stack, len(body.encode('utf-8'))))
+        return None
+    return body
@@ -1,7 +1,15 @@
 #!/bin/bash
 # sample connection script
 # can I install a .pgpass at ec2 initilization?
-# consider grabbing the hostname from exports to create this script from template
+# host from the rs stack outputs cached by cfn.py, see cfn_outputs.py
+# copy ~/.aws/cfn_cache/{stack}.env next to this script as rs.env on the bastion
+# or PGHOST=localhost to run it locally through ssh_tunnel_rs.sh
+for ENV_FILE in ./rs.env ~/.aws/cfn_cache/${OWNER}-${AWS_DEFAULT_PROFILE}-rs.env; do
+    if [ -f "${ENV_FILE}" ]; then
+        . "${ENV_FILE}"
+        break
+    fi
+done
 /usr/bin/psql --dbname=test --port=5439 --username=billybob \
- --host=r619185-lab-rs-redshift-aycq2lrvs5md.cp2b6xqxwhiv.us-west-2.redshift.amazonaws.com \
+ --host=${PGHOST:-${ClusterEndpoint%:*}} \
  -f $1
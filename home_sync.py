@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+'''home_sync.py
+
+package the home/ directory for the bastion host and upload it to
+s3://{S3BUCKET}/cloudformation/home.tar.gz only when its content changed
+
+a per file sha256 manifest of home/ is kept in .home_manifest.json.
+The archive is written as a gzip stream straight into the s3 upload,
+no temporary copy of the tree or the archive is made.
+
+--delta ships only the files changed since the last upload to
+s3://{S3BUCKET}/cloudformation/home-delta/{hash}.tar.gz, for refreshing a
+running bastion.  home.tar.gz is then stale and uploaded by the next
+run without --delta.  Deleted files are reported, not removed remotely.
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ home_sync.py [-v] [--delta] [--output home.tar.gz]
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import json
+import stat
+import tarfile
+import hashlib
+import logging
+import argparse
+import platform
+import threading
+from os.path import abspath, dirname, isfile, join, relpath
+
+import aws_clients
+
+HOME_DIR = join(dirname(abspath(__file__)), 'home')
+MANIFEST_FILE = join(dirname(abspath(__file__)), '.home_manifest.json')
+FULL_KEY = 'cloudformation/home.tar.gz'
+DELTA_KEY = 'cloudformation/home-delta/{0}.tar.gz'
+
+
+def file_digest(path):
+    '''sha256 hex digest of a file read in blocks'''
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def build_manifest(home_dir=HOME_DIR):
+    '''sha256 and mode of every file under home_dir
+
+    Returns:
+        dict of relative path to {'sha256': ..., 'mode': ...}
+    '''
+    manifest = {}
+    for root, dirs, files in os.walk(home_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = join(root, name)
+            manifest[relpath(path, home_dir)] = {
+                'sha256': file_digest(path),
+                'mode': stat.S_IMODE(os.stat(path).st_mode),
+            }
+    return manifest
+
+
+def bundle_digest(manifest):
+    '''content hash of a whole manifest'''
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def changed_files(manifest, previous):
+    '''(changed, deleted) relative paths between two manifests'''
+    changed = sorted(x for x in manifest if previous.get(x) != manifest[x])
+    deleted = sorted(x for x in previous if x not in manifest)
+    return changed, deleted
+
+
+def write_archive(fileobj, paths, home_dir=HOME_DIR):
+    '''write a gzip tar stream of paths relative to home_dir
+
+    members are stored as ./path like tar -C home -zcf - .  so cfn-init
+    unpacks them the same way it unpacked the old home.tar.gz
+    '''
+    with tarfile.open(fileobj=fileobj, mode='w|gz') as archive:
+        for path in paths:
+            archive.add(join(home_dir, path), arcname='./{0}'.format(path), recursive=False)
+
+
+def read_state(manifest_file=MANIFEST_FILE):
+    '''last uploaded state per bucket, {'full': digest, 'files': manifest}'''
+    if not isfile(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def write_state(state, manifest_file=MANIFEST_FILE):
+    '''write last uploaded state'''
+    tmp_name = '{0}.tmp'.format(manifest_file)
+    with open(tmp_name, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.rename(tmp_name, manifest_file)
+
+
+class _ProducerReader(object):
+    '''read end of the archive pipe that raises the error of the producer
+    at end of stream, instead of letting a truncated archive look complete'''
+
+    def __init__(self, reader, errors):
+        self.reader = reader
+        self.errors = errors
+
+    def read(self, size=-1):
+        data = self.reader.read(size)
+        if not data and self.errors:
+            raise self.errors[0]
+        return data
+
+
+def stream_upload(bucket, key, paths, home_dir=HOME_DIR):
+    '''upload a tar stream of paths to s3 while it is being written
+
+    the archive is written into a pipe by a thread and upload_fileobj reads
+    the other end, sending multipart chunks as they fill.  If writing the
+    archive fails the read raises, upload_fileobj aborts the multipart
+    upload and the object already at key is left as it was
+    '''
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        writer = os.fdopen(write_fd, 'wb')
+        try:
+            write_archive(writer, paths, home_dir)
+        except Exception as err:
+            # recorded before the pipe closes so the reader sees it at end of stream
+            errors.append(err)
+        finally:
+            try:
+                writer.close()
+            except Exception as err:
+                errors.append(err)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    try:
+        with os.fdopen(read_fd, 'rb') as reader:
+            aws_clients.client('s3').upload_fileobj(_ProducerReader(reader, errors), bucket, key,
+                                                    ExtraArgs={'ServerSideEncryption': 'AES256'})
+    finally:
+        producer.join()
+    if errors:
+        raise errors[0]
+
+
+def sync_home(bucket, delta=False, home_dir=HOME_DIR, manifest_file=MANIFEST_FILE):
+    '''upload home_dir if it changed since the last upload
+
+    Args:
+        bucket (String): s3 bucket
+        delta (bool): ship only changed files to a delta archive
+        home_dir (String): directory to package
+        manifest_file (String): state of the last upload
+
+    Returns:
+        s3 key uploaded, or None if nothing changed
+    '''
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN sync_home')
+    manifest = build_manifest(home_dir)
+    digest = bundle_digest(manifest)
+    state = read_state(manifest_file)
+    bucket_state = state.setdefault(bucket, {})
+
+    if delta:
+        changed, deleted = changed_files(manifest, bucket_state.get('files', {}))
+        if deleted:
+            log.warning('deleted locally, not removed from the bastion: {0}'.format(deleted))
+        if not changed:
+            log.info('home has no changed files, nothing to upload')
+            return None
+        key = DELTA_KEY.format(digest)
+        log.info('uploading {0} changed files to s3://{1}/{2}'.format(len(changed), bucket, key))
+        stream_upload(bucket, key, changed, home_dir)
+        log.info('apply on the bastion with: aws s3 cp s3://{0}/{1} - | tar -xz -C ~'.format(bucket, key))
+    else:
+        if bucket_state.get('full') == digest:
+            log.info('home.tar.gz is up to date, nothing to upload')
+            return None
+        key = FULL_KEY
+        log.info('uploading {0} files to s3://{1}/{2}'.format(len(manifest), bucket, key))
+        stream_upload(bucket, key, sorted(manifest), home_dir)
+        bucket_state['full'] = digest
+
+    bucket_state['files'] = manifest
+    write_state(state, manifest_file)
+    log.debug('END sync_home')
+    return key
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    parser = argparse.ArgumentParser(description='upload home/ bundle to s3 when it changed')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('--delta', action='store_true',
+                        help='upload only files changed since the last upload')
+    parser.add_argument('-o', '--output',
+                        help='write the full archive to this file instead of uploading')
+    args = parser.parse_args()
+
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+
+    if args.output:
+        with open(args.output, 'wb') as f:
+            write_archive(f, sorted(build_manifest()))
+        log.info('wrote {0}'.format(args.output))
+        return
+
+    if 'S3BUCKET' not in os.environ:
+        raise ValueError('missing enviornment variables: {0}'.format(['S3BUCKET']))
+    sync_home(os.environ['S3BUCKET'], delta=args.delta)
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
@@ -1,7 +1,4 @@
 #!/bin/bash
 
-cd ./home
-tar -zcf ../home.tar.gz .
-cd -
-
-aws s3 cp home.tar.gz s3://${S3BUCKET}/cloudformation/home.tar.gz --sse AES256
+# uploads home.tar.gz only when home/ changed, see home_sync.py --delta for changed files only
+./home_sync.py "$@"
@@ -1,26 +1,73 @@
 #!/usr/bin/env python
 """manage_key_pair.py
 
-create, delete, or rotate an ec2 keypair
+create, delete, or rotate ec2 keypairs
 write private key to file $HOME/.ssh/{keypair}.pem
 
+several keypairs may be passed comma separated, they run concurrently
+with one shared ec2 client and a per key report is printed at the end
+
+ec2 can not rename or replace a keypair, so rotate narrows the time a
+keypair name has no key to the gap between two api calls:
+    1. a new key is created under a temporary name and its pem written
+       to $HOME/.ssh/{keypair}.pem.new with 0600 permissions
+    2. the public half of the new key is imported under the keypair name
+       right after the old key is deleted, if the import fails the old
+       public key, read from the local pem, is imported back
+    3. the new pem atomically replaces $HOME/.ssh/{keypair}.pem
+    4. the temporary keypair is deleted
+without a local pem the old key could not be restored, rotate then
+refuses unless --force is passed.  needs ssh-keygen to read the public
+half of a pem
+
+with --generate rsa|ed25519 keys are made locally by ssh-keygen and only
+the public half is sent with import_key_pair, rotate then needs no
+temporary keypair
+
+fingerprints of local pem files are cached in
+$HOME/.ssh/keypair_fingerprints.json by file modification time.  --audit
+compares them all against one describe_key_pairs call.  A pem matches
+if any of the fingerprints ec2 uses for it agrees: md5 of the der public
+key for imported rsa, sha256 of the openssh public key for imported
+ed25519, sha1 of the pkcs8 private key for rsa keys created by ec2.  The
+rsa fingerprints need openssl
+
 Example:
     call as script with optional -v argument
     -v will enable debug mode for verbose output
     -vv will enable very verbose output
 
-      $ manage_keypair.py -vv [-k keypair]
+      $ manage_keypair.py -vv [-c|-d|-r] -k keypair[,keypair...] [-j 8] [--generate rsa] [--force] [--trace]
+      $ manage_keypair.py --audit [-k keypair[,keypair...]]
 
 """
 from __future__ import absolute_import, division, print_function
 
 import os
 import sys
+import json
 import stat
+import time
 import boto3
+import base64
+import hashlib
 import platform
 import logging
 import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import aws_trace
+import aws_clients
+
+FINGERPRINT_CACHE = os.path.join(os.path.expanduser('~'), '.ssh', 'keypair_fingerprints.json')
+KEY_TYPES = {
+    'rsa': ['-t', 'rsa', '-b', '2048', '-m', 'PEM'],
+    'ed25519': ['-t', 'ed25519'],
+}
+
+_cache_lock = threading.Lock()
 
 
 def get_pem_filename(keyname):
@@ -40,11 +87,12 @@ def get_pem_filename(keyname):
     return os.path.join(os.path.expanduser('~'), '.ssh', keyname + '.pem')
 
 
-def delete_keypair(keyname):
+def delete_keypair(keyname, client=None):
     """delete ec2 keypair and delete private key file
 
     Args:
         keyname (String): name of keypair to delete
+        client: ec2 client, a new one if not passed
 
     Returns:
         response (dict)
@@ -54,7 +102,7 @@ def delete_keypair(keyname):
     log.debug('BEGIN delete_keypair')
     log.debug('parameter keyname is: {0}'.format(keyname))
 
-    client = boto3.client('ec2')
+    client = client or aws_clients.client('ec2')
 
     log.debug('deleting keypair: {0}'.format(keyname))
     # returns success if keypair does not exist
@@ -72,19 +120,20 @@ def delete_keypair(keyname):
     return response
 
 
-def write_pem(keyinfo):
+def write_pem(keyinfo, filename=None):
     """write private pem to file in $HOME/.ssh directory
     with appropriate permissions
     assumes .ssh directory exists for now
 
     Args:
         keyinfo (Dict): response from creating key
+        filename (String): file to write, defaults to the pem file of KeyName
 
     """
     log = logging.getLogger(__file__)
     log.debug('BEGIN write_pem')
     log.debug('arg keyinfo is: {0}'.format(keyinfo))
-    filename = get_pem_filename(keyinfo['KeyName'])
+    filename = filename or get_pem_filename(keyinfo['KeyName'])
     log.debug('filename to write is: {0}'.format(filename))
 
     # since we are working with keys let's be very careful that file permissions are correct
@@ -111,11 +160,12 @@ def write_pem(keyinfo):
     log.debug('END write_pem')
 
 
-def create_keypair(keypair_name):
+def create_keypair(keypair_name, client=None):
     """create an ec2 keypair and write private key to file
 
     Args:
         keypair_name (String): name of keypair to create
+        client: ec2 client, a new one if not passed
 
     Returns:
         response (Dict): includes pem and keypair_name
@@ -124,7 +174,7 @@ def create_keypair(keypair_name):
     log = logging.getLogger(__file__)
     log.debug('BEGIN create_keypair')
 
-    client = boto3.client('ec2')
+    client = client or aws_clients.client('ec2')
     response = client.create_key_pair(
         KeyName=keypair_name
     )
@@ -135,6 +185,279 @@ def create_keypair(keypair_name):
     return response
 
 
+def public_key(pem_filename):
+    """public half of a private key file in openssh format
+
+    Args:
+        pem_filename (String): private key file
+
+    Returns:
+        public key (String)
+
+    """
+    return subprocess.check_output(['ssh-keygen', '-y', '-f', pem_filename]).decode('ascii').strip()
+
+
+def generate_key(filename, key_type='rsa'):
+    """generate a private key locally with ssh-keygen, file permissions are 0600
+
+    Args:
+        filename (String): private key file to write, replaced if it exists
+        key_type (String): one of KEY_TYPES
+
+    Returns:
+        public key (String)
+
+    """
+    log = logging.getLogger(__file__)
+    log.debug('generating {0} key: {1}'.format(key_type, filename))
+    for name in (filename, filename + '.pub'):
+        if os.path.isfile(name):
+            os.remove(name)
+    subprocess.check_call(['ssh-keygen', '-q', '-N', '', '-C', os.path.basename(filename), '-f', filename] +
+                          KEY_TYPES[key_type])
+    # the public half is read from the private key, the .pub file is not kept
+    os.remove(filename + '.pub')
+    return public_key(filename)
+
+
+def import_keypair(keypair_name, key_type='rsa', client=None):
+    """generate a key locally, write its pem and import the public half to ec2
+
+    Args:
+        keypair_name (String): name of keypair to create
+        key_type (String): one of KEY_TYPES
+        client: ec2 client, a new one if not passed
+
+    Returns:
+        response (Dict): import response, includes KeyFingerprint
+
+    """
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN import_keypair')
+    client = client or aws_clients.client('ec2')
+    filename = get_pem_filename(keypair_name)
+    new_filename = '{0}.new'.format(filename)
+    try:
+        public = generate_key(new_filename, key_type)
+        response = client.import_key_pair(KeyName=keypair_name, PublicKeyMaterial=public.encode('ascii'))
+        os.rename(new_filename, filename)
+    finally:
+        if os.path.isfile(new_filename):
+            os.remove(new_filename)
+    log.debug('import response is: {0}'.format(response))
+    log.debug('END import_keypair')
+    return response
+
+
+def key_fingerprints(pem_filename):
+    """every fingerprint ec2 may show for a private key file
+
+    Args:
+        pem_filename (String): private key file
+
+    Returns:
+        list of fingerprints (String)
+
+    """
+    def colon_hex(digest):
+        return ':'.join(digest[x:x + 2] for x in range(0, len(digest), 2))
+
+    blob = base64.b64decode(public_key(pem_filename).split()[1])
+    fingerprints = [
+        # imported ed25519 keys, the ssh-keygen -l format
+        base64.b64encode(hashlib.sha256(blob).digest()).decode('ascii').rstrip('='),
+    ]
+    # rsa keys, openssl can not read openssh format ed25519 keys
+    try:
+        with open(os.devnull, 'w') as devnull:
+            # imported rsa keys, md5 of the der SubjectPublicKeyInfo
+            public_der = subprocess.check_output(['openssl', 'pkey', '-pubout', '-outform', 'DER',
+                                                  '-in', pem_filename], stderr=devnull)
+            fingerprints.append(colon_hex(hashlib.md5(public_der).hexdigest()))
+            # rsa keys created by ec2, sha1 of the der pkcs8 private key
+            private_der = subprocess.check_output(['openssl', 'pkcs8', '-topk8', '-nocrypt', '-outform', 'DER',
+                                                   '-in', pem_filename], stderr=devnull)
+            fingerprints.append(colon_hex(hashlib.sha1(private_der).hexdigest()))
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return fingerprints
+
+
+def read_fingerprint_cache(cache_file=FINGERPRINT_CACHE):
+    """cached fingerprints, dict of keyname to {'mtime': ..., 'fingerprints': [...]}"""
+    if not os.path.isfile(cache_file):
+        return {}
+    with open(cache_file) as f:
+        return json.load(f)
+
+
+def cache_fingerprints(keyname, cache_file=FINGERPRINT_CACHE):
+    """fingerprints of the local pem of a keypair, computed only when the pem changed
+
+    Returns:
+        list of fingerprints, empty if there is no local pem
+
+    """
+    filename = get_pem_filename(keyname)
+    with _cache_lock:
+        cache = read_fingerprint_cache(cache_file)
+        if not os.path.isfile(filename):
+            if cache.pop(keyname, None) is None:
+                return []
+        else:
+            mtime = os.stat(filename).st_mtime
+            if cache.get(keyname, {}).get('mtime') == mtime:
+                return cache[keyname]['fingerprints']
+            cache[keyname] = {'mtime': mtime, 'fingerprints': key_fingerprints(filename)}
+
+        tmp_name = '{0}.tmp'.format(cache_file)
+        with open(tmp_name, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.rename(tmp_name, cache_file)
+        return cache.get(keyname, {}).get('fingerprints', [])
+
+
+def audit_keypairs(keynames=None, client=None, max_workers=8):
+    """compare local pem fingerprints with ec2 using one describe_key_pairs call
+
+    Args:
+        keynames (list): names of keypairs, every keypair in ec2 if not passed
+        client: ec2 client, a new one if not passed
+        max_workers (int): number of local pem files to fingerprint at once
+
+    Returns:
+        list of (keyname, status, remote fingerprint) per keypair
+        status is one of OK, MISMATCH, NO_LOCAL_PEM, NO_REMOTE_KEY
+
+    """
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN audit_keypairs')
+    client = client or aws_clients.client('ec2')
+    remote = dict((x['KeyName'], x['KeyFingerprint']) for x in client.describe_key_pairs()['KeyPairs'])
+    keynames = keynames or sorted(remote)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        local = dict(zip(keynames, executor.map(cache_fingerprints, keynames)))
+
+    results = []
+    for keyname in keynames:
+        if keyname not in remote:
+            status = 'NO_REMOTE_KEY'
+        elif not local[keyname]:
+            status = 'NO_LOCAL_PEM'
+        elif remote[keyname].rstrip('=') in local[keyname]:
+            status = 'OK'
+        else:
+            status = 'MISMATCH'
+        results.append((keyname, status, remote.get(keyname, '')))
+    log.debug('END audit_keypairs')
+    return results
+
+
+def rotate_keypair(keyname, client=None, key_type=None, force=False):
+    """replace an ec2 keypair, the name has no key only between delete and import
+
+    Args:
+        keyname (String): name of keypair to rotate
+        client: ec2 client, a new one if not passed
+        key_type (String): generate the new key locally, one of KEY_TYPES
+        force (bool): rotate even without a local pem to restore the old key from
+
+    Returns:
+        response (Dict): import response for the new key
+
+    """
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN rotate_keypair')
+    client = client or aws_clients.client('ec2')
+    filename = get_pem_filename(keyname)
+    new_filename = '{0}.new'.format(filename)
+    temp_name = None
+
+    # the old public key is read before anything changes, a failed import restores it
+    old_public = public_key(filename) if os.path.isfile(filename) else None
+    if old_public is None and not force:
+        raise ValueError('{0} not found, a failed rotate of {1} could not restore the old key, '
+                         'pass --force to rotate anyway'.format(filename, keyname))
+
+    try:
+        if key_type:
+            new_public = generate_key(new_filename, key_type)
+        else:
+            # a failed create leaves the current key untouched
+            temp_name = '{0}-rotate-{1}'.format(keyname, int(time.time()))
+            write_pem(create_keypair(temp_name, client), new_filename)
+            new_public = public_key(new_filename)
+
+        client.delete_key_pair(KeyName=keyname)
+        try:
+            response = client.import_key_pair(KeyName=keyname, PublicKeyMaterial=new_public.encode('ascii'))
+        except Exception:
+            if old_public:
+                log.error('import of new {0} failed, restoring old public key'.format(keyname))
+                client.import_key_pair(KeyName=keyname, PublicKeyMaterial=old_public.encode('ascii'))
+            raise
+
+        # rename is atomic, the pem file always holds a complete key
+        os.rename(new_filename, filename)
+    finally:
+        if temp_name:
+            client.delete_key_pair(KeyName=temp_name)
+        if os.path.isfile(new_filename):
+            os.remove(new_filename)
+
+    log.debug('rotate response is: {0}'.format(response))
+    log.debug('END rotate_keypair')
+    return response
+
+
+def run_batch(action, keynames, max_workers=8, key_type=None, force=False):
+    """run an action on several keypairs concurrently with one shared client
+
+    Args:
+        action (String): one of create, delete, rotate
+        keynames (list): names of keypairs
+        max_workers (int): number of keypairs to work on at once
+        key_type (String): generate keys locally, one of KEY_TYPES
+        force (bool): rotate keys without a local pem, see rotate_keypair
+
+    Returns:
+        list of (keyname, status, fingerprint, seconds, error) per keypair
+
+    """
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN run_batch')
+    # clients are thread safe, one is shared by every worker
+    client = aws_clients.client('ec2')
+
+    def run(keyname):
+        start = time.time()
+        try:
+            if action == 'create' and key_type:
+                response = import_keypair(keyname, key_type, client)
+            elif action == 'create':
+                response = create_keypair(keyname, client)
+                write_pem(response)
+            elif action == 'delete':
+                response = delete_keypair(keyname, client)
+            elif action == 'rotate':
+                response = rotate_keypair(keyname, client, key_type, force)
+            else:
+                raise ValueError('unknown action: {0}'.format(action))
+            # refresh the cache while the new pem is at hand
+            cache_fingerprints(keyname)
+            return (keyname, 'OK', response.get('KeyFingerprint', ''), time.time() - start, '')
+        except Exception as err:
+            log.exception('FAILED: {0} {1}'.format(action, keyname))
+            return (keyname, 'FAILED', '', time.time() - start, str(err))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run, keynames))
+    log.debug('END run_batch')
+    return results
+
+
 def main():
     """entry function runs when script is executed."""
     log = logging.getLogger(__file__)
@@ -145,15 +468,27 @@ def main():
     # count the number of verbose options
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help='increase output detail')
-    parser.add_argument('-k', '--keypair', required=True,
-                        help='name of ec2 keypair to create')
+    parser.add_argument('--trace', nargs='?', const='aws_trace.jsonl',
+                        help='record every aws api call to this json lines file')
+    parser.add_argument('-k', '--keypair',
+                        help='name of ec2 keypair, or comma separated names')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='number of keypairs to work on at once')
     # one of create, delete, or rotate is required
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-c', '--create', action='store_true')
     group.add_argument('-d', '--delete', action='store_true')
     group.add_argument('-r', '--rotate', action='store_true')
+    group.add_argument('--audit', action='store_true',
+                       help='compare local pem files with ec2, every keypair if -k is not passed')
+    parser.add_argument('--generate', choices=sorted(KEY_TYPES),
+                        help='generate keys locally and import only the public half')
+    parser.add_argument('--force', action='store_true',
+                        help='rotate keypairs that have no local pem, their old key can not be restored')
 
     args = parser.parse_args()
+    if not args.keypair and not args.audit:
+        parser.error('argument -k/--keypair is required')
 
     # set loglevel to DEBUG if verbose
     if args.verbose >= 2:
@@ -165,26 +500,36 @@ def main():
 
     log.debug('system version is: {0}'.format(sys.version))
     log.debug('python path is: {0}'.format(sys.path))
+    if args.trace:
+        aws_trace.start(args.trace)
     log.debug('boto3 version is: {0}'.format(boto3.__version__))
 
+    keynames = [x.strip() for x in (args.keypair or '').split(',') if x.strip()]
+    if args.audit:
+        results = audit_keypairs(keynames, max_workers=args.jobs)
+        for keyname, status, fingerprint in results:
+            print('{0}  {1}  {2}'.format(keyname, status, fingerprint).rstrip())
+        if any(x[1] != 'OK' for x in results):
+            raise RuntimeError('local pem files do not match ec2 for some keypairs')
+        return
+
     if args.create:
-        response = create_keypair(args.keypair)
-        log.debug('create returned: {0}'.format(response))
-        write_pem(response)
+        action = 'create'
     elif args.delete:
-        response = delete_keypair(args.keypair)
-        log.debug('delete returned: {0}'.format(response))
+        action = 'delete'
     elif args.rotate:
-        response = delete_keypair(args.keypair)
-        log.debug('delete returned: {0}'.format(response))
-        response = create_keypair(args.keypair)
-        log.debug('create returned: {0}'.format(response))
-        write_pem(response)
+        action = 'rotate'
     else:
         # argparse mutually exclusive group guaruntees this will never happen
         raise ValueError('one of create, delete, or rotate was not passes as argument' +
                          'but somehow argument parser allowed this')
 
+    results = run_batch(action, keynames, max_workers=args.jobs, key_type=args.generate, force=args.force)
+    for keyname, status, fingerprint, seconds, error in results:
+        print('{0}  {1}  {2}  {3:.1f}s  {4}'.format(keyname, status, fingerprint, seconds, error).rstrip())
+    if any(x[1] != 'OK' for x in results):
+        raise RuntimeError('{0} failed for some keypairs'.format(action))
+
 
 if __name__ == '__main__':
     try:
@@ -1,7 +1,20 @@
 #!/bin/sh
 
-# connect to redshift thorugh ssh tunnel
+# connect to redshift through ssh tunnel, see ssh_tunnel_rs.sh
 # psql --dbname=test --port=5439 --password --username=billybob
+#
+# --direct connects to the cluster endpoint from the stack outputs cached
+# by cfn.py instead, the cluster is private so only from inside the vpc,
+# for example on the bastion.  One list_stacks call checks the cache, the
+# stack is described only when it changed, see cfn_outputs.py
+HOST=localhost
+if [ "$1" = "--direct" ]; then
+    STACK=${OWNER}-${AWS_DEFAULT_PROFILE}-rs
+    ENV_FILE=~/.aws/cfn_cache/${STACK}.env
+    python cfn_outputs.py --stacks ${STACK} > /dev/null || exit 1
+    . "${ENV_FILE}"
+    HOST=${ClusterEndpoint%:*}
+fi
 
 # use password from .pgpass
-psql --dbname=test --port=5439 --username=billybob
+psql --dbname=test --port=5439 --username=billybob --host=${HOST}
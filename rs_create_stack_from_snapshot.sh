@@ -1,7 +1,8 @@
 #!/bin/bash
 
-# need to update to use cfn.py and etc templates to pass snapshot name
-# or modify cfn.py to take an optional snapshot name parameter
-./rs.py --create --snapshot=r619185-lab-rs-redshift-20170502
-
-
+# restore redshift from snapshot $1, or from the newest snapshot of the rs stack
+if [ -n "$1" ]; then
+    ./cfn.py --create --type_of_stack rs --snapshot "$1"
+else
+    ./cfn.py --create --type_of_stack rs --restore-latest
+fi
@@ -1,2 +1,2 @@
 #!/bin/bash
-aws s3 cp rs.yaml s3://${S3BUCKET}/cloudformation/rs.yaml --sse AES256
+./upload_templates.py --types rs
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+'''spectrum_partitions.py
+
+register new s3 partitions of a redshift spectrum external table
+
+partition prefixes like s3://bucket/path/saledate=2008-01/ are found by
+listing one partition level at a time, every prefix of a level listed
+concurrently with a paginated delimiter listing.  Partitions already in
+SVV_EXTERNAL_PARTITIONS are skipped by location and the new ones are
+added with batched statements
+
+    alter table spectrum.sales_part add if not exists
+    partition (saledate='2008-01-01') location 's3://.../saledate=2008-01/'
+    partition (saledate='2008-02-01') location 's3://.../saledate=2008-02/'
+    ...
+
+statements are printed, or run with --execute.  Connects to
+localhost:5439 by default, through ssh_tunnel_rs.sh, needs psycopg2 and
+the password in PGPASSWORD or ~/.pgpass.
+
+to test against a local s3 stand-in (moto_server, minio) and a local
+postgres pass --endpoint-url and --partitions-view, the view needs
+schemaname, tablename and location columns like SVV_EXTERNAL_PARTITIONS
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ python spectrum_partitions.py -t spectrum.sales_part \\
+            -l s3://awssampledbuswest2/tickit/spectrum/sales_partition/ \\
+            --value-format '{0}-01' [--execute] [--user billybob --dbname test]
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import re
+import sys
+import logging
+import argparse
+import platform
+from concurrent.futures import ThreadPoolExecutor
+
+# redshift accepts up to 100 partitions in one alter table statement
+BATCH_SIZE = 100
+PARTITION_RE = re.compile(r'^([^=/]+)=([^/]*)/$')
+TABLE_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_$]*\.[A-Za-z_][A-Za-z0-9_$]*$')
+
+
+def split_location(location):
+    '''(bucket, prefix) of s3://bucket/prefix/, prefix always ends with /'''
+    if not location.startswith('s3://'):
+        raise ValueError('not an s3 location: {0}'.format(location))
+    bucket, _, prefix = location[len('s3://'):].partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    return bucket, prefix
+
+
+def list_prefixes(client, bucket, prefix):
+    '''sub prefixes one level below prefix with a paginated delimiter listing'''
+    paginator = client.get_paginator('list_objects_v2')
+    prefixes = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        prefixes.extend(x['Prefix'] for x in page.get('CommonPrefixes', []))
+    return prefixes
+
+
+def partition_prefixes(client, location, depth=1, max_workers=16):
+    '''every partition prefix under location
+
+    Args:
+        client: s3 client
+        location (String): s3://bucket/prefix/ of the external table
+        depth (int): number of partition columns
+        max_workers (int): prefixes listed at once
+
+    Returns:
+        list of (list of (column, value), s3 location) sorted by location
+    '''
+    log = logging.getLogger(__file__)
+    bucket, root = split_location(location)
+    level = [root]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for number in range(depth):
+            level = [x for prefixes in executor.map(lambda p: list_prefixes(client, bucket, p), level)
+                     for x in prefixes
+                     if PARTITION_RE.match(x[len(root):].split('/')[number] + '/')]
+            log.debug('level {0} has {1} prefixes'.format(number + 1, len(level)))
+
+    partitions = []
+    for prefix in sorted(level):
+        columns = [PARTITION_RE.match(x + '/').groups() for x in prefix[len(root):].rstrip('/').split('/')]
+        partitions.append((columns, 's3://{0}/{1}'.format(bucket, prefix)))
+    return partitions
+
+
+def registered_locations(conn, table, view='svv_external_partitions'):
+    '''locations of the partitions already added to an external table'''
+    schema, _, name = table.partition('.')
+    cursor = conn.cursor()
+    cursor.execute('select location from {0} where schemaname = %s and tablename = %s'.format(view),
+                   (schema, name))
+    return set(x[0].rstrip('/') + '/' for x in cursor.fetchall())
+
+
+def quote(value):
+    '''sql string literal'''
+    return "'{0}'".format(value.replace("'", "''"))
+
+
+def add_partition_statements(table, partitions, value_format='{0}', batch_size=BATCH_SIZE):
+    '''batched alter table add if not exists partition statements
+
+    Args:
+        table (String): schema.table
+        partitions (list): (list of (column, value), location) to add
+        value_format (String): format applied to every partition value, for
+            example '{0}-01' for a date column with month prefixes
+        batch_size (int): partitions per statement
+
+    Returns:
+        list of sql statements
+    '''
+    if not TABLE_RE.match(table):
+        raise ValueError('table must be schema.table: {0}'.format(table))
+    statements = []
+    for start in range(0, len(partitions), batch_size):
+        lines = ['alter table {0} add if not exists'.format(table)]
+        for columns, location in partitions[start:start + batch_size]:
+            values = ', '.join('{0}={1}'.format(x, quote(value_format.format(y))) for x, y in columns)
+            lines.append('partition ({0}) location {1}'.format(values, quote(location)))
+        statements.append('\n'.join(lines) + ';')
+    return statements
+
+
+def new_partitions(partitions, registered):
+    '''partitions whose location is not registered yet'''
+    return [x for x in partitions if x[1] not in registered]
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    parser = argparse.ArgumentParser(description='add new s3 partitions to a spectrum external table')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('-t', '--table', required=True,
+                        help='external table as schema.table')
+    parser.add_argument('-l', '--location', required=True,
+                        help='s3 location of the external table')
+    parser.add_argument('--depth', type=int, default=1,
+                        help='number of partition columns')
+    parser.add_argument('--value-format', default='{0}',
+                        help='format applied to partition values')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='partitions per statement')
+    parser.add_argument('-j', '--jobs', type=int, default=16,
+                        help='s3 prefixes listed at once')
+    parser.add_argument('--execute', action='store_true',
+                        help='run the statements instead of printing them')
+    parser.add_argument('--all', action='store_true',
+                        help='do not query registered partitions, emit every partition')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5439)
+    parser.add_argument('--dbname', default='test')
+    parser.add_argument('--user', default='billybob')
+    parser.add_argument('--endpoint-url',
+                        help='s3 endpoint, for a local s3 stand-in')
+    parser.add_argument('--partitions-view', default='svv_external_partitions',
+                        help='view of registered partitions, for a local postgres')
+    args = parser.parse_args()
+
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+
+    import aws_clients
+
+    client = aws_clients.client('s3', endpoint_url=args.endpoint_url)
+    partitions = partition_prefixes(client, args.location, depth=args.depth, max_workers=args.jobs)
+    log.info('found {0} partitions under {1}'.format(len(partitions), args.location))
+
+    conn = None
+    if args.execute or not args.all:
+        import psycopg2
+
+        conn = psycopg2.connect(host=args.host, port=args.port, dbname=args.dbname, user=args.user)
+        # alter table on an external table can not run inside a transaction
+        conn.autocommit = True
+    if not args.all:
+        partitions = new_partitions(partitions, registered_locations(conn, args.table, args.partitions_view))
+        log.info('{0} partitions are new'.format(len(partitions)))
+
+    statements = add_partition_statements(args.table, partitions, args.value_format, args.batch_size)
+    if not args.execute:
+        for statement in statements:
+            print(statement)
+        return
+    cursor = conn.cursor()
+    for statement in statements:
+        log.debug(statement)
+        cursor.execute(statement)
+    log.info('ran {0} statements'.format(len(statements)))
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+'''sql_run.py
+
+run sql script files against redshift or aurora, stage by stage
+
+files are named {stage}_{name}.sql or .pgsql, the numeric prefix is the
+stage and not a position: 10_* runs before 20_* before 99_*, and every file
+of one stage runs concurrently, each on its own connection from a pool.  A
+stage starts only when the previous one succeeded.  Files that do not
+depend on each other share a prefix, files that do get a later one, for
+example home/psql/cell_level
+
+    10_users_and_groups
+    20_ddl
+    30_functions  30_lineorder  30_tags    concurrently
+    90_test
+    99_cleanup
+
+a file without a numeric prefix is a stage of its own, run in the order given.
+
+statements run one at a time with autocommit like psql does.  By default
+a file stops at its first error and no later stage starts, with
+--continue-on-error every statement of every stage runs like psql without
+ON_ERROR_STOP, the exit status still shows that something failed.  psql
+\\c {database} switches the connection of the rest of the file, other
+backslash commands are skipped.  A connection that ran a set statement is
+closed instead of going back to the pool.
+
+host and port come from the rs or ar stack outputs, see cfn_outputs.py,
+or with --tunnel from the local ports of the ssh tunnel scripts.  Redshift
+needs psycopg2 with the password in PGPASSWORD or ~/.pgpass, aurora needs
+pymysql with the password in MYSQL_PWD.
+
+wall time of every statement and the rows it returned, up to
+MAX_RESULT_ROWS, are written to a json report.  Result sets are printed
+per file and the slowest statements at the end
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ python sql_run.py [-vv] [-t rs] [--tunnel] [-j 4] [--report sql_report.json] [--continue-on-error] home/psql/cell_level
+      $ python sql_run.py -t ar --tunnel setup.sql test.sql
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from os.path import basename, isdir, join
+
+STAGE_RE = re.compile(r'^(\d+)_')
+SQL_EXTENSIONS = ('.sql', '.pgsql')
+DOLLAR_RE = re.compile(r'\$[A-Za-z_0-9]*\$')
+# keeps passwords of create user statements out of the report
+PASSWORD_RE = re.compile(r"(password\s+)'[^']*'", re.IGNORECASE)
+# rows of a result set kept in the report, the rest is counted only
+MAX_RESULT_ROWS = 1000
+
+# output with the endpoint and default port by stack type
+ENGINES = {
+    'rs': ('ClusterEndpoint', 5439),
+    'ar': ('EndPointAddress', 3306),
+}
+
+
+def stages(paths):
+    '''group sql files into stages by numeric prefix, files sharing a prefix share a stage
+
+    Args:
+        paths (list): sql files and directories of sql files
+
+    Returns:
+        list of (stage name, list of files) in run order
+    '''
+    files = []
+    for path in paths:
+        if isdir(path):
+            files.extend(sorted(join(path, x) for x in os.listdir(path) if x.endswith(SQL_EXTENSIONS)))
+        else:
+            files.append(path)
+
+    numbered = defaultdict(list)
+    result = []
+    for path in files:
+        match = STAGE_RE.match(basename(path))
+        if match:
+            numbered[int(match.group(1))].append(path)
+        else:
+            result.append((basename(path), [path]))
+    return [(str(x), numbered[x]) for x in sorted(numbered)] + result
+
+
+def split_statements(text):
+    '''split sql text into statements and psql backslash commands
+
+    semicolons inside quotes, comments and dollar quoted bodies do not
+    end a statement
+
+    Returns:
+        list of (line number, statement text)
+    '''
+    statements = []
+    current = []
+    line = start = 1
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '\n':
+            line += 1
+        if not ''.join(current).strip():
+            start = line
+            # psql meta command at the start of a statement
+            if char == '\\' and (i == 0 or text[i - 1] == '\n'):
+                end = text.find('\n', i)
+                end = len(text) if end < 0 else end
+                statements.append((line, text[i:end].strip()))
+                current = []
+                i = end
+                continue
+        if text.startswith('--', i):
+            end = text.find('\n', i)
+            i = len(text) if end < 0 else end
+            continue
+        if text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            end = len(text) if end < 0 else end + 2
+            line += text.count('\n', i, end)
+            i = end
+            continue
+        dollar = DOLLAR_RE.match(text, i) if char == '$' else None
+        if char in ('"', "'") or dollar:
+            quote = dollar.group(0) if dollar else char
+            end = text.find(quote, i + len(quote))
+            end = len(text) if end < 0 else end + len(quote)
+            line += text.count('\n', i, end)
+            current.append(text[i:end])
+            i = end
+            continue
+        if char == ';':
+            # a stray semicolon is not an empty statement
+            if ''.join(current).strip():
+                statements.append((start, ''.join(current).strip()))
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    if ''.join(current).strip():
+        statements.append((start, ''.join(current).strip()))
+    return statements
+
+
+def endpoint(type_of_stack, tunnel=False):
+    '''(host, port) of the database of a stack type'''
+    if tunnel:
+        from ssh_create_scripts import ENDPOINTS
+        return 'localhost', [x.local_port for x in ENDPOINTS if x.type_of_stack == type_of_stack][0]
+
+    from cfn_outputs import get_output, stack_prefix
+    output, default_port = ENGINES[type_of_stack]
+    value = get_output('{0}-{1}'.format(stack_prefix(), type_of_stack), output)
+    # redshift outputs host:port, aurora only the host
+    host, _, port = value.partition(':')
+    return host, int(port) if port else default_port
+
+
+def connector(type_of_stack, host, port, user):
+    '''function connecting to a database by name with autocommit on'''
+    if type_of_stack == 'rs':
+        import psycopg2
+
+        def connect(database):
+            conn = psycopg2.connect(host=host, port=port, user=user, dbname=database)
+            conn.autocommit = True
+            return conn
+    else:
+        import pymysql
+
+        def connect(database):
+            return pymysql.connect(host=host, port=port, user=user, password=os.environ.get('MYSQL_PWD', ''),
+                                   database=database, autocommit=True)
+    return connect
+
+
+class ConnectionPool(object):
+    '''idle connections kept per database and reused by later files
+
+    Args:
+        connect (callable): opens a connection to a database by name
+    '''
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.idle = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def get(self, database):
+        '''an idle connection to database, or a new one'''
+        with self.lock:
+            if self.idle[database]:
+                return self.idle[database].pop()
+        return self.connect(database)
+
+    def put(self, database, conn, reusable=True):
+        '''return a connection, connections with session state are closed'''
+        if not reusable:
+            conn.close()
+            return
+        with self.lock:
+            self.idle[database].append(conn)
+
+    def close(self):
+        '''close every idle connection'''
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
+
+
+def run_file(pool, path, database, stage, stop_on_error=True):
+    '''run the statements of one file on one connection
+
+    Returns:
+        list of report rows, one per statement, stops at the first error
+        unless stop_on_error is False
+    '''
+    log = logging.getLogger(__file__)
+    with open(path) as f:
+        statements = split_statements(f.read())
+
+    rows = []
+    conn = None
+    reusable = True
+    try:
+        for number, (line, sql) in enumerate(statements):
+            if sql.startswith('\\'):
+                command = sql.split()
+                if command[0] in ('\\c', '\\connect') and len(command) > 1:
+                    if conn is not None:
+                        pool.put(database, conn, reusable)
+                        conn = None
+                    database, reusable = command[1], True
+                else:
+                    log.warning('{0}:{1} skipping psql command {2}'.format(path, line, sql))
+                continue
+
+            conn = conn or pool.get(database)
+            reusable = reusable and not re.match(r'^(set|reset)\s', sql, re.IGNORECASE)
+            row = {'stage': stage, 'file': path, 'line': line, 'statement': number,
+                   'database': database, 'sql': PASSWORD_RE.sub(r"\1'***'", ' '.join(sql.split()))[:200]}
+            start = time.time()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(sql)
+                row['rows'] = cursor.rowcount
+                if cursor.description is not None:
+                    # a statement returning rows, select or show
+                    row['columns'] = [x[0] for x in cursor.description]
+                    row['result'] = [list(x) for x in cursor.fetchmany(MAX_RESULT_ROWS)]
+            except Exception as err:
+                row['error'] = str(err).strip()
+                reusable = False
+            row['seconds'] = round(time.time() - start, 3)
+            rows.append(row)
+            log.debug('{0}:{1} {2:.3f}s'.format(path, line, row['seconds']))
+            if 'error' in row:
+                log.error('{0}:{1} failed: {2}'.format(path, line, row['error']))
+                if stop_on_error:
+                    break
+    finally:
+        if conn is not None:
+            pool.put(database, conn, reusable)
+    return rows
+
+
+def format_result(row):
+    '''result set of a report row as tab separated lines, like psql -A -F tab'''
+    lines = ['\t'.join(row['columns'])]
+    lines.extend('\t'.join('' if x is None else str(x) for x in values) for values in row['result'])
+    if row['rows'] > len(row['result']):
+        lines.append('({0} rows, {1} shown)'.format(row['rows'], len(row['result'])))
+    else:
+        lines.append('({0} rows)'.format(len(row['result'])))
+    return '\n'.join(lines)
+
+
+def run_stages(pool, plan, database, max_workers=4, stop_on_error=True):
+    '''run stages in order and the files of each stage concurrently
+
+    Returns:
+        (list of report rows, list of per stage dicts), stops after a failed
+        stage unless stop_on_error is False
+    '''
+    log = logging.getLogger(__file__)
+    rows = []
+    summary = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for stage, files in plan:
+            start = time.time()
+            stage_rows = [x for result in executor.map(lambda p: run_file(pool, p, database, stage, stop_on_error),
+                                                       files)
+                          for x in result]
+            rows.extend(stage_rows)
+            failed = any('error' in x for x in stage_rows)
+            summary.append({'stage': stage, 'files': files, 'seconds': round(time.time() - start, 3),
+                            'failed': failed})
+            log.info('stage {0}: {1} files in {2:.1f}s{3}'.format(
+                stage, len(files), time.time() - start, ' FAILED' if failed else ''))
+            if failed and stop_on_error:
+                break
+    return rows, summary
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    parser = argparse.ArgumentParser(description='run sql files stage by stage with concurrent files')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('paths', nargs='+',
+                        help='sql files or directories of sql files')
+    parser.add_argument('-t', '--type_of_stack', choices=sorted(ENGINES), default='rs',
+                        help='database stack to run against')
+    parser.add_argument('--tunnel', action='store_true',
+                        help='connect to localhost through the ssh tunnel')
+    parser.add_argument('--host',
+                        help='database host, instead of the stack outputs')
+    parser.add_argument('--port', type=int,
+                        help='database port, instead of the stack outputs')
+    parser.add_argument('--dbname', default='test')
+    parser.add_argument('--user', default='billybob')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='files of a stage run at once')
+    parser.add_argument('--report', default='sql_report.json',
+                        help='json file with the time of every statement')
+    parser.add_argument('--slowest', type=int, default=10,
+                        help='number of slowest statements to print')
+    parser.add_argument('--continue-on-error', action='store_true',
+                        help='run every statement and stage after an error, like psql does')
+    args = parser.parse_args()
+
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+
+    plan = stages(args.paths)
+    if args.host:
+        host, port = args.host, args.port or ENGINES[args.type_of_stack][1]
+    else:
+        host, port = endpoint(args.type_of_stack, args.tunnel)
+        port = args.port or port
+    log.info('running {0} stages against {1}:{2}'.format(len(plan), host, port))
+
+    pool = ConnectionPool(connector(args.type_of_stack, host, port, args.user))
+    start = time.time()
+    try:
+        rows, summary = run_stages(pool, plan, args.dbname, max_workers=args.jobs,
+                                   stop_on_error=not args.continue_on_error)
+    finally:
+        pool.close()
+
+    with open(args.report, 'w') as f:
+        json.dump({'host': host, 'port': port, 'seconds': round(time.time() - start, 3),
+                   'stages': summary, 'statements': rows}, f, indent=2, default=str)
+    for row in rows:
+        if 'result' in row:
+            print('{0}:{1}\n{2}\n'.format(row['file'], row['line'], format_result(row)))
+    for row in sorted(rows, key=lambda x: -x['seconds'])[:args.slowest]:
+        print('{0:8.3f}s  {1}:{2}  {3}'.format(row['seconds'], row['file'], row['line'], row['sql'][:60]))
+    log.info('wrote {0}'.format(args.report))
+    failed = [x['stage'] for x in summary if x['failed']]
+    if failed:
+        raise RuntimeError('stages {0} failed'.format(failed))
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
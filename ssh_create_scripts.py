@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+'''create every ssh login and tunnel script in one pass
+
+the bastion ip and every database endpoint (rs, ar, mysql) are resolved
+with one batched stack outputs lookup, see cfn_outputs.py.  Stacks that
+do not exist are skipped.  Outputs cached by cfn.py within the last 12
+hours are used without any aws call.
+
+writes
+    ssh_ec2.sh            login to the bastion
+    ssh_tunnel_rs.sh      localhost:5439 to redshift
+    ssh_tunnel_ar.sh      localhost:3306 to aurora
+    ssh_tunnel_mysql.sh   localhost:3307 to mysql
+
+with --ssh-config FILE writes an ssh_config instead, with one host entry
+holding every forward and ControlMaster multiplexing so that all tunnels
+and logins share one ssh connection through the bastion
+
+      $ ssh -F FILE -fN {prefix}-bastion     # open every tunnel
+      $ ssh -F FILE {prefix}-bastion         # login over the same connection
+
+replaces ssh_ec2_create_script.py, ssh_tunnel_ar_create_script.py and
+ssh_tunnel_redshift_create_script.py
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ python ssh_create_scripts.py [-vv] [--ssh-config ssh_config] [--wait] [--trace]
+
+'''
+import os
+import sys
+import logging
+import argparse
+import platform
+from collections import namedtuple
+
+import aws_trace
+from cfn_outputs import CACHE_MAX_AGE, get_outputs, stack_prefix
+
+# stack type, output with the endpoint, local port, remote port, script name
+Endpoint = namedtuple('Endpoint', ['type_of_stack', 'output', 'local_port', 'remote_port', 'script_name'])
+
+ENDPOINTS = [
+    Endpoint('rs', 'ClusterEndpoint', 5439, 5439, 'ssh_tunnel_rs.sh'),
+    Endpoint('ar', 'EndPointAddress', 3306, 3306, 'ssh_tunnel_ar.sh'),
+    Endpoint('mysql', 'EndPointAddress', 3307, 3306, 'ssh_tunnel_mysql.sh'),
+]
+
+# host, port and local port of a resolved forward
+Forward = namedtuple('Forward', ['name', 'local_port', 'host', 'port'])
+
+
+def resolve_endpoints(prefix, endpoints=ENDPOINTS, max_age=None):
+    '''bastion ip and database forwards from one batched outputs lookup
+
+    Args:
+        prefix (String): stack name prefix {OWNER}-{AWS_DEFAULT_PROFILE}
+        endpoints (list): Endpoint definitions
+        max_age (float): describe stacks again once their cache entry is older,
+            see cfn_outputs.get_outputs
+
+    Returns:
+        (bastion ip String, list of Forward for stacks that exist)
+    '''
+    log = logging.getLogger(__file__)
+    log.debug('START resolve_endpoints')
+    names = ['{0}-ec2'.format(prefix)] + ['{0}-{1}'.format(prefix, x.type_of_stack) for x in endpoints]
+    outputs = get_outputs(names, ignore_missing=True, max_age=max_age)
+    if names[0] not in outputs:
+        raise ValueError('bastion stack {0} does not exist'.format(names[0]))
+    bastion = outputs[names[0]]['PublicIP']
+
+    forwards = []
+    for endpoint in endpoints:
+        stack_name = '{0}-{1}'.format(prefix, endpoint.type_of_stack)
+        if stack_name not in outputs:
+            log.info('{0} does not exist, skipping'.format(stack_name))
+            continue
+        # redshift outputs host:port, aurora only the host
+        host, _, port = outputs[stack_name][endpoint.output].partition(':')
+        forwards.append(Forward(endpoint.type_of_stack, endpoint.local_port, host,
+                                int(port) if port else endpoint.remote_port))
+    log.debug('END resolve_endpoints')
+    return bastion, forwards
+
+
+def write_script(script_name, lines):
+    '''write an executable shell script'''
+    with open(script_name, 'w') as f:
+        f.writelines(lines)
+    # python 3 0o775
+    # python 2 0775
+    os.chmod(script_name, 0o775)
+
+
+def write_scripts(prefix, bastion, forwards, endpoints=ENDPOINTS):
+    '''write the login script and one tunnel script per forward
+
+    Returns:
+        list of script names written
+    '''
+    write_script('ssh_ec2.sh', ['#!/bin/sh \n',
+                                'ssh ec2-user@{0} \\\n'.format(bastion),
+                                '\t-i ~/.ssh/{0}.pem \n'.format(prefix)])
+    written = ['ssh_ec2.sh']
+    script_names = dict((x.type_of_stack, x.script_name) for x in endpoints)
+    for forward in forwards:
+        write_script(script_names[forward.name], [
+            '#!/bin/sh \n',
+            'ssh -f ec2-user@{0} \\\n'.format(bastion),
+            '\t-i ~/.ssh/{0}.pem \\\n'.format(prefix),
+            '\t-L localhost:{0}:{1}:{2}'.format(forward.local_port, forward.host, forward.port),
+            ' \\\n',
+            '\t-o "ExitOnForwardFailure yes" -o "ServerAliveInterval 60" \\\n',
+            '\t-N'])
+        written.append(script_names[forward.name])
+    return written
+
+
+def ssh_config(prefix, bastion, forwards):
+    '''ssh_config text with every forward on one multiplexed bastion host entry'''
+    lines = [
+        'Host {0}-bastion'.format(prefix),
+        '    HostName {0}'.format(bastion),
+        '    User ec2-user',
+        '    IdentityFile ~/.ssh/{0}.pem'.format(prefix),
+        '    ControlMaster auto',
+        '    ControlPath ~/.ssh/cm-%r@%h:%p',
+        '    ControlPersist 10m',
+        '    ExitOnForwardFailure yes',
+        '    ServerAliveInterval 60',
+    ]
+    for forward in forwards:
+        lines.append('    # {0}'.format(forward.name))
+        lines.append('    LocalForward localhost:{0} {1}:{2}'.format(forward.local_port, forward.host, forward.port))
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    # parse command line arguments
+    parser = argparse.ArgumentParser(description='create ssh login and tunnel scripts for every endpoint')
+    # count the number of verbose options
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('--trace', nargs='?', const='aws_trace.jsonl',
+                        help='record every aws api call to this json lines file')
+    parser.add_argument('--ssh-config',
+                        help='write a multiplexed ssh_config to this file instead of scripts')
+    parser.add_argument('-w', '--wait', action='store_true',
+                        help='first wait for the bastion, redshift and aurora concurrently')
+
+    args = parser.parse_args()
+    # set loglevel to DEBUG if verbose
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+    if args.trace:
+        aws_trace.start(args.trace)
+
+    prefix = stack_prefix()
+    if args.wait:
+        from wait_ready import wait_all
+        wait_all(['ec2', 'rs', 'ar'], prefix=prefix)
+    bastion, forwards = resolve_endpoints(prefix, max_age=CACHE_MAX_AGE)
+
+    if args.ssh_config:
+        with open(args.ssh_config, 'w') as f:
+            f.write(ssh_config(prefix, bastion, forwards))
+        log.info('wrote {0}, open every tunnel with: ssh -F {0} -fN {1}-bastion'.format(args.ssh_config, prefix))
+    else:
+        log.info('wrote {0}'.format(write_scripts(prefix, bastion, forwards)))
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
@@ -3,7 +3,6 @@
 
 TODO:
     functions are duplicated in ssh_tunnel_redshift_create_script.py
-    create a library/module of cfn outputs and exports
 
 Example:
     call as script with optional -v argument
@@ -15,25 +14,22 @@ Example:
 '''
 import os
 import sys
-import boto3
 import logging
 import argparse
 import platform
 
+import aws_trace
+import aws_clients
+from cfn_outputs import CACHE_MAX_AGE, get_output, stack_prefix
+
 
 # plan to convert this to an object later
 # these will be properties / construtor items
-# uses cfn exports instead now
+# uses cfn outputs instead now, looked up through cfn_outputs
+# which makes no aws calls until a value is needed
 # has functions to support either way
 EC2_IDENTIFIER = 'i-98d90b45'
-cfn_client = boto3.client('cloudformation')
-cloudformation = boto3.resource('cloudformation')
-response = cfn_client.list_exports()
-
-# use dict comprehention to extract out key, values from cloudformation exports
-exports = { x['Name']: x['Value'] for x in response['Exports'] }
-
-prefix = '{0}-{1}'.format(os.environ['OWNER'], os.environ['AWS_DEFAULT_PROFILE'])
+prefix = stack_prefix()
 
 
 def get_ec2_public_ip_from_cfn_export():
@@ -42,10 +38,9 @@ def get_ec2_public_ip_from_cfn_export():
          Returns (String) - public IP
     '''
     log.debug('START get_ec2_public_ip_from_cfn_export')
-    stack = cloudformation.Stack('{0}-ec2'.format(prefix))
-    outputs = { x['OutputKey']: x['OutputValue'] for x in stack.outputs }
+    value = get_output('{0}-ec2'.format(prefix), 'PublicIP', max_age=CACHE_MAX_AGE)
     log.debug('END get_ec2_public_ip_from_cfn_export')
-    return outputs['PublicIP']
+    return value
 
 
 def get_ec2_public_ip_from_identifier():
@@ -55,7 +50,7 @@ def get_ec2_public_ip_from_identifier():
     '''
     log.debug('START get_ec2_public_ip_from_identifier')
 
-    ec2_instance = boto3.resource('ec2').Instance(EC2_IDENTIFIER)
+    ec2_instance = aws_clients.resource('ec2').Instance(EC2_IDENTIFIER)
 
     log.debug('END get_ec2_public_ip_from_identifier')
     return ec2_instance.public_ip_address
@@ -71,6 +66,8 @@ def main():
     # count the number of verbose options
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help='increase output detail')
+    parser.add_argument('--trace', nargs='?', const='aws_trace.jsonl',
+                        help='record every aws api call to this json lines file')
 
     args = parser.parse_args()
     # set loglevel to DEBUG if verbose
@@ -83,6 +80,8 @@ def main():
 
     log.debug('system version is: {0}'.format(sys.version))
     log.debug('python path is: {0}'.format(sys.path))
+    if args.trace:
+        aws_trace.start(args.trace)
 
     # create ssh tunnel shell script
     with open('ssh_ec2.sh', 'w') as f:
@@ -4,37 +4,33 @@
 Create a ssh tunnel script ssh_tunnel_ar.sh for current running
 bastion host and aurora instance
 
-TODO:
-    add waiter for aurora to be up like the redshift does
+with --wait first waits for the aurora cluster and its instances to be
+available, see wait_ready.py
 
 Example:
     call as script with optional -v argument
     -v will enable debug mode for verbose output
     -vv will enable very verbose output
 
-      $ python ssh_tunnel_ar_create_script.py [-vv]
+      $ python ssh_tunnel_ar_create_script.py [-vv] [--wait]
 
 '''
 import os
 import sys
-import boto3
 import logging
 import argparse
 import platform
 
+import aws_trace
+from cfn_outputs import CACHE_MAX_AGE, get_output, get_outputs, stack_prefix
+from wait_ready import wait_all
+
 
 # plan to convert this to an object later
 # these will be properties / construtor items
-# uses cfn exports instead now
-cfn_client = boto3.client('cloudformation')
-response = cfn_client.list_exports()
-# script doesn't use any exports yet
-# use dict comprehention to extract out key, values from cloudformation exports
-exports = { x['Name']: x['Value'] for x in response['Exports'] }
-
-prefix = '{0}-{1}'.format(os.environ['OWNER'], os.environ['AWS_DEFAULT_PROFILE'])
-
-cloudformation = boto3.resource('cloudformation')
+# uses cfn outputs instead now, looked up through cfn_outputs
+# which makes no aws calls until a value is needed
+prefix = stack_prefix()
 
 
 def get_ec2_public_ip_from_cfn_export():
@@ -43,10 +39,9 @@ def get_ec2_public_ip_from_cfn_export():
          Returns (String) - public IP
     '''
     log.debug('START get_ec2_public_ip_from_cfn_export')
-    stack = cloudformation.Stack('{0}-ec2'.format(prefix))
-    outputs = { x['OutputKey']: x['OutputValue'] for x in stack.outputs }
+    value = get_output('{0}-ec2'.format(prefix), 'PublicIP')
     log.debug('END get_ec2_public_ip_from_cfn_export')
-    return outputs['PublicIP']
+    return value
 
 
 def get_aurora_endpoint_from_cfn_export():
@@ -55,11 +50,9 @@ def get_aurora_endpoint_from_cfn_export():
          Returns (String) - host:port format
     '''
     log.debug('START get_aurora_endpoint_from_cfn_export')
-    # references cloudformation from outside function - fix
-    stack = cloudformation.Stack('{0}-ar'.format(prefix))
-    outputs = { x['OutputKey']: x['OutputValue'] for x in stack.outputs }
+    value = get_output('{0}-ar'.format(prefix), 'EndPointAddress')
     log.debug('END get_aurora_endpoint_from_cfn_export')
-    return outputs['EndPointAddress']
+    return value
 
 
 def main():
@@ -72,6 +65,10 @@ def main():
     # count the number of verbose options
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help='increase output detail')
+    parser.add_argument('--trace', nargs='?', const='aws_trace.jsonl',
+                        help='record every aws api call to this json lines file')
+    parser.add_argument('-w', '--wait', action='store_true',
+                        help='wait for aurora to be available first')
 
     args = parser.parse_args()
     # set loglevel to DEBUG if verbose
@@ -84,8 +81,16 @@ def main():
 
     log.debug('system version is: {0}'.format(sys.version))
     log.debug('python path is: {0}'.format(sys.path))
+    if args.trace:
+        aws_trace.start(args.trace)
 
     script_name = 'ssh_tunnel_ar.sh'
+    if args.wait:
+        wait_all(['ar'], prefix=prefix)
+
+    # fetch both stacks in one batch, the getters below read the memoized outputs
+    get_outputs(['{0}-ec2'.format(prefix), '{0}-ar'.format(prefix)], max_age=CACHE_MAX_AGE)
+
     # create ssh tunnel shell script
     with open(script_name, 'w') as f:
         f.writelines(['#!/bin/sh \n',
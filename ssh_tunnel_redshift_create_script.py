@@ -19,27 +19,24 @@ Example:
 '''
 import os
 import sys
-import boto3
 import logging
 import argparse
 import platform
 
+import aws_trace
+import aws_clients
+from cfn_outputs import CACHE_MAX_AGE, get_output, get_outputs, stack_prefix
+from wait_ready import poll_until, redshift_ready
+
 
 # plan to convert this to an object later
 # these will be properties / construtor items
-# uses cfn exports instead now
+# uses cfn outputs instead now, looked up through cfn_outputs
+# which makes no aws calls until a value is needed
 # has functions to support either way
 REDSHIFT_CLUSTER_IDENTIFIER = 'redshift-id'
 EC2_IDENTIFIER = 'i-98d90b45'
-cfn_client = boto3.client('cloudformation')
-response = cfn_client.list_exports()
-# script doesn't use any exports yet
-# use dict comprehention to extract out key, values from cloudformation exports
-exports = { x['Name']: x['Value'] for x in response['Exports'] }
-
-prefix = '{0}-{1}'.format(os.environ['OWNER'], os.environ['AWS_DEFAULT_PROFILE'])
-
-cloudformation = boto3.resource('cloudformation')
+prefix = stack_prefix()
 
 
 def get_ec2_public_ip_from_cfn_export():
@@ -48,10 +45,9 @@ def get_ec2_public_ip_from_cfn_export():
          Returns (String) - public IP
     '''
     log.debug('START get_ec2_public_ip_from_cfn_export')
-    stack = cloudformation.Stack('{0}-ec2'.format(prefix))
-    outputs = { x['OutputKey']: x['OutputValue'] for x in stack.outputs }
+    value = get_output('{0}-ec2'.format(prefix), 'PublicIP')
     log.debug('END get_ec2_public_ip_from_cfn_export')
-    return outputs['PublicIP']
+    return value
 
 
 def get_redshift_endpoint_from_cfn_export():
@@ -60,10 +56,9 @@ def get_redshift_endpoint_from_cfn_export():
          Returns (String) - host:port format
     '''
     log.debug('START get_redshift_endpoint_from_cfn_export')
-    stack = cloudformation.Stack('{0}-rs'.format(prefix))
-    outputs = { x['OutputKey']: x['OutputValue'] for x in stack.outputs }
+    value = get_output('{0}-rs'.format(prefix), 'ClusterEndpoint')
     log.debug('END get_redshift_endpoint_from_cfn_export')
-    return outputs['ClusterEndpoint']
+    return value
 
 
 def get_ec2_public_ip_from_identifier():
@@ -73,7 +68,7 @@ def get_ec2_public_ip_from_identifier():
     '''
     log.debug('START get_ec2_public_ip_from_identifier')
 
-    ec2_instance = boto3.resource('ec2').Instance(EC2_IDENTIFIER)
+    ec2_instance = aws_clients.resource('ec2').Instance(EC2_IDENTIFIER)
 
     log.debug('END get_ec2_public_ip_from_identifier')
     return ec2_instance.public_ip_address
@@ -86,19 +81,16 @@ def get_redshift_endpoint_from_cluster_identifier():
     '''
     log.debug('START get_redshift_endpoint_from_cluster_identifier')
 
-    rdshft = boto3.client('redshift')
+    rdshft = aws_clients.client('redshift')
     # wait until redshift available
-    # Note that waiter throws exception on 'deleting' state
-    # Waiter polls every minute for 30 minutes
-    ca_waiter = rdshft.get_waiter('cluster_available')
-    ca_waiter.wait(ClusterIdentifier=REDSHIFT_CLUSTER_IDENTIFIER)
-
-    rspnce = rdshft.describe_clusters(ClusterIdentifier=REDSHIFT_CLUSTER_IDENTIFIER)
-    endpoint = rspnce['Clusters'][0]['Endpoint']
-    log.debug('endpoint is: {0}'.format(endpoint))
+    # Note that the check raises on 'deleting' state
+    # polls from 2 seconds backing off to 30 for 30 minutes, see wait_ready.py
+    address, port = poll_until(lambda: redshift_ready(rdshft, REDSHIFT_CLUSTER_IDENTIFIER),
+                               1800, REDSHIFT_CLUSTER_IDENTIFIER)
+    log.debug('endpoint is: {0}:{1}'.format(address, port))
 
     log.debug('END get_redshift_endpoint_from_cluster_identifier')
-    return '{0}:{1}'.format(endpoint['Address'], endpoint['Port'])
+    return '{0}:{1}'.format(address, port)
 
 
 def main():
@@ -111,6 +103,8 @@ def main():
     # count the number of verbose options
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help='increase output detail')
+    parser.add_argument('--trace', nargs='?', const='aws_trace.jsonl',
+                        help='record every aws api call to this json lines file')
 
     args = parser.parse_args()
     # set loglevel to DEBUG if verbose
@@ -123,8 +117,13 @@ def main():
 
     log.debug('system version is: {0}'.format(sys.version))
     log.debug('python path is: {0}'.format(sys.path))
+    if args.trace:
+        aws_trace.start(args.trace)
 
     script_name = 'ssh_tunnel_rs.sh'
+    # fetch both stacks in one batch, the getters below read the memoized outputs
+    get_outputs(['{0}-ec2'.format(prefix), '{0}-rs'.format(prefix)], max_age=CACHE_MAX_AGE)
+
     # create ssh tunnel shell script
     with open(script_name, 'w') as f:
         f.writelines(['#!/bin/sh \n',
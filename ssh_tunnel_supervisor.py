@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+'''supervise ssh tunnels through the bastion host
+
+holds every database forward (5439 redshift, 3306 aurora, 3307 mysql)
+over one multiplexed ssh connection, probes each local port and restarts
+the connection with exponential backoff when ssh exits or a port stops
+answering.  Endpoints are looked up like ssh_create_scripts.py and looked
+up again on reconnect, so a replaced bastion is picked up.
+
+status is written as json to ~/.ssh/tunnel-{prefix}.status.json after
+every check, print it with --status
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ python ssh_tunnel_supervisor.py [-vv] [--interval 10]
+      $ python ssh_tunnel_supervisor.py --status
+
+'''
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import argparse
+import platform
+import subprocess
+from os.path import expanduser
+
+import cfn_outputs
+from ssh_create_scripts import resolve_endpoints
+
+
+def status_file(prefix):
+    '''path of the status file for a stack prefix'''
+    return expanduser('~/.ssh/tunnel-{0}.status.json'.format(prefix))
+
+
+def write_status(path, status):
+    '''write status json atomically'''
+    tmp_name = '{0}.tmp'.format(path)
+    with open(tmp_name, 'w') as f:
+        json.dump(status, f, indent=2, sort_keys=True)
+    os.rename(tmp_name, path)
+
+
+def probe(port, timeout=2.0):
+    '''True if something accepts tcp connections on localhost:port'''
+    try:
+        conn = socket.create_connection(('localhost', port), timeout=timeout)
+        conn.close()
+        return True
+    except (socket.error, socket.timeout):
+        return False
+
+
+def ssh_command(prefix, bastion, forwards):
+    '''foreground ssh command holding every forward on one connection
+
+    never prompts, BatchMode makes ssh exit instead of asking for a passphrase
+    and the host key of a replaced bastion is accepted when it is new, a changed
+    key for a known address still fails.  Multiplexing is off, with the
+    ControlPath of the ssh_config from ssh_create_scripts.py the supervisor
+    would become a client of an interactive master and die with it
+    '''
+    command = [
+        'ssh', '-N',
+        '-i', expanduser('~/.ssh/{0}.pem'.format(prefix)),
+        '-o', 'BatchMode yes',
+        '-o', 'StrictHostKeyChecking accept-new',
+        '-o', 'ExitOnForwardFailure yes',
+        '-o', 'ServerAliveInterval 15',
+        '-o', 'ServerAliveCountMax 3',
+        '-o', 'ControlMaster no',
+        '-o', 'ControlPath none',
+    ]
+    for forward in forwards:
+        command.extend(['-L', 'localhost:{0}:{1}:{2}'.format(forward.local_port, forward.host, forward.port)])
+    command.append('ec2-user@{0}'.format(bastion))
+    return command
+
+
+class TunnelSupervisor(object):
+    '''run ssh with every forward and restart it when it fails
+
+    Args:
+        prefix (String): stack name prefix {OWNER}-{AWS_DEFAULT_PROFILE}
+        interval (float): seconds between health checks
+        min_backoff (float): first delay before reconnecting
+        max_backoff (float): longest delay before reconnecting
+    '''
+
+    def __init__(self, prefix, interval=10.0, min_backoff=1.0, max_backoff=60.0):
+        self.prefix = prefix
+        self.interval = interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.process = None
+        self.bastion = None
+        self.forwards = []
+        self.restarts = 0
+        self.started = None
+        self.running = True
+
+    def resolve(self):
+        '''look up the bastion and endpoints again, keep the old ones if that fails'''
+        log = logging.getLogger(__file__)
+        cfn_outputs.clear()
+        try:
+            self.bastion, self.forwards = resolve_endpoints(self.prefix)
+        except Exception:
+            if self.bastion is None:
+                raise
+            log.exception('endpoint lookup failed, reusing bastion {0}'.format(self.bastion))
+
+    def connect(self):
+        '''start ssh and wait until its forwards answer or it exits'''
+        log = logging.getLogger(__file__)
+        self.resolve()
+        command = ssh_command(self.prefix, self.bastion, self.forwards)
+        log.info('connecting: {0}'.format(' '.join(command)))
+        self.process = subprocess.Popen(command)
+        self.started = time.time()
+        deadline = time.time() + 30
+        while time.time() < deadline and self.process.poll() is None:
+            if all(probe(x.local_port) for x in self.forwards):
+                return
+            time.sleep(0.5)
+
+    def disconnect(self):
+        '''stop ssh if it is running'''
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait()
+            except OSError:
+                pass
+        self.process = None
+
+    def check(self):
+        '''health of the connection and every forward
+
+        Returns:
+            status dict
+        '''
+        alive = self.process is not None and self.process.poll() is None
+        forwards = dict((x.name, {'local_port': x.local_port, 'remote': '{0}:{1}'.format(x.host, x.port),
+                                  'ok': alive and probe(x.local_port)}) for x in self.forwards)
+        return {
+            'pid': self.process.pid if alive else None,
+            'bastion': self.bastion,
+            'state': 'up' if alive and all(x['ok'] for x in forwards.values()) else 'down',
+            'started': self.started,
+            'restarts': self.restarts,
+            'checked': time.time(),
+            'forwards': forwards,
+        }
+
+    def stop(self, *args):
+        '''stop supervising, used as a signal handler'''
+        self.running = False
+
+    def run(self):
+        '''supervise until stopped'''
+        log = logging.getLogger(__file__)
+        path = status_file(self.prefix)
+        self.connect()
+        try:
+            while self.running:
+                status = self.check()
+                write_status(path, status)
+                if status['state'] == 'up':
+                    # a connection that stayed up resets the backoff
+                    if time.time() - self.started > self.max_backoff:
+                        self.backoff = self.min_backoff
+                    time.sleep(self.interval)
+                    continue
+
+                log.warning('tunnel down: {0}, reconnecting in {1:.0f}s'.format(
+                    sorted(x for x, y in status['forwards'].items() if not y['ok']), self.backoff))
+                self.disconnect()
+                time.sleep(self.backoff)
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                self.restarts += 1
+                self.connect()
+        finally:
+            self.disconnect()
+            status = self.check()
+            status['state'] = 'stopped'
+            write_status(path, status)
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    # parse command line arguments
+    parser = argparse.ArgumentParser(description='supervise ssh tunnels through the bastion')
+    # count the number of verbose options
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('-i', '--interval', type=float, default=10.0,
+                        help='seconds between health checks')
+    parser.add_argument('--status', action='store_true',
+                        help='print the status of a running supervisor and exit')
+
+    args = parser.parse_args()
+    # set loglevel to DEBUG if verbose
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+
+    prefix = cfn_outputs.stack_prefix()
+    if args.status:
+        with open(status_file(prefix)) as f:
+            print(f.read())
+        return
+
+    supervisor = TunnelSupervisor(prefix, interval=args.interval)
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+'''stack_events.py
+
+follow cloudformation events of several stacks at once
+
+each stack keeps the id of the newest event already seen, so a poll only
+reads describe_stack_events pages until it reaches that event instead of
+the full history.  Polling starts every 2 seconds and backs off to 30
+seconds while nothing changes.  Following ends when every stack reaches a
+final status, which is returned.
+
+used on its own or by cfn.py --follow during create, update and delete.
+on_event is called with every new event as it is read, cfn.py --fail-fast
+uses it to stop at the first resource that fails, see is_resource_failure
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ stack_events.py [-v] -s mwest-default-vpc,mwest-default-sg [--history 20]
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+import logging
+import argparse
+import platform
+import threading
+from contextlib import contextmanager
+
+STACK_TYPE = 'AWS::CloudFormation::Stack'
+NOT_FOUND = 'NOT_FOUND'
+
+
+def is_final(status):
+    '''True if a stack status will not change without another operation'''
+    return status is not None and not status.endswith('_IN_PROGRESS')
+
+
+def is_failure(status):
+    '''True if a final stack status means the operation did not succeed'''
+    return status == NOT_FOUND or 'FAILED' in status or 'ROLLBACK' in status
+
+
+def is_resource_failure(event):
+    '''True if an event is a resource, not the stack itself, reaching a *_FAILED status'''
+    return event['ResourceStatus'].endswith('_FAILED') and not (
+        event['ResourceType'] == STACK_TYPE and event['LogicalResourceId'] == event['StackName'])
+
+
+def format_event(event):
+    '''one line summary of a stack event'''
+    return '{0} {1} {2} {3} {4}'.format(
+        event['Timestamp'], event['StackName'], event['LogicalResourceId'],
+        event['ResourceStatus'], event.get('ResourceStatusReason', '')).rstrip()
+
+
+class StackEventTailer(object):
+    '''incremental event reader for several stacks
+
+    Args:
+        client: cloudformation client
+        stack_names (list): stacks to follow
+        wait_for_new (bool): only a status reached after prime() counts as
+            final, use when an operation is about to start
+        on_event (callable): called as on_event(stack name, event) for every
+            event read by poll, oldest first
+    '''
+
+    def __init__(self, client, stack_names, wait_for_new=False, on_event=None):
+        self.client = client
+        self.wait_for_new = wait_for_new
+        self.on_event = on_event
+        # stack name or id to use in describe_stack_events, the id keeps
+        # working once a stack is deleted
+        self.stack_ids = dict((x, x) for x in stack_names)
+        self.watermarks = dict((x, None) for x in stack_names)
+        self.statuses = dict((x, None) for x in stack_names)
+
+    def new_events(self, stack_name):
+        '''events newer than the watermark, oldest first'''
+        from botocore.exceptions import ClientError
+
+        events = []
+        kwargs = {'StackName': self.stack_ids[stack_name]}
+        try:
+            while True:
+                page = self.client.describe_stack_events(**kwargs)
+                for event in page['StackEvents']:
+                    if event['EventId'] == self.watermarks[stack_name]:
+                        return list(reversed(events))
+                    events.append(event)
+                if not page.get('NextToken') or self.watermarks[stack_name] is None:
+                    # first read only needs the newest page
+                    return list(reversed(events))
+                kwargs['NextToken'] = page['NextToken']
+        except ClientError as err:
+            if 'does not exist' not in str(err):
+                raise
+            # stack not created yet
+            return []
+
+    def _record(self, stack_name, events):
+        for event in events:
+            self.stack_ids[stack_name] = event['StackId']
+            self.watermarks[stack_name] = event['EventId']
+            if event['ResourceType'] == STACK_TYPE and event['LogicalResourceId'] == event['StackName']:
+                self.statuses[stack_name] = event['ResourceStatus']
+
+    def prime(self, history=0):
+        '''set watermarks to the newest existing events
+
+        Args:
+            history (int): number of existing events to log per stack
+        '''
+        log = logging.getLogger(__file__)
+        for stack_name in self.stack_ids:
+            events = self.new_events(stack_name)
+            for event in events[-history:] if history else []:
+                log.info(format_event(event))
+            self._record(stack_name, events)
+            if self.wait_for_new:
+                self.statuses[stack_name] = None
+            elif not events:
+                log.warning('stack {0} does not exist'.format(stack_name))
+                self.statuses[stack_name] = NOT_FOUND
+
+    def poll(self):
+        '''read new events of every unfinished stack
+
+        Returns:
+            number of new events
+        '''
+        log = logging.getLogger(__file__)
+        count = 0
+        for stack_name in self.stack_ids:
+            if is_final(self.statuses[stack_name]):
+                continue
+            events = self.new_events(stack_name)
+            for event in events:
+                log.info(format_event(event))
+            self._record(stack_name, events)
+            if self.on_event is not None:
+                for event in events:
+                    self.on_event(stack_name, event)
+            count += len(events)
+        return count
+
+    def finished(self):
+        '''True when every stack reached a final status'''
+        return all(is_final(x) for x in self.statuses.values())
+
+    def follow(self, stop=None, delay=2.0, max_delay=30.0):
+        '''poll until every stack is final or stop is set
+
+        Args:
+            stop (threading.Event): ends following early
+            delay (float): initial seconds between polls
+            max_delay (float): longest seconds between polls
+
+        Returns:
+            dict of stack name to status, None if never seen
+        '''
+        stop = stop or threading.Event()
+        current = delay
+        while not self.finished() and not stop.is_set():
+            if self.poll():
+                current = delay
+            else:
+                current = min(current * 1.5, max_delay)
+            stop.wait(current)
+        return dict(self.statuses)
+
+
+@contextmanager
+def follow_events(client, stack_names):
+    '''log events of stacks in a background thread while an operation
+    runs in the foreground
+
+    Example:
+        with follow_events(client, ['mwest-default-vpc']) as tailer:
+            stack.create_stack()
+        tailer.statuses
+
+    Yields:
+        StackEventTailer
+    '''
+    log = logging.getLogger(__file__)
+    tailer = StackEventTailer(client, stack_names, wait_for_new=True)
+    tailer.prime()
+    stop = threading.Event()
+    thread = threading.Thread(target=tailer.follow, kwargs={'stop': stop})
+    thread.daemon = True
+    thread.start()
+    try:
+        yield tailer
+    finally:
+        stop.set()
+        thread.join()
+        # catch events between the last poll and the end of the operation
+        tailer.poll()
+        for stack_name, status in sorted(tailer.statuses.items()):
+            log.info('{0} final status: {1}'.format(stack_name, status))
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    parser = argparse.ArgumentParser(description='follow cloudformation events of several stacks')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('-s', '--stacks', required=True,
+                        help='REQUIRED: comma separated stack names')
+    parser.add_argument('--history', type=int, default=10,
+                        help='number of existing events to show per stack')
+    args = parser.parse_args()
+
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+
+    import aws_clients
+
+    tailer = StackEventTailer(aws_clients.client('cloudformation'), [x.strip() for x in args.stacks.split(',') if x.strip()])
+    tailer.prime(history=args.history)
+    statuses = tailer.follow()
+    for stack_name, status in sorted(statuses.items()):
+        log.info('{0} final status: {1}'.format(stack_name, status))
+    if any(is_failure(x) for x in statuses.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
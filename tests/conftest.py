@@ -0,0 +1,21 @@
+'''shared pytest setup, the modules under test live in the repo root'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+from os.path import abspath, dirname
+
+import pytest
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+
+@pytest.fixture
+def aws_env(monkeypatch, tmp_path):
+    '''fake credentials and region, no real aws config or profile is read'''
+    for envvar in ['AWS_PROFILE', 'AWS_DEFAULT_PROFILE', 'AWS_SESSION_TOKEN', 'AWS_ENDPOINT_URL']:
+        monkeypatch.delenv(envvar, raising=False)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-west-2')
+    monkeypatch.setenv('AWS_CONFIG_FILE', str(tmp_path / 'config'))
+    monkeypatch.setenv('AWS_SHARED_CREDENTIALS_FILE', str(tmp_path / 'credentials'))
@@ -0,0 +1,109 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from cfn_drift import detect_drift, format_drift
+
+botocore_exceptions = pytest.importorskip('botocore.exceptions')
+
+
+def client_error(message):
+    return botocore_exceptions.ClientError({'Error': {'Code': 'ValidationError', 'Message': message}},
+                                           'DetectStackDrift')
+
+
+def drift(logical_id, status, differences=()):
+    return {
+        'LogicalResourceId': logical_id,
+        'ResourceType': 'AWS::EC2::SecurityGroup',
+        'StackResourceDriftStatus': status,
+        'PropertyDifferences': [{'PropertyPath': x, 'DifferenceType': 'NOT_EQUAL'} for x in differences],
+    }
+
+
+class FakeClient(object):
+    '''drift detection that finishes after polls status calls
+
+    Args:
+        stacks (dict): stack name to (final status response, list of resource drifts),
+            or an exception detect_stack_drift raises
+    '''
+
+    def __init__(self, stacks, polls=1):
+        self.stacks = stacks
+        self.polls = polls
+        self.status_calls = {}
+
+    def detect_stack_drift(self, StackName):
+        if StackName not in self.stacks:
+            raise client_error('Stack with id {0} does not exist'.format(StackName))
+        if isinstance(self.stacks[StackName], Exception):
+            raise self.stacks[StackName]
+        return {'StackDriftDetectionId': 'detection-' + StackName}
+
+    def describe_stack_drift_detection_status(self, StackDriftDetectionId):
+        stack_name = StackDriftDetectionId[len('detection-'):]
+        self.status_calls[stack_name] = self.status_calls.get(stack_name, 0) + 1
+        if self.status_calls[stack_name] < self.polls:
+            return {'DetectionStatus': 'DETECTION_IN_PROGRESS'}
+        return self.stacks[stack_name][0]
+
+    def describe_stack_resource_drifts(self, StackName, NextToken=None):
+        drifts = self.stacks[StackName][1]
+        # one resource per page
+        index = int(NextToken or 0)
+        response = {'StackResourceDrifts': drifts[index:index + 1]}
+        if index + 1 < len(drifts):
+            response['NextToken'] = str(index + 1)
+        return response
+
+
+def test_detect_drift_of_several_stacks():
+    client = FakeClient({
+        'lab-sg': ({'DetectionStatus': 'DETECTION_COMPLETE', 'StackDriftStatus': 'DRIFTED'},
+                   [drift('BastionSG', 'MODIFIED', ['/SecurityGroupIngress/1/CidrIp']), drift('DbSG', 'IN_SYNC')]),
+        'lab-vpc': ({'DetectionStatus': 'DETECTION_COMPLETE', 'StackDriftStatus': 'IN_SYNC'}, []),
+        'lab-busy': client_error('Drift detection is not supported in UPDATE_IN_PROGRESS'),
+    }, polls=3)
+    stacks = [(client, x) for x in ['lab-sg', 'lab-vpc', 'lab-busy', 'lab-gone']]
+    results = detect_drift(stacks, delay=0, max_delay=0)
+
+    assert results['lab-sg']['status'] == 'DRIFTED'
+    assert [x['LogicalResourceId'] for x in results['lab-sg']['resources']] == ['BastionSG', 'DbSG']
+    assert results['lab-vpc'] == {'status': 'IN_SYNC', 'reason': '', 'resources': []}
+    assert results['lab-gone'] == {'status': 'NOT_FOUND', 'reason': '', 'resources': []}
+    assert results['lab-busy']['status'] == 'DETECTION_FAILED'
+    assert 'UPDATE_IN_PROGRESS' in results['lab-busy']['reason']
+    assert client.status_calls == {'lab-sg': 3, 'lab-vpc': 3}
+
+
+def test_failed_detection_keeps_the_resources_it_checked():
+    client = FakeClient({
+        'lab-sg': ({'DetectionStatus': 'DETECTION_FAILED', 'StackDriftStatus': 'DRIFTED',
+                    'DetectionStatusReason': 'some resources not checked'}, [drift('BastionSG', 'DELETED')]),
+        'lab-role': ({'DetectionStatus': 'DETECTION_FAILED', 'DetectionStatusReason': 'access denied'}, []),
+    })
+    results = detect_drift([(client, 'lab-sg'), (client, 'lab-role')], delay=0, max_delay=0)
+    assert results['lab-sg']['status'] == 'DRIFTED'
+    assert results['lab-sg']['reason'] == 'some resources not checked'
+    assert len(results['lab-sg']['resources']) == 1
+    assert results['lab-role']['status'] == 'DETECTION_FAILED'
+
+
+def test_format_drift():
+    results = {
+        'lab-vpc': {'status': 'IN_SYNC', 'reason': '', 'resources': [drift('Vpc', 'IN_SYNC')]},
+        'lab-sg': {'status': 'DRIFTED', 'reason': '', 'resources': [
+            drift('BastionSG', 'MODIFIED', ['/SecurityGroupIngress/1/CidrIp', '/Tags']),
+            drift('DbSG', 'IN_SYNC'),
+            drift('OldSG', 'DELETED'),
+        ]},
+        'lab-gone': {'status': 'NOT_FOUND', 'reason': '', 'resources': []},
+    }
+    assert format_drift(results) == [
+        'lab-gone  NOT_FOUND',
+        'lab-sg  DRIFTED  DELETED=1 IN_SYNC=1 MODIFIED=1',
+        '    BastionSG  AWS::EC2::SecurityGroup  MODIFIED  SecurityGroupIngress.1.CidrIp NOT_EQUAL,Tags NOT_EQUAL',
+        '    OldSG  AWS::EC2::SecurityGroup  DELETED',
+        'lab-vpc  IN_SYNC  IN_SYNC=1',
+    ]
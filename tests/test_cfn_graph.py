@@ -0,0 +1,80 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import threading
+
+import pytest
+
+from cfn_graph import build_dependencies, check_acyclic, reverse_dependencies, run_graph
+
+
+def test_check_acyclic_accepts_a_dag():
+    check_acyclic({'vpc': set(), 'sg': {'vpc'}, 'ec2': {'vpc', 'sg'}})
+
+
+def test_check_acyclic_accepts_an_empty_graph():
+    check_acyclic({})
+
+
+def test_check_acyclic_names_the_stacks_of_a_cycle():
+    with pytest.raises(ValueError) as err:
+        check_acyclic({'vpc': set(), 'sg': {'vpc', 'rs'}, 'rs': {'sg'}})
+    assert "['rs', 'sg']" in str(err.value)
+
+
+def test_check_acyclic_rejects_a_self_dependency():
+    with pytest.raises(ValueError):
+        check_acyclic({'vpc': {'vpc'}})
+
+
+def test_check_acyclic_does_not_change_its_argument():
+    dependencies = {'vpc': set(), 'sg': {'vpc'}}
+    check_acyclic(dependencies)
+    assert dependencies == {'vpc': set(), 'sg': {'vpc'}}
+
+
+def test_reverse_dependencies():
+    assert reverse_dependencies({'vpc': set(), 'sg': {'vpc'}, 'ec2': {'vpc', 'sg'}}) == {
+        'vpc': {'sg', 'ec2'}, 'sg': {'ec2'}, 'ec2': set()}
+
+
+def test_build_dependencies_of_the_templates():
+    dependencies = build_dependencies(['vpc', 'sg', 'role', 'ec2'])
+    assert dependencies == {'vpc': set(), 'sg': {'vpc'}, 'role': set(), 'ec2': {'vpc', 'sg', 'role'}}
+
+
+def test_build_dependencies_assumes_unselected_exporters_are_deployed():
+    assert build_dependencies(['sg', 'ec2']) == {'sg': set(), 'ec2': {'sg'}}
+
+
+def test_build_dependencies_of_a_type_without_template():
+    assert build_dependencies(['vpc', 'missing']) == {'vpc': set(), 'missing': set()}
+
+
+def test_run_graph_runs_dependencies_first():
+    finished = []
+    lock = threading.Lock()
+
+    def func(node):
+        with lock:
+            finished.append(node)
+
+    status = run_graph({'vpc': set(), 'sg': {'vpc'}, 'role': set(), 'ec2': {'sg', 'role'}}, func)
+    assert status == dict((x, 'COMPLETE') for x in ['vpc', 'sg', 'role', 'ec2'])
+    assert finished.index('vpc') < finished.index('sg') < finished.index('ec2')
+    assert finished.index('role') < finished.index('ec2')
+
+
+def test_run_graph_skips_every_dependent_of_a_failure():
+    def func(node):
+        if node == 'vpc':
+            raise RuntimeError('create failed')
+
+    status = run_graph({'vpc': set(), 'sg': {'vpc'}, 'ec2': {'sg'}, 'role': set()}, func)
+    assert status == {'vpc': 'FAILED', 'sg': 'SKIPPED', 'ec2': 'SKIPPED', 'role': 'COMPLETE'}
+
+
+def test_run_graph_checks_for_cycles_before_running():
+    calls = []
+    with pytest.raises(ValueError):
+        run_graph({'sg': {'rs'}, 'rs': {'sg'}}, calls.append)
+    assert calls == []
@@ -0,0 +1,151 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+
+import pytest
+
+import aws_trace
+import cfn_outputs
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+TEMPLATE = json.dumps({
+    'Parameters': {'Name': {'Type': 'String'}},
+    'Resources': {'Topic': {'Type': 'AWS::SNS::Topic'}},
+    'Outputs': {'Name': {'Value': {'Ref': 'Name'}}},
+})
+
+
+@pytest.fixture
+def client(aws_env):
+    with moto.mock_aws():
+        cfn_outputs.clear()
+        yield boto3.client('cloudformation')
+    cfn_outputs.clear()
+
+
+def trace(client):
+    '''count the calls of client from now on'''
+    tracer = aws_trace.Tracer()
+    tracer.register(client.meta.events)
+    return tracer
+
+
+def calls(tracer):
+    '''operation name to number of calls'''
+    return dict((operation, x['calls']) for (_, operation), x in tracer.totals.items())
+
+
+def create_stack(client, name, value=None):
+    client.create_stack(StackName=name, TemplateBody=TEMPLATE,
+                        Parameters=[{'ParameterKey': 'Name', 'ParameterValue': value or name}])
+
+
+def test_active_statuses_are_every_status_but_deleted(client):
+    statuses = cfn_outputs.active_statuses(client)
+    assert 'DELETE_COMPLETE' not in statuses
+    assert {'CREATE_COMPLETE', 'ROLLBACK_COMPLETE', 'UPDATE_ROLLBACK_FAILED', 'DELETE_FAILED'} <= set(statuses)
+
+
+def test_describe_stacks_calls_once_per_stack(client):
+    create_stack(client, 'a')
+    create_stack(client, 'b')
+    create_stack(client, 'c')
+    tracer = trace(client)
+    described = cfn_outputs.describe_stacks(['a', 'b'], client)
+    assert sorted(described) == ['a', 'b']
+    assert described['a']['outputs'] == {'Name': 'a'}
+    assert calls(tracer) == {'DescribeStacks': 2}
+
+
+def test_describe_stacks_missing(client):
+    create_stack(client, 'a')
+    with pytest.raises(Exception) as err:
+        cfn_outputs.describe_stacks(['a', 'missing'], client)
+    assert 'does not exist' in str(err.value)
+    assert sorted(cfn_outputs.describe_stacks(['a', 'missing'], client, must_exist=False)) == ['a']
+
+
+def test_get_outputs_is_memoized(client):
+    create_stack(client, 'a')
+    create_stack(client, 'b')
+    tracer = trace(client)
+    assert cfn_outputs.get_outputs(['a', 'b'], client=client, use_cache=False) == {
+        'a': {'Name': 'a'}, 'b': {'Name': 'b'}}
+    assert cfn_outputs.get_output('a', 'Name', client=client, use_cache=False) == 'a'
+    assert calls(tracer) == {'DescribeStacks': 2}
+
+
+def test_get_outputs_of_a_missing_stack(client, tmp_path):
+    create_stack(client, 'a')
+    cache_file = str(tmp_path / 'outputs.json')
+    with pytest.raises(ValueError):
+        cfn_outputs.get_outputs(['a', 'missing'], client=client, cache_file=cache_file)
+    assert cfn_outputs.get_outputs(['a', 'missing'], client=client, cache_file=cache_file,
+                                   ignore_missing=True) == {'a': {'Name': 'a'}}
+
+
+def test_get_outputs_of_a_deleted_stack(client, tmp_path):
+    create_stack(client, 'a')
+    client.delete_stack(StackName='a')
+    with pytest.raises(ValueError):
+        cfn_outputs.get_outputs(['a'], client=client, cache_file=str(tmp_path / 'outputs.json'))
+
+
+def test_cache_skips_describe_of_unchanged_stacks(client, tmp_path):
+    create_stack(client, 'a')
+    create_stack(client, 'b')
+    cache_file = str(tmp_path / 'outputs.json')
+    cfn_outputs.get_outputs(['a', 'b'], client=client, cache_file=cache_file)
+    # a new process starts with only the on-disk cache
+    cfn_outputs.clear()
+    tracer = trace(client)
+    assert cfn_outputs.get_outputs(['a', 'b'], client=client, cache_file=cache_file) == {
+        'a': {'Name': 'a'}, 'b': {'Name': 'b'}}
+    assert calls(tracer) == {'ListStacks': 1}
+
+
+def test_cache_describes_changed_stacks_again(client, tmp_path):
+    create_stack(client, 'a')
+    create_stack(client, 'b')
+    cache_file = str(tmp_path / 'outputs.json')
+    cfn_outputs.get_outputs(['a', 'b'], client=client, cache_file=cache_file)
+    # moto sets no LastUpdatedTime on update, a recreated stack has a new CreationTime
+    client.delete_stack(StackName='a')
+    create_stack(client, 'a', value='updated')
+    cfn_outputs.clear()
+    tracer = trace(client)
+    assert cfn_outputs.get_outputs(['a', 'b'], client=client, cache_file=cache_file) == {
+        'a': {'Name': 'updated'}, 'b': {'Name': 'b'}}
+    assert calls(tracer) == {'ListStacks': 1, 'DescribeStacks': 1}
+
+
+def test_max_age_bounds_the_cache_life(client, tmp_path):
+    create_stack(client, 'a')
+    cache_file = str(tmp_path / 'outputs.json')
+    cfn_outputs.get_outputs(['a'], client=client, cache_file=cache_file, max_age=3600)
+    cfn_outputs.clear()
+    tracer = trace(client)
+    cfn_outputs.get_outputs(['a'], client=client, cache_file=cache_file, max_age=3600)
+    assert calls(tracer) == {'ListStacks': 1}
+    cfn_outputs.clear()
+    cfn_outputs.get_outputs(['a'], client=client, cache_file=cache_file, max_age=0)
+    assert calls(tracer) == {'ListStacks': 2, 'DescribeStacks': 1}
+
+
+def test_cache_writes_env_files_and_forget_removes_them(client, tmp_path):
+    create_stack(client, 'a', value="it's")
+    cache_file = str(tmp_path / 'outputs.json')
+    cfn_outputs.get_outputs(['a'], client=client, cache_file=cache_file)
+    with open(cfn_outputs.env_file('a', cache_file)) as f:
+        assert "Name='it'\\''s'" in f.read().splitlines()
+    cfn_outputs.forget(['a'], cache_file=cache_file)
+    assert cfn_outputs.read_cache(cache_file) == {}
+    assert not (tmp_path / 'a.env').exists()
+
+
+def test_corrupt_cache_is_ignored(tmp_path):
+    cache_file = tmp_path / 'outputs.json'
+    cache_file.write_text('{not json')
+    assert cfn_outputs.read_cache(str(cache_file)) == {}
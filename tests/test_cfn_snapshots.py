@@ -0,0 +1,91 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import datetime
+
+import pytest
+
+from cfn_snapshots import find_latest, latest_snapshot, redshift_snapshots
+
+
+def day(number):
+    return datetime.datetime(2020, 1, number)
+
+
+INDEX = {
+    'mwest-lab-rs-redshiftcluster-abc123': [(day(3), 'rs-newest'), (day(1), 'rs-old')],
+    # a cluster of an earlier stack with the same name, since replaced
+    'mwest-lab-rs-redshiftcluster-old999': [(day(2), 'rs-replaced')],
+    # same prefix without the dash, another stack
+    'mwest-lab-rs2-redshiftcluster-def456': [(day(9), 'rs2-newest')],
+    'MWEST-LAB-AR-CLUSTER-XYZ': [(day(5), 'ar-newest')],
+    'mwest-lab-ar-cluster-empty': [],
+}
+
+
+def test_latest_snapshot_of_every_cluster_of_a_stack():
+    assert latest_snapshot(INDEX, 'mwest-lab-rs') == 'rs-newest'
+
+
+def test_latest_snapshot_matches_the_prefix_up_to_the_dash():
+    assert latest_snapshot(INDEX, 'mwest-lab-rs2') == 'rs2-newest'
+    assert latest_snapshot(INDEX, 'mwest-lab') == 'rs2-newest'
+    assert latest_snapshot(INDEX, 'mwest-lab-r') is None
+
+
+def test_latest_snapshot_ignores_case():
+    assert latest_snapshot(INDEX, 'mwest-lab-ar') == 'ar-newest'
+
+
+def test_latest_snapshot_none():
+    assert latest_snapshot(INDEX, 'other-lab-rs') is None
+    assert latest_snapshot({}, 'mwest-lab-rs') is None
+
+
+class FakePaginator(object):
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self):
+        return iter(self.pages)
+
+
+class FakeClient(object):
+    def __init__(self, operation, pages):
+        self.operation = operation
+        self.pages = pages
+
+    def get_paginator(self, operation):
+        assert operation == self.operation
+        return FakePaginator(self.pages)
+
+
+def redshift_snapshot(cluster, created, identifier, status='available'):
+    return {'ClusterIdentifier': cluster, 'SnapshotCreateTime': created, 'SnapshotIdentifier': identifier,
+            'Status': status}
+
+
+def test_redshift_snapshots_are_indexed_newest_first_across_pages():
+    client = FakeClient('describe_cluster_snapshots', [
+        {'Snapshots': [redshift_snapshot('c1', day(1), 'old'),
+                       redshift_snapshot('c1', day(4), 'creating', status='creating')]},
+        {'Snapshots': [redshift_snapshot('c1', day(3), 'newest'), redshift_snapshot('c2', day(2), 'other')]},
+    ])
+    assert redshift_snapshots(client) == {'c1': [(day(3), 'newest'), (day(1), 'old')], 'c2': [(day(2), 'other')]}
+
+
+def test_find_latest_lists_each_service_once():
+    clients = {
+        'redshift': FakeClient('describe_cluster_snapshots', [
+            {'Snapshots': [redshift_snapshot('mwest-lab-rs-cluster-1', day(1), 'rs-snap')]}]),
+        'rds': FakeClient('describe_db_cluster_snapshots', [
+            {'DBClusterSnapshots': [{'DBClusterIdentifier': 'mwest-lab-ar-cluster-1', 'SnapshotCreateTime': day(2),
+                                     'DBClusterSnapshotIdentifier': 'ar-snap', 'Status': 'available'}]}]),
+    }
+    assert find_latest({'rs': 'mwest-lab-rs', 'ar': 'mwest-lab-ar'}, clients) == {'rs': 'rs-snap', 'ar': 'ar-snap'}
+
+
+def test_find_latest_raises_without_a_snapshot():
+    clients = {'redshift': FakeClient('describe_cluster_snapshots', [{'Snapshots': []}])}
+    with pytest.raises(ValueError) as err:
+        find_latest({'rs': 'mwest-lab-rs'}, clients)
+    assert 'mwest-lab-rs' in str(err.value)
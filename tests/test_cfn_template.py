@@ -0,0 +1,117 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import textwrap
+
+from cfn_template import (load_template, minify_template, template_body, template_exports, template_imports,
+                          template_path, template_types)
+
+
+def write_template(tmp_path, text):
+    path = tmp_path / 'test.yaml'
+    path.write_text(textwrap.dedent(text))
+    return str(path)
+
+
+def test_short_form_tags_expand_to_long_form(tmp_path):
+    template = load_template(write_template(tmp_path, '''\
+        Resources:
+          Bastion:
+            Properties:
+              SubnetId: !ImportValue 'mwest-subnet-id'
+              VpcId: !Ref Vpc
+              Name: !Sub '${AWS::StackName}-bastion'
+              Zone: !Select [0, !GetAZs '']
+        '''))
+    properties = template['Resources']['Bastion']['Properties']
+    assert properties['SubnetId'] == {'Fn::ImportValue': 'mwest-subnet-id'}
+    assert properties['VpcId'] == {'Ref': 'Vpc'}
+    assert properties['Name'] == {'Fn::Sub': '${AWS::StackName}-bastion'}
+    assert properties['Zone'] == {'Fn::Select': [0, {'Fn::GetAZs': ''}]}
+
+
+def test_get_att_scalar_splits_at_the_first_dot(tmp_path):
+    template = load_template(write_template(tmp_path, '''\
+        Outputs:
+          Endpoint:
+            Value: !GetAtt Cluster.Endpoint.Address
+          Ip:
+            Value: !GetAtt [Bastion, PublicIp]
+        '''))
+    assert template['Outputs']['Endpoint']['Value'] == {'Fn::GetAtt': ['Cluster', 'Endpoint.Address']}
+    assert template['Outputs']['Ip']['Value'] == {'Fn::GetAtt': ['Bastion', 'PublicIp']}
+
+
+def test_mapping_tag_expands(tmp_path):
+    template = load_template(write_template(tmp_path, '''\
+        Value: !Sub
+          - '${Name}-sg'
+          - {Name: !Ref Product}
+        Other: !Base64 {Ref: UserData}
+        '''))
+    assert template['Value'] == {'Fn::Sub': ['${Name}-sg', {'Name': {'Ref': 'Product'}}]}
+    assert template['Other'] == {'Fn::Base64': {'Ref': 'UserData'}}
+
+
+def test_exports_and_imports(tmp_path):
+    template = load_template(write_template(tmp_path, '''\
+        Resources:
+          Sg:
+            Properties:
+              VpcId: !ImportValue 'mwest-vpc-id'
+              Tags: [{Key: Name, Value: !ImportValue {'Fn::Sub': '${Product}-name'}}]
+        Outputs:
+          SgId:
+            Value: !Ref Sg
+            Export:
+              Name: 'mwest-sg-id'
+          Built:
+            Value: !Ref Sg
+            Export:
+              Name: !Sub '${AWS::StackName}-sg'
+          Plain:
+            Value: !Ref Sg
+        '''))
+    # names built with !Sub are not literal and are left out
+    assert template_exports(template) == {'mwest-sg-id'}
+    assert template_imports(template) == {'mwest-vpc-id'}
+
+
+def test_template_types_lists_the_repo_templates():
+    types = template_types()
+    assert types == sorted(types)
+    assert {'vpc', 'sg', 'role', 'ec2', 'rs', 'ar'} <= set(types)
+
+
+def test_minify_template_is_compact_json_of_the_long_form(tmp_path):
+    path = write_template(tmp_path, '''\
+        # comments and layout are dropped
+        AWSTemplateFormatVersion: 2010-09-09
+        Resources:
+          Vpc:
+            Type: 'AWS::EC2::VPC'
+            Properties:
+              CidrBlock: !Ref Cidr
+        ''')
+    body = minify_template(path)
+    assert json.loads(body) == {
+        'AWSTemplateFormatVersion': '2010-09-09',
+        'Resources': {'Vpc': {'Type': 'AWS::EC2::VPC', 'Properties': {'CidrBlock': {'Ref': 'Cidr'}}}},
+    }
+    assert '# comments' not in body
+    assert ' ' not in body
+
+
+def test_template_body_of_every_template_fits_and_round_trips():
+    for type_of_stack in template_types():
+        body = template_body(type_of_stack)
+        assert body is not None, type_of_stack
+        assert json.loads(body) == json.loads(json.dumps(
+            load_template(template_path(type_of_stack)), default=str))
+
+
+def test_template_body_is_none_when_too_large():
+    body = template_body('vpc')
+    size = len(body.encode('utf-8'))
+    assert template_body('vpc', max_bytes=size) == body
+    assert template_body('vpc', max_bytes=size - 1) is None
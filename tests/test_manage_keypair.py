@@ -0,0 +1,97 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import hashlib
+import subprocess
+
+import pytest
+
+import manage_keypair
+from manage_keypair import cache_fingerprints, generate_key, key_fingerprints, write_pem
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+
+@pytest.fixture
+def home(monkeypatch, tmp_path):
+    '''HOME with an empty .ssh, pem files are written there'''
+    os.makedirs(str(tmp_path / '.ssh'))
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def ec2(aws_env):
+    with moto.mock_aws():
+        yield boto3.client('ec2')
+
+
+def ssh_keygen_fingerprint(filename):
+    '''sha256 fingerprint as printed by ssh-keygen -l, without the SHA256: prefix'''
+    output = subprocess.check_output(['ssh-keygen', '-l', '-E', 'sha256', '-f', filename]).decode('ascii')
+    return output.split()[1].split(':', 1)[1]
+
+
+def test_generate_key_is_private_to_the_user(home):
+    filename = str(home / '.ssh' / 'key.pem')
+    public = generate_key(filename, 'ed25519')
+    assert public.startswith('ssh-ed25519 ')
+    assert os.stat(filename).st_mode & 0o777 == 0o600
+    assert not os.path.exists(filename + '.pub')
+
+
+def test_ed25519_fingerprint_is_the_ssh_keygen_format(home):
+    filename = str(home / '.ssh' / 'key.pem')
+    generate_key(filename, 'ed25519')
+    assert key_fingerprints(filename)[0] == ssh_keygen_fingerprint(filename)
+
+
+def colon_hex(digest):
+    return ':'.join(digest[x:x + 2] for x in range(0, len(digest), 2))
+
+
+def test_imported_rsa_key_matches_the_ec2_fingerprint(home, ec2):
+    # moto fingerprints imported rsa keys as ec2 does, imported ed25519 keys not
+    response = manage_keypair.import_keypair('imported', key_type='rsa', client=ec2)
+    assert response['KeyFingerprint'] in key_fingerprints(manage_keypair.get_pem_filename('imported'))
+
+
+def test_created_rsa_key_fingerprint_is_the_sha1_of_the_private_key(home, ec2):
+    serialization = pytest.importorskip('cryptography.hazmat.primitives.serialization')
+
+    # moto hashes the public key of created keys, ec2 the der pkcs8 private key
+    write_pem(ec2.create_key_pair(KeyName='created'))
+    filename = manage_keypair.get_pem_filename('created')
+    assert os.stat(filename).st_mode & 0o777 == 0o600
+    with open(filename, 'rb') as f:
+        private_key = serialization.load_pem_private_key(f.read(), password=None)
+    der = private_key.private_bytes(serialization.Encoding.DER, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+    assert colon_hex(hashlib.sha1(der).hexdigest()) in key_fingerprints(filename)
+
+
+def test_fingerprints_are_cached_until_the_pem_changes(home, monkeypatch):
+    cache_file = str(home / '.ssh' / 'fingerprints.json')
+    assert cache_fingerprints('key', cache_file=cache_file) == []
+
+    generate_key(manage_keypair.get_pem_filename('key'), 'ed25519')
+    computed = []
+
+    def counting(filename):
+        computed.append(filename)
+        return ['fingerprint-{0}'.format(len(computed))]
+
+    monkeypatch.setattr(manage_keypair, 'key_fingerprints', counting)
+    assert cache_fingerprints('key', cache_file=cache_file) == ['fingerprint-1']
+    assert cache_fingerprints('key', cache_file=cache_file) == ['fingerprint-1']
+    assert len(computed) == 1
+
+    filename = manage_keypair.get_pem_filename('key')
+    stat = os.stat(filename)
+    os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+    assert cache_fingerprints('key', cache_file=cache_file) == ['fingerprint-2']
+
+    os.remove(filename)
+    assert cache_fingerprints('key', cache_file=cache_file) == []
+    assert manage_keypair.read_fingerprint_cache(cache_file) == {}
@@ -0,0 +1,84 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import textwrap
+
+from sql_run import PASSWORD_RE, split_statements, stages
+
+
+def split(text):
+    return split_statements(textwrap.dedent(text))
+
+
+def test_split_on_semicolons_with_line_numbers():
+    assert split('''\
+        select 1;
+        select
+          2;
+
+        select 3''') == [(1, 'select 1'), (2, 'select\n  2'), (5, 'select 3')]
+
+
+def test_semicolons_in_quotes_do_not_split():
+    assert split('''\
+        select 'a;b', "c;d";
+        select 'it''s; fine';
+        ''') == [(1, '''select 'a;b', "c;d"'''), (2, "select 'it''s; fine'")]
+
+
+def test_comments_are_dropped_and_do_not_split():
+    assert split('''\
+        -- drop table x;
+        select 1; /* a;
+        b; */ select 2;
+        ''') == [(2, 'select 1'), (3, 'select 2')]
+
+
+def test_dollar_quoted_bodies_do_not_split():
+    assert split('''\
+        create function f() returns int as $body$
+          begin return 1; end;
+        $body$ language plpgsql;
+        select $$;$$;
+        ''') == [
+        (1, 'create function f() returns int as $body$\n  begin return 1; end;\n$body$ language plpgsql'),
+        (4, 'select $$;$$'),
+    ]
+
+
+def test_psql_meta_commands_are_statements():
+    assert split('''\
+        \\timing on
+        select 1;
+        \\echo done
+        ''') == [(1, '\\timing on'), (2, 'select 1'), (3, '\\echo done')]
+
+
+def test_backslash_inside_a_statement_is_kept():
+    assert split("select E'a\\nb';\n") == [(1, "select E'a\\nb'")]
+
+
+def test_unterminated_quote_runs_to_the_end():
+    assert split("select 'open;\n") == [(1, "select 'open;")]
+
+
+def test_empty_text():
+    assert split_statements('') == []
+    assert split_statements(' ;\n-- only a comment\n') == []
+
+
+def test_stages_group_files_by_numeric_prefix(tmp_path):
+    for name in ['10_schema.sql', '20_b.pgsql', '20_a.sql', '3_early.sql', 'readme.txt', 'extra.sql']:
+        (tmp_path / name).write_text('select 1;')
+    single = str(tmp_path / 'single.sql')
+    assert stages([str(tmp_path), single]) == [
+        ('3', [str(tmp_path / '3_early.sql')]),
+        ('10', [str(tmp_path / '10_schema.sql')]),
+        ('20', [str(tmp_path / '20_a.sql'), str(tmp_path / '20_b.pgsql')]),
+        ('extra.sql', [str(tmp_path / 'extra.sql')]),
+        ('single.sql', [single]),
+    ]
+
+
+def test_passwords_are_masked():
+    assert PASSWORD_RE.sub(r"\1'***'", "create user bob password 'Secret1';") == \
+        "create user bob password '***';"
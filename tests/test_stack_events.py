@@ -0,0 +1,131 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from stack_events import (NOT_FOUND, STACK_TYPE, StackEventTailer, format_event, is_failure, is_final,
+                          is_resource_failure)
+
+botocore_exceptions = pytest.importorskip('botocore.exceptions')
+
+
+def event(number, status, logical_id='mwest-lab-vpc', resource_type=STACK_TYPE, reason=None):
+    result = {
+        'EventId': 'event-{0}'.format(number),
+        'StackId': 'arn:stack/mwest-lab-vpc/1',
+        'StackName': 'mwest-lab-vpc',
+        'LogicalResourceId': logical_id,
+        'ResourceType': resource_type,
+        'ResourceStatus': status,
+        'Timestamp': '2020-01-01 00:00:{0:02d}'.format(number),
+    }
+    if reason:
+        result['ResourceStatusReason'] = reason
+    return result
+
+
+class FakeClient(object):
+    '''describe_stack_events of one stack, newest first in pages of page_size'''
+
+    def __init__(self, events=None, page_size=2):
+        self.events = events
+        self.page_size = page_size
+        self.calls = []
+
+    def describe_stack_events(self, StackName, NextToken=None):
+        self.calls.append((StackName, NextToken))
+        if self.events is None:
+            raise botocore_exceptions.ClientError(
+                {'Error': {'Code': 'ValidationError', 'Message': 'Stack [{0}] does not exist'.format(StackName)}},
+                'DescribeStackEvents')
+        start = int(NextToken or 0)
+        newest_first = list(reversed(self.events))
+        page = {'StackEvents': newest_first[start:start + self.page_size]}
+        if start + self.page_size < len(newest_first):
+            page['NextToken'] = str(start + self.page_size)
+        return page
+
+
+def test_is_final():
+    assert not is_final(None)
+    assert not is_final('CREATE_IN_PROGRESS')
+    assert not is_final('UPDATE_COMPLETE_CLEANUP_IN_PROGRESS')
+    assert is_final('CREATE_COMPLETE')
+    assert is_final('ROLLBACK_FAILED')
+    assert is_final(NOT_FOUND)
+
+
+def test_is_failure():
+    assert not is_failure('CREATE_COMPLETE')
+    assert not is_failure('DELETE_COMPLETE')
+    assert is_failure('ROLLBACK_COMPLETE')
+    assert is_failure('UPDATE_ROLLBACK_COMPLETE')
+    assert is_failure('DELETE_FAILED')
+    assert is_failure(NOT_FOUND)
+
+
+def test_is_resource_failure_ignores_the_stack_itself():
+    assert is_resource_failure(event(1, 'CREATE_FAILED', 'Subnet', 'AWS::EC2::Subnet'))
+    assert not is_resource_failure(event(1, 'CREATE_COMPLETE', 'Subnet', 'AWS::EC2::Subnet'))
+    assert not is_resource_failure(event(1, 'UPDATE_ROLLBACK_FAILED'))
+    # a nested stack is a resource of its parent
+    assert is_resource_failure(event(1, 'CREATE_FAILED', 'Nested', STACK_TYPE))
+
+
+def test_format_event():
+    assert format_event(event(1, 'CREATE_FAILED', 'Subnet', 'AWS::EC2::Subnet', reason='limit')) == \
+        '2020-01-01 00:00:01 mwest-lab-vpc Subnet CREATE_FAILED limit'
+    assert format_event(event(2, 'CREATE_COMPLETE')) == \
+        '2020-01-01 00:00:02 mwest-lab-vpc mwest-lab-vpc CREATE_COMPLETE'
+
+
+def test_first_read_is_only_the_newest_page():
+    client = FakeClient([event(x, 'CREATE_IN_PROGRESS', 'R{0}'.format(x), 'AWS::EC2::Subnet') for x in range(5)])
+    tailer = StackEventTailer(client, ['mwest-lab-vpc'])
+    assert [x['EventId'] for x in tailer.new_events('mwest-lab-vpc')] == ['event-3', 'event-4']
+    assert len(client.calls) == 1
+
+
+def test_poll_reads_pages_until_the_watermark():
+    events = [event(1, 'CREATE_IN_PROGRESS')]
+    client = FakeClient(events)
+    seen = []
+    tailer = StackEventTailer(client, ['mwest-lab-vpc'], on_event=lambda name, x: seen.append(x['EventId']))
+    tailer.prime()
+    assert tailer.statuses == {'mwest-lab-vpc': 'CREATE_IN_PROGRESS'}
+
+    events.extend([event(2, 'CREATE_IN_PROGRESS', 'Vpc', 'AWS::EC2::VPC'),
+                   event(3, 'CREATE_COMPLETE', 'Vpc', 'AWS::EC2::VPC'),
+                   event(4, 'CREATE_COMPLETE')])
+    del client.calls[:]
+    assert tailer.poll() == 3
+    assert seen == ['event-2', 'event-3', 'event-4']
+    assert len(client.calls) == 2
+    # later pages are read by stack id, it keeps working after a delete
+    assert client.calls[0][0] == 'arn:stack/mwest-lab-vpc/1'
+    assert tailer.finished()
+    assert tailer.statuses == {'mwest-lab-vpc': 'CREATE_COMPLETE'}
+
+    # a finished stack is not polled again
+    del client.calls[:]
+    assert tailer.poll() == 0
+    assert client.calls == []
+
+
+def test_wait_for_new_ignores_the_existing_final_status():
+    client = FakeClient([event(1, 'CREATE_COMPLETE')])
+    tailer = StackEventTailer(client, ['mwest-lab-vpc'], wait_for_new=True)
+    tailer.prime()
+    assert tailer.statuses == {'mwest-lab-vpc': None}
+    assert not tailer.finished()
+
+
+def test_missing_stack():
+    tailer = StackEventTailer(FakeClient(), ['mwest-lab-vpc'])
+    tailer.prime()
+    assert tailer.statuses == {'mwest-lab-vpc': NOT_FOUND}
+    assert tailer.follow(delay=0) == {'mwest-lab-vpc': NOT_FOUND}
+
+    waiting = StackEventTailer(FakeClient(), ['mwest-lab-vpc'], wait_for_new=True)
+    waiting.prime()
+    assert waiting.poll() == 0
+    assert waiting.statuses == {'mwest-lab-vpc': None}
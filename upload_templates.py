@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+'''upload_templates.py
+
+upload cloudformation templates to s3 under content hash keys
+
+every template is hashed and stored as
+s3://{S3BUCKET}/cloudformation/{type}/{sha256}.yaml
+the bucket is listed once and only templates whose hash is not there yet
+are uploaded, concurrently.  cfn.py hashes the local template the same way
+and points the stack at that key, uploading it first if it is missing, see
+ensure_template.  An unchanged template keeps the same url, so an update
+with the same parameters is a no-op for cloudformation.
+
+cfn.py sends templates that fit the TemplateBody limit inline, only the
+templates larger than cfn_template.MAX_TEMPLATE_BODY once minified, or every
+template with cfn.py --no-inline, are deployed from s3.  Running this script
+first uploads them in parallel instead of one at a time from cfn.py.
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ upload_templates.py [-v] [-t vpc,sg] [-j 8]
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import hashlib
+import logging
+import argparse
+import platform
+
+import aws_clients
+
+TEMPLATE_URL = 'https://s3-us-west-2.amazonaws.com/{0}/{1}'
+
+
+def template_key(type_of_stack, digest):
+    '''s3 key of a template version'''
+    return 'cloudformation/{0}/{1}.yaml'.format(type_of_stack, digest)
+
+
+def template_digest(path):
+    '''sha256 hex digest of a template file'''
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        sha.update(f.read())
+    return sha.hexdigest()
+
+
+def ensure_template(type_of_stack, bucket, client=None):
+    '''url of the content hash key of the local template, uploaded first if missing
+
+    the key is the sha256 of the local template, so a head_object tells whether
+    the template is there.  Errors other than a missing key, and upload errors,
+    are raised, a stack is never pointed at a template other than the local one
+
+    Args:
+        type_of_stack (String): type of stack, for example vpc
+        bucket (String): s3 bucket templates are uploaded to
+        client: s3 client, defaults to the shared one of the default session
+
+    Returns:
+        url String
+    '''
+    from botocore.exceptions import ClientError
+    from cfn_template import template_path
+
+    log = logging.getLogger(__file__)
+    client = client or aws_clients.client('s3')
+    path = template_path(type_of_stack)
+    key = template_key(type_of_stack, template_digest(path))
+    try:
+        client.head_object(Bucket=bucket, Key=key)
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+        log.info('uploading {0} to s3://{1}/{2}'.format(type_of_stack, bucket, key))
+        with open(path, 'rb') as body:
+            client.put_object(Bucket=bucket, Key=key, Body=body, ServerSideEncryption='AES256')
+    return TEMPLATE_URL.format(bucket, key)
+
+
+def existing_keys(client, bucket):
+    '''every key under cloudformation/ in the bucket with one paginated listing'''
+    keys = set()
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix='cloudformation/'):
+        keys.update(x['Key'] for x in page.get('Contents', []))
+    return keys
+
+
+def upload_templates(types, bucket, max_workers=8):
+    '''upload changed templates concurrently
+
+    Args:
+        types (list): stack types to upload, for example ['vpc', 'sg']
+        bucket (String): s3 bucket
+        max_workers (int): number of concurrent uploads
+
+    Returns:
+        dict of stack type to s3 key, only for templates that were uploaded
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    from cfn_template import template_path
+
+    log = logging.getLogger(__file__)
+    log.debug('BEGIN upload_templates')
+    digests = dict((x, template_digest(template_path(x))) for x in types)
+
+    client = aws_clients.client('s3')
+    keys = existing_keys(client, bucket)
+    changed = dict((x, template_key(x, digests[x])) for x in types if template_key(x, digests[x]) not in keys)
+    log.info('unchanged templates: {0}'.format(sorted(set(types) - set(changed))))
+
+    def upload(type_of_stack):
+        log.info('uploading {0} to s3://{1}/{2}'.format(type_of_stack, bucket, changed[type_of_stack]))
+        with open(template_path(type_of_stack), 'rb') as body:
+            client.put_object(Bucket=bucket, Key=changed[type_of_stack], Body=body,
+                              ServerSideEncryption='AES256')
+
+    if changed:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # list() re-raises the first upload error
+            list(executor.map(upload, sorted(changed)))
+
+    log.debug('END upload_templates')
+    return changed
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    parser = argparse.ArgumentParser(description='upload changed cloudformation templates to s3')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('-t', '--types',
+                        help='comma separated stack types, default is every template')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='number of concurrent uploads')
+    args = parser.parse_args()
+
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+
+    if 'S3BUCKET' not in os.environ:
+        raise ValueError('missing enviornment variables: {0}'.format(['S3BUCKET']))
+
+    from cfn_template import template_types
+    types = [x.strip() for x in args.types.split(',') if x.strip()] if args.types else template_types()
+    changed = upload_templates(types, os.environ['S3BUCKET'], max_workers=args.jobs)
+    log.info('uploaded {0} of {1} templates'.format(len(changed), len(types)))
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
@@ -1,4 +1,5 @@
 #!/bin/bash
 set -u
 set -e
-aws cloudformation validate-template --template-body file:///Users/mike/Documents/code/cloudformation/$1
+# offline, validates every template and etc config when no template is given
+./validate_templates.py "$@"
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+'''validate_templates.py
+
+validate every cloudformation template in this directory offline,
+in one process and with no aws calls
+
+builds an index of each template's Parameters, Resources, Conditions,
+Outputs and Exports, then checks that
+    * every !Ref names a parameter, resource or pseudo parameter
+    * every !GetAtt and ${} variable in !Sub names a resource or parameter
+    * every !ImportValue is exported by a template in this directory
+    * every condition used by !If or a Condition key is declared
+    * every DependsOn names a resource
+    * every key in etc/{type}_cfg.yaml is a parameter of {type}.yaml
+
+fast enough to run on every commit, for example as .git/hooks/pre-commit
+    #!/bin/sh
+    exec ./validate_templates.py
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ validate_templates.py [-v] [--index] [vpc.yaml sg.yaml]
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+from os.path import abspath, basename, dirname, isfile, join, splitext
+
+import yaml
+
+from cfn_api import RESERVED_KEYS
+from cfn_template import (TEMPLATE_DIR, find_intrinsics, load_template, template_exports,
+                          template_imports, template_path, template_types)
+
+ETC_DIR = join(dirname(abspath(__file__)), 'etc')
+SUB_VARIABLE = re.compile(r'\$\{([^!][^}]*)\}')
+MUSTACHE = re.compile(r'\{\{[^}]*\}\}')
+
+
+def index_template(path):
+    '''parse a template and index its sections
+
+    Returns:
+        dict with template, parameters, resources, conditions, outputs, exports, imports
+    '''
+    template = load_template(path) or {}
+    return {
+        'template': template,
+        'parameters': sorted(template.get('Parameters') or {}),
+        'resources': sorted(template.get('Resources') or {}),
+        'conditions': sorted(template.get('Conditions') or {}),
+        'outputs': sorted(template.get('Outputs') or {}),
+        'exports': sorted(template_exports(template)),
+        'imports': sorted(template_imports(template)),
+    }
+
+
+def check_template(name, index, all_exports):
+    '''errors in one indexed template
+
+    Args:
+        name (String): template file name for messages
+        index (dict): result of index_template
+        all_exports (set): export names of every template
+
+    Returns:
+        list of error Strings
+    '''
+    errors = []
+    template = index['template']
+    parameters = set(index['parameters'])
+    resources = set(index['resources'])
+    conditions = set(index['conditions'])
+    referable = parameters | resources
+
+    def known(ref):
+        return ref in referable or ref.startswith('AWS::')
+
+    if not resources:
+        errors.append('{0}: no Resources'.format(name))
+
+    for ref in find_intrinsics(template, 'Ref'):
+        if not isinstance(ref, str) or not known(ref):
+            errors.append('{0}: !Ref {1} is not a parameter or resource'.format(name, ref))
+
+    for att in find_intrinsics(template, 'Fn::GetAtt'):
+        if not isinstance(att, list) or len(att) != 2 or att[0] not in resources:
+            errors.append('{0}: !GetAtt {1} is not a resource attribute'.format(name, att))
+
+    for sub in find_intrinsics(template, 'Fn::Sub'):
+        local = set()
+        if isinstance(sub, list):
+            local = set(sub[1]) if len(sub) > 1 and isinstance(sub[1], dict) else set()
+            sub = sub[0]
+        if not isinstance(sub, str):
+            continue
+        for variable in SUB_VARIABLE.findall(sub):
+            ref = variable.split('.', 1)[0]
+            if ref not in local and not known(ref):
+                errors.append('{0}: !Sub variable ${{{1}}} is not a parameter or resource'.format(name, variable))
+
+    for imported in index['imports']:
+        if imported not in all_exports:
+            errors.append('{0}: !ImportValue {1} is not exported by any template'.format(name, imported))
+
+    used_conditions = [x[0] for x in find_intrinsics(template, 'Fn::If') if isinstance(x, list) and x]
+    for section in ('Resources', 'Outputs'):
+        used_conditions.extend(
+            x['Condition'] for x in (template.get(section) or {}).values()
+            if isinstance(x, dict) and 'Condition' in x
+        )
+    for condition in used_conditions:
+        if condition not in conditions:
+            errors.append('{0}: condition {1} is not declared'.format(name, condition))
+
+    for resource_name, resource in (template.get('Resources') or {}).items():
+        depends = resource.get('DependsOn', []) if isinstance(resource, dict) else []
+        for dependency in [depends] if isinstance(depends, str) else depends:
+            if dependency not in resources:
+                errors.append('{0}: {1} DependsOn {2} is not a resource'.format(name, resource_name, dependency))
+
+    return errors
+
+
+def check_config(config_file, indexes):
+    '''errors in an etc/{type}_cfg.yaml file
+
+    mustache tags are replaced with a placeholder, only the keys matter
+
+    Returns:
+        list of error Strings
+    '''
+    name = basename(config_file)
+    type_of_stack = name[:-len('_cfg.yaml')]
+    if type_of_stack not in indexes:
+        logging.getLogger(__file__).warning('{0}: no template {1}.yaml, not checked'.format(name, type_of_stack))
+        return []
+    with open(config_file) as f:
+        config = yaml.safe_load(MUSTACHE.sub('x', f.read())) or {}
+    parameters = set(indexes[type_of_stack]['parameters'])
+    return ['{0}: {1} is not a parameter of {2}.yaml'.format(name, key, type_of_stack)
+            for key in sorted(config) if key not in parameters and key not in RESERVED_KEYS]
+
+
+def validate(types=None):
+    '''validate templates and their config files
+
+    Args:
+        types (list): stack types to check, defaults to every template.
+            Imports are always resolved against every template.
+
+    Returns:
+        (indexes, errors) dict of stack type to index, list of error Strings
+    '''
+    indexes = {}
+    errors = []
+    for type_of_stack in template_types():
+        try:
+            indexes[type_of_stack] = index_template(template_path(type_of_stack))
+        except yaml.YAMLError as err:
+            errors.append('{0}.yaml: {1}'.format(type_of_stack, err))
+
+    all_exports = set()
+    for index in indexes.values():
+        all_exports.update(index['exports'])
+
+    for type_of_stack in sorted(types or indexes):
+        if type_of_stack in indexes:
+            errors.extend(check_template('{0}.yaml'.format(type_of_stack), indexes[type_of_stack], all_exports))
+        config_file = join(ETC_DIR, '{0}_cfg.yaml'.format(type_of_stack))
+        if isfile(config_file):
+            errors.extend(check_config(config_file, indexes))
+    return indexes, errors
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.debug('python version is: {0}'.format(platform.python_version()))
+
+    parser = argparse.ArgumentParser(description='validate cloudformation templates offline')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('--index', action='store_true',
+                        help='print the index of every template as json')
+    parser.add_argument('templates', nargs='*',
+                        help='templates to check, for example vpc.yaml, default is every template')
+    args = parser.parse_args()
+
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+
+    start = time.time()
+    types = [splitext(basename(x))[0] for x in args.templates]
+    for type_of_stack in types:
+        if not isfile(template_path(type_of_stack)):
+            raise ValueError('no template {0}.yaml in {1}'.format(type_of_stack, TEMPLATE_DIR))
+    indexes, errors = validate(types)
+
+    if args.index:
+        print(json.dumps(dict((k, dict((x, y) for x, y in v.items() if x != 'template'))
+                              for k, v in indexes.items()), indent=2, sort_keys=True))
+    for error in errors:
+        log.error(error)
+    log.info('validated {0} templates in {1:.0f} ms, {2} errors'.format(
+        len(types or indexes), (time.time() - start) * 1000, len(errors)))
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise
@@ -1,2 +1,2 @@
 #!/bin/bash
-aws cloudformation describe-stack-events --stack-name mwest-${AWS_DEFAULT_PROFILE}-vpc
+./stack_events.py --stacks ${OWNER}-${AWS_DEFAULT_PROFILE}-vpc
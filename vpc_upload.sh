@@ -1,2 +1,2 @@
 #!/bin/bash
-aws s3 cp vpc.yaml s3://${S3BUCKET}/cloudformation/vpc.yaml --sse AES256
+./upload_templates.py --types vpc
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+'''wait until stacks and their resources are usable, all at once
+
+one thread per stack type waits, in order, for
+    1. the stack to reach a final status
+    2. the resource itself
+        * rs    redshift cluster available
+        * ar    aurora cluster and every instance available
+        * ec2   bastion instance and system status ok
+    3. a tcp connect to the endpoint, always for the bastion ssh port,
+       for the databases only with --probe-endpoints as they are private
+
+polls start every 2 seconds and back off exponentially with jitter to 30
+seconds, each resource returns as soon as it is usable.  The first failure
+is raised at once and stops the other waiters.  Stacks that do not exist
+are skipped.  The boto
+cluster_available waiter polls once a minute, which adds up to 59 seconds
+of dead time per resource.
+
+Example:
+    call as script with optional -v argument
+    -v will enable debug mode for verbose output
+
+      $ python wait_ready.py [-vv] [--types rs,ar,ec2] [--timeout 1800] [--probe-endpoints]
+
+'''
+import sys
+import time
+import random
+import socket
+import logging
+import argparse
+import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cfn_outputs import stack_prefix
+
+
+class NotReady(Exception):
+    '''raised when a resource did not become usable before the timeout'''
+
+
+def poll_until(check, timeout, description, delay=2.0, max_delay=30.0, stop=None):
+    '''call check until it returns a true value
+
+    sleeps grow exponentially with full jitter between delay and max_delay
+
+    Args:
+        check (callable): returns a true value when ready
+        timeout (float): seconds before giving up
+        description (String): used in log and error messages
+        stop (threading.Event): gives up early, raising NotReady, once set
+
+    Returns:
+        the true value returned by check
+    '''
+    log = logging.getLogger(__file__)
+    deadline = time.time() + timeout
+    current = delay
+    stop = stop or threading.Event()
+    while True:
+        if stop.is_set():
+            raise NotReady('{0} stopped waiting'.format(description))
+        result = check()
+        if result:
+            return result
+        if time.time() >= deadline:
+            raise NotReady('{0} not ready after {1:.0f}s'.format(description, timeout))
+        sleep = min(random.uniform(delay, current), max(deadline - time.time(), 0))
+        log.debug('{0} not ready, checking again in {1:.1f}s'.format(description, sleep))
+        stop.wait(sleep)
+        current = min(current * 2, max_delay)
+
+
+def tcp_ready(host, port, timeout=3.0):
+    '''True if host accepts a tcp connection on port'''
+    try:
+        socket.create_connection((host, port), timeout=timeout).close()
+        return True
+    except (socket.error, socket.timeout):
+        return False
+
+
+# *_COMPLETE statuses of stacks that are not usable
+UNUSABLE_STATUSES = ('ROLLBACK_COMPLETE', 'DELETE_COMPLETE')
+
+
+def stack_final(client, stack_name):
+    '''final status of a stack, None while in progress
+
+    every *_COMPLETE status is usable, UPDATE_ROLLBACK_COMPLETE and
+    IMPORT_COMPLETE included, except a rolled back create or a delete
+    '''
+    status = client.describe_stacks(StackName=stack_name)['Stacks'][0]['StackStatus']
+    if status.endswith('_IN_PROGRESS'):
+        return None
+    if not status.endswith('_COMPLETE') or status in UNUSABLE_STATUSES:
+        raise NotReady('{0} ended with status {1}'.format(stack_name, status))
+    return status
+
+
+def physical_id(client, stack_name, logical_id):
+    '''physical id of a resource of a stack'''
+    response = client.describe_stack_resource(StackName=stack_name, LogicalResourceId=logical_id)
+    return response['StackResourceDetail']['PhysicalResourceId']
+
+
+def redshift_ready(redshift, cluster_id):
+    '''(address, port) once the redshift cluster is available'''
+    cluster = redshift.describe_clusters(ClusterIdentifier=cluster_id)['Clusters'][0]
+    if cluster['ClusterStatus'] == 'deleting':
+        raise NotReady('redshift {0} is deleting'.format(cluster_id))
+    if cluster['ClusterStatus'] != 'available' or 'Endpoint' not in cluster:
+        return None
+    return cluster['Endpoint']['Address'], cluster['Endpoint']['Port']
+
+
+def aurora_ready(rds, cluster_id):
+    '''(address, port) once the aurora cluster and every instance are available'''
+    cluster = rds.describe_db_clusters(DBClusterIdentifier=cluster_id)['DBClusters'][0]
+    if cluster['Status'] != 'available':
+        return None
+    instances = rds.describe_db_instances(Filters=[{'Name': 'db-cluster-id', 'Values': [cluster_id]}])
+    if not instances['DBInstances'] or any(x['DBInstanceStatus'] != 'available' for x in instances['DBInstances']):
+        return None
+    return cluster['Endpoint'], cluster['Port']
+
+
+def bastion_ready(ec2, instance_id):
+    '''(public ip, 22) once instance and system status checks pass'''
+    statuses = ec2.describe_instance_status(InstanceIds=[instance_id])['InstanceStatuses']
+    if not statuses:
+        return None
+    status = statuses[0]
+    if status['InstanceStatus']['Status'] != 'ok' or status['SystemStatus']['Status'] != 'ok':
+        return None
+    instance = ec2.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
+    return instance['PublicIpAddress'], 22
+
+
+# logical id of the resource to wait for and the check for it, by stack type
+RESOURCES = {
+    'rs': ('Redshift', 'redshift', redshift_ready, False),
+    'ar': ('AuroraCluster', 'rds', aurora_ready, False),
+    'ec2': ('Bastion', 'ec2', bastion_ready, True),
+}
+
+
+def wait_for(type_of_stack, prefix, clients, timeout, probe_endpoints=False, stop=None):
+    '''wait for the stack, the resource and the endpoint of one stack type
+
+    Returns:
+        (host, port) of the usable endpoint, None if the stack does not exist
+    '''
+    from botocore.exceptions import ClientError
+
+    log = logging.getLogger(__file__)
+    start = time.time()
+    stack_name = '{0}-{1}'.format(prefix, type_of_stack)
+    logical_id, service, check, always_probe = RESOURCES[type_of_stack]
+
+    def remaining():
+        return max(timeout - (time.time() - start), 0)
+
+    try:
+        poll_until(lambda: stack_final(clients['cloudformation'], stack_name), remaining(), stack_name, stop=stop)
+    except ClientError as err:
+        if 'does not exist' not in str(err):
+            raise
+        log.info('{0} does not exist, skipping'.format(stack_name))
+        return None
+    resource_id = physical_id(clients['cloudformation'], stack_name, logical_id)
+    endpoint = poll_until(lambda: check(clients[service], resource_id), remaining(),
+                          '{0} {1}'.format(type_of_stack, resource_id), stop=stop)
+    if always_probe or probe_endpoints:
+        poll_until(lambda: tcp_ready(*endpoint), remaining(), '{0}:{1}'.format(*endpoint), stop=stop)
+    log.info('{0} ready in {1:.0f}s at {2}:{3}'.format(type_of_stack, time.time() - start, *endpoint))
+    return endpoint
+
+
+def wait_all(types, prefix=None, timeout=1800, probe_endpoints=False):
+    '''wait for several stack types concurrently
+
+    the first failure is raised as soon as it happens, the other waiters
+    stop at their next poll instead of running to their timeout
+
+    Returns:
+        dict of stack type to (host, port) for the stacks that exist,
+        raises NotReady for the first failure
+    '''
+    import aws_clients
+
+    if not types:
+        return {}
+    prefix = prefix or stack_prefix()
+    # shared clients are thread safe, see aws_clients.py
+    clients = dict((x, aws_clients.client(x)) for x in ['cloudformation', 'redshift', 'rds', 'ec2'])
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(types))
+    try:
+        futures = dict((executor.submit(wait_for, x, prefix, clients, timeout, probe_endpoints, stop), x)
+                       for x in types)
+        endpoints = {}
+        for future in as_completed(futures):
+            endpoint = future.result()
+            if endpoint is not None:
+                endpoints[futures[future]] = endpoint
+        return endpoints
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+
+def main():
+    '''entry function runs when script is executed.'''
+    log = logging.getLogger(__file__)
+    log.info('python version is: {0}'.format(platform.python_version()))
+
+    # parse command line arguments
+    parser = argparse.ArgumentParser(description='wait until stacks and their resources are usable')
+    # count the number of verbose options
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase output detail')
+    parser.add_argument('-t', '--types', default='ec2,rs,ar',
+                        help='comma separated stack types from {0}'.format(sorted(RESOURCES)))
+    parser.add_argument('--timeout', type=float, default=1800,
+                        help='seconds to wait for each resource')
+    parser.add_argument('--probe-endpoints', action='store_true',
+                        help='also tcp connect to database endpoints, needs network access to them')
+
+    args = parser.parse_args()
+    # set loglevel to DEBUG if verbose
+    if args.verbose >= 2:
+        log.info('setting loglevel to DEBUG globally')
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        log.info('setting loglevel to DEBUG locally')
+        logging.getLogger(__file__).setLevel(logging.DEBUG)
+
+    log.debug('system version is: {0}'.format(sys.version))
+    log.debug('python path is: {0}'.format(sys.path))
+
+    types = [x.strip() for x in args.types.split(',') if x.strip()]
+    unknown = [x for x in types if x not in RESOURCES]
+    if unknown:
+        raise ValueError('no readiness check for: {0}'.format(unknown))
+    wait_all(types, timeout=args.timeout, probe_endpoints=args.probe_endpoints)
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.INFO)
+        log = logging.getLogger(__file__)
+        main()
+    except Exception:
+        log.exception('FAILED: script {0})'.format(__file__))
+        raise